@@ -1,9 +1,110 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Max, Min, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .archival import archive_products
+from .inventory import release
 from .models import User, Category, Product, Cart, Wishlist, Order, OrderItem
 
 
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset``, or None where there is none."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts exactly only when the planner expects a small result.
+
+    Past ADMIN_EXACT_COUNT_LIMIT rows the changelist shows the estimate, so
+    the last page links may land on an empty page.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < settings.ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+
+class DateRangeQuerySet(QuerySet):
+    """Year and month ``datetimes()`` from MIN/MAX instead of a DISTINCT over every row.
+
+    The admin date hierarchy lists its years and months this way, so it
+    stays an index lookup; months without rows are listed too.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = (timezone.localtime(bounds[key], tzinfo) for key in ('first', 'last'))
+        months = []
+        year, month = first.year, first.month if kind == 'month' else 1
+        while (year, month) <= (last.year, last.month):
+            months.append(first.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0))
+            if kind == 'year':
+                year += 1
+            else:
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return months if order == 'ASC' else months[::-1]
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the extra COUNT(*) of the unfiltered table and the per-choice
+    # facet counts.
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+
+class InputFilter(admin.SimpleListFilter):
+    """A text box instead of a link per value, for columns with too many values to list."""
+    template = 'admin/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        # Never shown; SimpleListFilter only renders when there are lookups.
+        return [('', '')]
+
+    def choices(self, changelist):
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'placeholder': self.placeholder,
+            'params': [
+                (name, value) for name, value in changelist.get_filters_params().items()
+                if name != self.parameter_name
+            ],
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class UserEmailFilter(InputFilter):
+    title = 'user'
+    parameter_name = 'user_email'
+    placeholder = 'Email address'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(user__in=User.objects.filter(email=self.value().strip()).values('pk'))
+        return queryset
+
+
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdmin):
     list_display = ('email', 'name', 'role', 'is_staff', 'is_active')
     list_filter = ('role', 'is_staff', 'is_active')
     search_fields = ('email', 'name')
@@ -17,29 +118,87 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'price', 'brand', 'category', 'active')
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'price', 'brand', 'category', 'active', 'archived_at')
     list_filter = ('category', 'active')
+    list_select_related = ('category',)
     search_fields = ('name', 'brand', 'description')
+    readonly_fields = ('archived_at',)
+
+    # Deleting archives the product, see api.archival. Skip collecting the
+    # cascade for the confirmation page since nothing else is deleted.
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        return [str(obj) for obj in objs], {Product._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def delete_model(self, request, obj):
+        archive_products([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        archive_products(list(queryset.values_list('pk', flat=True)))
+
+    def save_model(self, request, obj, form, change):
+        # Re-activating an archived product restores it.
+        if obj.active:
+            obj.archived_at = None
+        super().save_model(request, obj, form, change)
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ('id', 'user', 'product', 'quantity')
-    list_filter = ('user',)
+    list_filter = (UserEmailFilter,)
+    list_select_related = ('user', 'product')
+    autocomplete_fields = ('user', 'product')
 
 @admin.register(Wishlist)
-class WishlistAdmin(admin.ModelAdmin):
+class WishlistAdmin(LargeTableAdmin):
     list_display = ('id', 'user', 'product')
-    list_filter = ('user',)
+    list_filter = (UserEmailFilter,)
+    list_select_related = ('user', 'product')
+    autocomplete_fields = ('user', 'product')
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ('id', 'user', 'total', 'status', 'created_at')
-    list_filter = ('status', 'created_at')
+    list_filter = ('status', UserEmailFilter)
+    list_select_related = ('user',)
+    date_hierarchy = 'created_at'
     search_fields = ('user__email',)
+    search_help_text = 'Order id or exact customer email'
+    autocomplete_fields = ('user',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DateRangeQuerySet(self.model, query=queryset.query, using=queryset._db)
+
+    def get_search_results(self, request, queryset, search_term):
+        # An id or an email, both answered from an index rather than a
+        # substring scan of the join.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return queryset.filter(user__in=User.objects.filter(email=term).values('pk')), False
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Order.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # The delete cascades to the stock reservations; put the units they
+        # still hold back first, as the admin API does.
+        with transaction.atomic():
+            ids = list(queryset.select_for_update(of=('self',)).values_list('pk', flat=True))
+            release(ids)
+            Order.objects.filter(pk__in=ids).delete()
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ('id', 'order', 'product', 'quantity', 'price')
-    search_fields = ('product__name',)
+    list_select_related = ('order', 'product')
+    # The snapshot column avoids the join to Product; the prefix search is
+    # served by orderitem_product_name_prefix_idx on PostgreSQL.
+    search_fields = ('^product_name',)
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('product',)
@@ -5,5 +5,9 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
 
+    def ready(self):
+        # Connects the catalog change-sequence, revenue cache and image upload signal receivers.
+        from . import catalog, reports, uploads  # noqa: F401
+
 
 
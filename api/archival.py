@@ -0,0 +1,56 @@
+"""Product deletion as archiving.
+
+Deleting a product used to cascade through carts, wishlists, order items
+and everything else pointing at it in one transaction. Archiving is a
+single UPDATE of the product rows instead: they become inactive, so every
+``active`` filter hides them, and order history keeps its product links.
+Delta syncs see archived products as deleted, through a CatalogTombstone
+taken with the same change number.
+Cart and wishlist rows left pointing at archived products are removed
+later, in small batches, by ``purge_archived_rows``.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import bump_catalog_version, next_change_seq
+from .membership import invalidate_membership
+from .models import Cart, CatalogTombstone, Product, Wishlist
+
+
+def archive_products(product_ids):
+    """Archive the given products. Returns how many were not archived already."""
+    with transaction.atomic():
+        # Taking the change number locks out every other catalog write.
+        seq = next_change_seq()
+        archived = list(
+            Product.objects.filter(pk__in=product_ids, archived_at__isnull=True).values_list('pk', flat=True)
+        )
+        if archived:
+            Product.objects.filter(pk__in=archived).update(active=False, archived_at=timezone.now(), change_seq=seq)
+            CatalogTombstone.objects.bulk_create([
+                CatalogTombstone(kind='product', object_id=pk, change_seq=seq) for pk in archived
+            ])
+    if archived:
+        transaction.on_commit(bump_catalog_version)
+    return len(archived)
+
+
+def purge_archived_rows(model, batch_size=1000):
+    """Delete one batch of ``model`` (Cart or Wishlist) rows of archived products.
+
+    Returns the number of rows deleted.
+    """
+    with transaction.atomic():
+        rows = list(
+            model.objects.filter(product__archived_at__isnull=False)
+            .order_by('pk').values_list('pk', 'user_id')[:batch_size]
+        )
+        if not rows:
+            return 0
+        model.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+        for user_id in {user_id for _, user_id in rows}:
+            invalidate_membership(user_id)
+    return len(rows)
+
+
+PURGED_MODELS = [Cart, Wishlist]
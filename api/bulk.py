@@ -0,0 +1,152 @@
+"""Set-based admin updates of many orders, products or users.
+
+A bulk request names its rows with ``ids`` or with a ``filter`` object
+holding the same parameters as the matching list endpoint, and gives the
+target state explicitly. The matched rows are locked in id order, the
+ones not already in the target state are changed with one UPDATE, and
+side effects run once for the whole batch: sales counters, stock, status
+events and their notifications for orders, one catalog version bump for
+products. Everything happens in one transaction, so a failure changes
+nothing.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .catalog import bump_catalog_version, next_change_seq
+from .events import record_status_changes
+from .inventory import settle
+from .models import Order, Product, User
+from .popularity import record_sales, sales_sign
+from .reports import filter_orders
+
+
+ORDER_FILTERS = ('status', 'date_from', 'date_to', 'email', 'min_total', 'max_total')
+PRODUCT_FILTERS = ('category', 'brand', 'active')
+USER_FILTERS = ('is_active', 'email')
+
+
+def _typed(params, name, kind, label):
+    value = params[name]
+    if not isinstance(value, kind) or isinstance(value, bool) != (kind is bool):
+        raise ValueError(f"{name} must be {label}")
+    return value
+
+
+def filter_products(queryset, params):
+    if 'category' in params:
+        queryset = queryset.filter(category_id=_typed(params, 'category', int, 'a category id'))
+    if 'brand' in params:
+        queryset = queryset.filter(brand=_typed(params, 'brand', str, 'a string'))
+    if 'active' in params:
+        queryset = queryset.filter(active=_typed(params, 'active', bool, 'true or false'))
+    return queryset
+
+
+def filter_order_params(queryset, params):
+    for name in params:
+        _typed(params, name, str, 'a string')
+    return filter_orders(queryset, params)
+
+
+def filter_users(queryset, params):
+    if 'is_active' in params:
+        queryset = queryset.filter(is_active=_typed(params, 'is_active', bool, 'true or false'))
+    if 'email' in params:
+        queryset = queryset.filter(email=_typed(params, 'email', str, 'a string').strip())
+    return queryset
+
+
+def targets(queryset, data, apply_filter, allowed):
+    """``(queryset, requested ids or None)`` for the rows a bulk request names.
+
+    Raises ValueError on bad input. Unknown filter keys are rejected rather
+    than ignored, so a typo cannot widen the update to every row.
+    """
+    ids, params = data.get('ids'), data.get('filter')
+    if (ids is None) == (params is None):
+        raise ValueError("Give either ids or filter")
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(
+            isinstance(pk, int) and not isinstance(pk, bool) for pk in ids
+        ):
+            raise ValueError("ids must be a non-empty list of integers")
+        if len(ids) > settings.ADMIN_BULK_MAX_ROWS:
+            raise ValueError(f"At most {settings.ADMIN_BULK_MAX_ROWS} ids per request")
+        return queryset.filter(pk__in=ids), ids
+    if not isinstance(params, dict) or not params:
+        raise ValueError("filter must be a non-empty object")
+    unknown = set(params) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown filter: {', '.join(sorted(unknown))}; use {', '.join(allowed)}")
+    return apply_filter(queryset, params), None
+
+
+def _lock(queryset):
+    """Lock and return the rows of ``queryset`` in id order, refusing oversized batches."""
+    limit = settings.ADMIN_BULK_MAX_ROWS
+    # Filters may join other tables; only the updated rows are locked.
+    rows = list(queryset.select_for_update(of=('self',)).order_by('pk')[:limit + 1])
+    if len(rows) > limit:
+        raise ValueError(f"Matches more than {limit} rows; narrow the filter")
+    return rows
+
+
+def set_order_status(queryset, new_status):
+    """Move the matched orders to ``new_status``. Returns ``(matched ids, updated)``.
+
+    Refuses the whole batch if it would move an order out of a final status.
+    """
+    if new_status not in dict(Order.STATUS_CHOICES):
+        raise ValueError("Invalid status")
+    with transaction.atomic():
+        orders = _lock(queryset.only('id', 'status', 'user_id', 'created_at'))
+        changed = [order for order in orders if order.status != new_status]
+        final = [str(order.pk) for order in changed if order.status in Order.FINAL_STATUSES]
+        if final:
+            raise ValueError(f"Orders {', '.join(final)} are in a final status and cannot change it")
+        by_sign = defaultdict(list)
+        for order in changed:
+            by_sign[sales_sign(order.status, new_status)].append(order)
+            order.status = new_status
+        if changed:
+            Order.objects.filter(pk__in=[order.pk for order in changed]).update(status=new_status)
+            for sign, group in by_sign.items():
+                record_sales(group, sign)
+            settle(changed)
+            record_status_changes(changed)
+    return [order.pk for order in orders], len(changed)
+
+
+def set_products_active(queryset, active):
+    """Activate or deactivate the matched products that are not archived."""
+    if not isinstance(active, bool):
+        raise ValueError("active must be true or false")
+    with transaction.atomic():
+        products = _lock(queryset.filter(archived_at__isnull=True).only('id', 'active'))
+        changed = [product.pk for product in products if product.active != active]
+        if changed:
+            Product.objects.filter(pk__in=changed).update(active=active, change_seq=next_change_seq())
+    if changed:
+        transaction.on_commit(bump_catalog_version)
+    return [product.pk for product in products], len(changed)
+
+
+def set_users_active(queryset, is_active):
+    """Block (``is_active=False``) or unblock the matched users."""
+    if not isinstance(is_active, bool):
+        raise ValueError("is_active must be true or false")
+    with transaction.atomic():
+        users = _lock(queryset.only('id', 'is_active'))
+        changed = [user.pk for user in users if user.is_active != is_active]
+        if changed:
+            User.objects.filter(pk__in=changed).update(is_active=is_active)
+    return [user.pk for user in users], len(changed)
+
+
+def summary(requested_ids, matched_ids, updated):
+    result = {'matched': len(matched_ids), 'updated': updated}
+    if requested_ids is not None:
+        result['not_found'] = sorted(set(requested_ids) - set(matched_ids))
+    return result
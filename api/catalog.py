@@ -0,0 +1,129 @@
+"""Catalog cache version and the change sequence behind delta sync.
+
+Every write to a product or category takes the next value of a single
+counter row and stamps it on the row (or on a tombstone for deletes) in
+the same transaction. Archiving a product also counts as a delete; a
+product restored later comes back with a newer change number. The counter
+row stays locked until that commit, so
+once a value is visible every change numbered at or below it is too, and
+``since < change_seq <= token`` never skips a change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from dessertshop_backend.cache import invalidate_tags
+from dessertshop_backend.db_router import primary
+
+from .fastpath import CATEGORY_PLAN, PRODUCT_PLAN
+from .models import CatalogTombstone, Category, JobCheckpoint, Product
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Tiered cache tag of everything derived from products and categories.
+CATALOG_TAG = 'catalog'
+CHANGE_SEQ = 'catalog.change_seq'
+DELETED_KEYS = {'category': 'categories', 'product': 'products'}
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every cache entry keyed on the catalog version or tagged with it."""
+    invalidate_tags(CATALOG_TAG)
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 2, None)
+        return 2
+
+
+def next_change_seq():
+    """Take the next catalog change number. Call inside the writing transaction."""
+    JobCheckpoint.objects.get_or_create(name=CHANGE_SEQ)
+    JobCheckpoint.objects.filter(name=CHANGE_SEQ).update(value=F('value') + 1)
+    return JobCheckpoint.objects.filter(name=CHANGE_SEQ).values_list('value', flat=True).get()
+
+
+def current_change_seq():
+    return JobCheckpoint.objects.filter(name=CHANGE_SEQ).values_list('value', flat=True).first() or 0
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+def _stamp_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    with transaction.atomic():
+        instance.change_seq = next_change_seq()
+        sender.objects.filter(pk=instance.pk).update(change_seq=instance.change_seq)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def _record_tombstone(sender, instance, **kwargs):
+    if getattr(instance, 'archived_at', None) is not None:
+        # Purging an archived product; its tombstone was taken when it was archived.
+        return
+    with transaction.atomic():
+        CatalogTombstone.objects.create(
+            kind=sender._meta.model_name, object_id=instance.pk, change_seq=next_change_seq(),
+        )
+    transaction.on_commit(bump_catalog_version)
+
+
+def _page_end(queryset, since, token, limit):
+    """The highest change number that keeps ``queryset``'s page within ``limit`` rows."""
+    last = list(
+        queryset.filter(change_seq__gt=since, change_seq__lte=token)
+        .order_by('change_seq').values_list('change_seq', flat=True)[limit - 1:limit]
+    )
+    return last[0] if last else token
+
+
+@primary()
+def catalog_changes(since, request, limit=None):
+    """Products, categories and deletions changed after ``since``, with the next token.
+
+    Reads the primary: a token from one database and rows from another
+    could skip changes for good.
+    """
+    limit = limit or settings.CATALOG_CHANGES_PAGE_SIZE
+    token = current_change_seq()
+    changes = {
+        'token': str(max(token, since)),
+        'has_more': False,
+        'categories': [],
+        'products': [],
+        'deleted': {'categories': [], 'products': []},
+    }
+    if since >= token:
+        return changes
+
+    products = Product.objects.filter(archived_at__isnull=True)
+    sources = [Category.objects.all(), products, CatalogTombstone.objects.all()]
+    end = min(_page_end(queryset, since, token, limit) for queryset in sources)
+    window = {'change_seq__gt': since, 'change_seq__lte': end}
+
+    changes['token'] = str(end)
+    changes['has_more'] = end < token
+    changes['categories'] = CATEGORY_PLAN.serialize(
+        Category.objects.filter(**window).order_by('change_seq', 'id'), request
+    )
+    changes['products'] = PRODUCT_PLAN.serialize(products.filter(**window).order_by('change_seq', 'id'), request)
+    # A product archived and then restored within the page is only an update.
+    restored = {product['id'] for product in changes['products']}
+    for kind, object_id in CatalogTombstone.objects.filter(**window).order_by('change_seq').values_list('kind', 'object_id'):
+        if kind != 'product' or object_id not in restored:
+            changes['deleted'][DELETED_KEYS[kind]].append(object_id)
+    return changes
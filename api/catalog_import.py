@@ -0,0 +1,254 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import transaction
+
+from .catalog import bump_catalog_version, next_change_seq
+from .models import Category, Product
+
+
+PRODUCT_FIELDS = ['name', 'price', 'description', 'brand', 'category', 'active', 'image']
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.categories_created = 0
+        self.images_stored = 0
+        self.errors = []
+
+    def add_error(self, row, message):
+        self.errors.append({'row': row, 'error': message})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'categories_created': self.categories_created,
+            'images_stored': self.images_stored,
+            'errors': self.errors,
+        }
+
+
+def read_rows(fileobj, fmt):
+    """Return the rows of a CSV or JSON catalog file as a list of dicts."""
+    data = fileobj.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if fmt == 'json':
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError("JSON catalog must be a list of objects")
+        return rows
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(data)))
+    raise ValueError(f"Unsupported catalog format: {fmt}")
+
+
+def guess_format(filename):
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return ext if ext in ('csv', 'json') else None
+
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def _clean_row(row):
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+    name = _text(row, 'name')
+    brand = _text(row, 'brand')
+    category = _text(row, 'category')
+    if not name or not brand or not category:
+        raise ValueError("name, brand and category are required")
+    try:
+        price = Decimal(_text(row, 'price')).quantize(Decimal('0.01'))
+        valid = price.is_finite() and price >= 0 and len(price.as_tuple().digits) <= 8
+    except ArithmeticError:
+        valid = False
+    if not valid:
+        raise ValueError("Invalid price")
+    active = row.get('active', True)
+    if isinstance(active, str):
+        active = active.strip().lower() in TRUE_VALUES if active.strip() else True
+    return {
+        'name': name[:100],
+        'brand': brand[:100],
+        'category': category[:100],
+        'price': price,
+        'description': _text(row, 'description'),
+        'active': bool(active),
+        'image': _text(row, 'image'),
+    }
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def store_image(archive_path, member, upload_to='products/'):
+    """Validate one archive member and write it to the default storage.
+
+    Runs inside a worker process, so it only returns plain values:
+    ``(member, stored name, error, whether the file is new)``.
+    """
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from PIL import Image
+
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            content = archive.read(member)
+        Image.open(io.BytesIO(content)).verify()
+    except KeyError:
+        return member, None, "Image not found in archive", False
+    except Exception as e:
+        return member, None, f"Invalid image: {e}", False
+    content = ContentFile(content)
+    name = upload_to + os.path.basename(member)
+    created = not default_storage.exists(default_storage.hashed_name(name, content))
+    name = default_storage.save(name, content)
+    return member, name, None, created
+
+
+def store_images(archive_path, members, workers=None):
+    """Store archive images, in parallel unless ``workers`` is 1.
+
+    Returns ``({member: name}, {member: error}, names of files written for this import)``.
+    """
+    stored, failed, created = {}, {}, set()
+    members = sorted(members)
+    if not members:
+        return stored, failed, created
+    if workers == 1 or len(members) == 1:
+        results = (store_image(archive_path, m) for m in members)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            results = list(pool.map(store_image, [archive_path] * len(members), members, chunksize=8))
+    for member, name, error, new in results:
+        (failed if error else stored)[member] = error or name
+        if new:
+            created.add(name)
+    return stored, failed, created
+
+
+def discard_images(names):
+    """Delete files written by a failed import that no product ended up using."""
+    from django.core.files.storage import default_storage
+
+    used = set(Product.objects.filter(image__in=names).values_list('image', flat=True))
+    for name in set(names) - used:
+        default_storage.delete(name)
+
+
+def _upsert_categories(names, report):
+    existing = {}
+    for category in Category.objects.filter(name__in=names).order_by('id'):
+        existing.setdefault(category.name, category)
+    missing = [Category(name=name, image='') for name in sorted(names) if name not in existing]
+    if missing:
+        # bulk_create skips the save signals, so stamp the change sequence here.
+        with transaction.atomic():
+            seq = next_change_seq()
+            for category in missing:
+                category.change_seq = seq
+            Category.objects.bulk_create(missing)
+        # bulk_create only returns primary keys on some backends.
+        for category in Category.objects.filter(name__in=[c.name for c in missing]).order_by('id'):
+            existing.setdefault(category.name, category)
+        report.categories_created = len(missing)
+    return existing
+
+
+def _upsert_products(batch, categories, report):
+    existing = {}
+    for product in Product.objects.filter(name__in={data['name'] for _, data in batch}).order_by('id'):
+        existing.setdefault((product.name, product.brand), product)
+
+    to_create, to_update = [], []
+    for _, data in batch:
+        product = existing.get((data['name'], data['brand']))
+        if product is None:
+            product = Product(name=data['name'], brand=data['brand'], image=data['image'])
+            to_create.append(product)
+        elif data['image']:
+            product.image = data['image']
+        if product.pk is not None:
+            to_update.append(product)
+        product.price = data['price']
+        product.description = data['description']
+        product.active = data['active']
+        # Importing an archived product brings it back.
+        product.archived_at = None
+        product.category = categories[data['category']]
+
+    with transaction.atomic():
+        seq = next_change_seq()
+        for product in to_create + to_update:
+            product.change_seq = seq
+        if to_create:
+            Product.objects.bulk_create(to_create)
+        if to_update:
+            Product.objects.bulk_update(to_update, PRODUCT_FIELDS + ['archived_at', 'change_seq'])
+    report.created += len(to_create)
+    report.updated += len(to_update)
+
+
+def import_catalog(rows, image_archive=None, batch_size=500, workers=None):
+    """Upsert products and categories keyed on (name, brand) and category name.
+
+    ``image`` values in the rows name members of ``image_archive`` (a path to a
+    zip file). Rows that fail validation are reported and skipped.
+    """
+    report = ImportReport()
+    cleaned = {}
+    for number, row in enumerate(rows, start=1):
+        try:
+            data = _clean_row(row)
+        except (ValueError, TypeError) as e:
+            report.add_error(number, str(e))
+            continue
+        # Later rows win when the same product appears twice.
+        cleaned.pop((data['name'], data['brand']), None)
+        cleaned[(data['name'], data['brand'])] = (number, data)
+
+    wanted = {data['image'] for _, data in cleaned.values() if data['image']}
+    if wanted and not image_archive:
+        stored, failed, created = {}, {member: "No image archive supplied" for member in wanted}, set()
+    else:
+        stored, failed, created = store_images(image_archive, wanted, workers)
+    report.images_stored = len(stored)
+
+    valid = []
+    for number, data in cleaned.values():
+        if data['image'] in failed:
+            report.add_error(number, failed[data['image']])
+            continue
+        if data['image']:
+            data['image'] = stored[data['image']]
+        valid.append((number, data))
+
+    try:
+        if valid:
+            categories = _upsert_categories({data['category'] for _, data in valid}, report)
+            for start in range(0, len(valid), batch_size):
+                _upsert_products(valid[start:start + batch_size], categories, report)
+    except Exception:
+        # Batches that committed keep their images; the rest are removed.
+        discard_images(created)
+        raise
+
+    if report.created or report.updated or report.categories_created:
+        bump_catalog_version()
+    report.errors.sort(key=lambda error: error['row'])
+    return report
@@ -0,0 +1,25 @@
+"""Payment gateway and mail clients, created on first use.
+
+Importing ``razorpay`` and opening mail backends is kept out of module import
+so workers that only serve catalog reads start faster.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def razorpay_client():
+    import razorpay
+    return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+
+
+@lru_cache(maxsize=None)
+def mail_connection():
+    from django.core.mail import get_connection
+    return get_connection(fail_silently=False)
+
+
+def send_mail(**kwargs):
+    from django.core.mail import send_mail as django_send_mail
+    return django_send_mail(connection=mail_connection(), **kwargs)
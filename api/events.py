@@ -0,0 +1,224 @@
+"""Order status events for the server-sent event stream.
+
+Status changes are written to OrderStatusEvent in the transaction that
+makes them, and the owner's streams are woken once it commits. A wake-up
+carries only the user id: the stream then reads that user's events after
+the last id it sent, which is also how a reconnecting client resumes from
+``Last-Event-ID``.
+
+The hub fans wake-ups out to streams in this process. The backend carries
+them between processes: ``local`` only wakes this process, ``postgres``
+uses LISTEN/NOTIFY so every worker hears about every commit.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections, transaction
+
+from dessertshop_backend.db_router import primary
+
+from .models import OrderStatusEvent
+from .reports import invalidate_revenue
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'order_events'
+RETRY_MS = 3000
+BATCH_SIZE = 100
+
+
+class Hub:
+    """Idle streams of this process, keyed by user id."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[user_id]
+
+    def notify(self, user_id):
+        """Wake the user's streams. Safe to call from any thread."""
+        with self.lock:
+            subscriptions = list(self.subscribers.get(user_id, ()))
+        for loop, wake in subscriptions:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                # The stream's event loop has already shut down.
+                pass
+
+    def notify_all(self):
+        with self.lock:
+            user_ids = list(self.subscribers)
+        for user_id in user_ids:
+            self.notify(user_id)
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+
+hub = Hub()
+
+
+class LocalBackend:
+    def __init__(self, hub):
+        self.hub = hub
+
+    def start(self):
+        pass
+
+    def publish(self, user_ids):
+        user_ids = set(user_ids)
+        transaction.on_commit(lambda: [self.hub.notify(user_id) for user_id in user_ids])
+
+
+class PostgresBackend(LocalBackend):
+    """Wake-ups via NOTIFY, which PostgreSQL delivers only when the transaction commits."""
+
+    def __init__(self, hub):
+        super().__init__(hub)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def publish(self, user_ids):
+        with connections['default'].cursor() as cursor:
+            for user_id in sorted(set(user_ids)):
+                cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, str(user_id)])
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.listen, name='order-events-listener', daemon=True)
+                self.thread.start()
+
+    def listen(self):
+        wrapper = connections['default']
+        while True:
+            conn = None
+            try:
+                conn = wrapper.get_new_connection(wrapper.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                # Anything committed while we were not listening was missed.
+                self.hub.notify_all()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.hub.notify(int(conn.notifies.pop(0).payload))
+            except Exception:
+                logger.exception("Order event listener lost its connection; reconnecting")
+                if conn is not None:
+                    conn.close()
+                time.sleep(1)
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'postgres': PostgresBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return BACKENDS[settings.ORDER_EVENTS_BACKEND](hub)
+
+
+def db_call(func):
+    """``sync_to_async`` on the shared thread pool.
+
+    The default thread-sensitive mode gives every request its own thread,
+    and so its own database connection, for as long as its stream is open.
+    """
+    def call(*args):
+        close_old_connections()
+        return func(*args)
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def record_status_changes(orders):
+    """Log the new status of saved ``orders`` and wake their owners' streams after commit.
+
+    Also drops the cached revenue buckets of the orders, as every status
+    change goes through here, including the bulk updates that skip signals.
+    """
+    events = [OrderStatusEvent(user_id=order.user_id, order_id=order.pk, status=order.status) for order in orders]
+    if not events:
+        return
+    invalidate_revenue(orders)
+    OrderStatusEvent.objects.bulk_create(events)
+    get_backend().publish(event.user_id for event in events)
+
+
+# A wake-up means the event is on the primary; a replica may not have it yet.
+@primary()
+def latest_event_id(user_id):
+    return OrderStatusEvent.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+@primary()
+def _events_after(user_id, last_id):
+    return list(
+        OrderStatusEvent.objects.filter(user_id=user_id, id__gt=last_id)
+        .order_by('id').values('id', 'order_id', 'status', 'created_at')[:BATCH_SIZE]
+    )
+
+
+def _format(event):
+    data = json.dumps(
+        {'order_id': event['order_id'], 'status': event['status'], 'created_at': event['created_at']},
+        cls=DjangoJSONEncoder,
+    )
+    return f"id: {event['id']}\nevent: order_status\ndata: {data}\n\n"
+
+
+async def event_stream(user_id, last_id, heartbeat=None):
+    """Yield SSE frames for ``user_id``'s status events after ``last_id``, forever."""
+    heartbeat = heartbeat or settings.ORDER_EVENTS_HEARTBEAT_SECONDS
+    get_backend().start()
+    subscription = hub.subscribe(user_id)
+    wake = subscription[1]
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            events = await db_call(_events_after)(user_id, last_id)
+            for event in events:
+                last_id = event['id']
+                yield _format(event)
+            if len(events) == BATCH_SIZE:
+                continue
+            # Idle streams only wake for heartbeats and never touch the database.
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), heartbeat)
+                    break
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+            wake.clear()
+    finally:
+        hub.unsubscribe(user_id, subscription)
@@ -0,0 +1,136 @@
+"""Read-only serialization of querysets straight from ``.values()`` rows.
+
+List serializers in ``serializers.py`` use these plans for GET list responses
+instead of building model instances and running every field per row. Each
+plan produces exactly the same output as its ModelSerializer.
+"""
+from django.core.files.storage import default_storage
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+
+
+class MediaURL:
+    """Absolute media URLs with the scheme and host resolved once per request."""
+
+    def __init__(self, request):
+        self.request = request
+        self.base = None
+        base_url = getattr(default_storage, 'base_url', None)
+        if request is not None and base_url is not None:
+            self.base = request.build_absolute_uri(base_url)
+
+    def __call__(self, name):
+        if not name or self.request is None:
+            return None
+        if self.base is not None:
+            return self.base + filepath_to_uri(name).lstrip('/')
+        return self.request.build_absolute_uri(default_storage.url(name))
+
+
+def decimal(max_digits, decimal_places):
+    return serializers.DecimalField(max_digits=max_digits, decimal_places=decimal_places).to_representation
+
+
+class Plan:
+    """Ordered output fields mapped to ``.values()`` columns.
+
+    Entries are ``(key, column, converter)``, where converter is None, a
+    callable, or ``'media'``; or ``(key, prefix, Plan)`` for a nested object
+    read from ``prefix``-ed columns of the same row.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def columns(self, prefix=''):
+        columns = []
+        for key, column, converter in self.entries:
+            if isinstance(converter, Plan):
+                columns += converter.columns(prefix + column)
+            else:
+                columns.append(prefix + column)
+        return columns
+
+    def compile(self, media, prefix=''):
+        steps = []
+        for key, column, converter in self.entries:
+            if isinstance(converter, Plan):
+                steps.append((key, None, converter.compile(media, prefix + column)))
+            elif converter == 'media':
+                steps.append((key, prefix + column, media))
+            else:
+                steps.append((key, prefix + column, converter))
+
+        def render(row):
+            out = {}
+            for key, column, convert in steps:
+                if column is None:
+                    out[key] = convert(row)
+                elif convert is None:
+                    out[key] = row[column]
+                else:
+                    value = row[column]
+                    out[key] = None if value is None else convert(value)
+            return out
+        return render
+
+    def select(self, tree):
+        """A plan for the fields in a ``fieldsets`` tree (None keeps everything)."""
+        if tree is None:
+            return self
+        entries = []
+        for key, column, converter in self.entries:
+            if key not in tree and key != 'id':
+                continue
+            if isinstance(converter, Plan):
+                converter = converter.select(tree[key])
+            entries.append((key, column, converter))
+        return Plan(entries)
+
+    def serialize(self, queryset, request, prefix=''):
+        render = self.compile(MediaURL(request), prefix)
+        return [render(row) for row in queryset.values(*self.columns(prefix))]
+
+
+CATEGORY_PLAN = Plan([
+    ('id', 'id', None),
+    ('name', 'name', None),
+    ('image', 'image', 'media'),
+])
+
+PRODUCT_PLAN = Plan([
+    ('id', 'id', None),
+    ('name', 'name', None),
+    ('price', 'price', decimal(8, 2)),
+    ('description', 'description', None),
+    ('brand', 'brand', None),
+    ('image', 'image', 'media'),
+    ('category', 'category_id', None),
+    ('category_name', 'category__name', None),
+    ('active', 'active', None),
+])
+
+CART_PLAN = Plan([
+    ('id', 'id', None),
+    ('user', 'user_id', None),
+    ('product', 'product_id', None),
+    ('quantity', 'quantity', None),
+    ('product_details', 'product__', PRODUCT_PLAN),
+])
+
+WISHLIST_PLAN = Plan([
+    ('id', 'id', None),
+    ('user', 'user_id', None),
+    ('product', 'product_id', None),
+    ('product_details', 'product__', PRODUCT_PLAN),
+])
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """Uses the child's ``Meta.fast_plan`` when serializing a queryset."""
+
+    def to_representation(self, data):
+        plan = getattr(self.child.Meta, 'fast_plan', None)
+        if plan is None or not hasattr(data, 'values'):
+            return super().to_representation(data)
+        return plan.select(self.child.fieldset()).serialize(data.all(), self.context.get('request'))
@@ -0,0 +1,160 @@
+"""``?fields=`` and ``?expand=`` support for GET responses.
+
+``fields`` is a comma separated list of field names; dotted names pick
+fields of a nested object (``fields=id,quantity,product_details.name``).
+When ``fields`` is given, nested objects are only included if they are
+named in it or in ``expand`` (``expand=product_details``), which embeds
+them whole. ``id`` is always kept so clients can match objects up.
+Without ``fields`` responses are unchanged.
+
+``prune_queryset`` turns the same selection into ``only()``,
+``select_related()`` and ``Prefetch`` calls so columns and relations that
+are not returned are never loaded.
+"""
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+ALL = None
+
+
+def _split(value):
+    return [path.strip() for path in (value or '').split(',') if path.strip()]
+
+
+def parse_fieldset(fields, expand=''):
+    """Build a tree of requested fields. ``None`` means every field."""
+    paths = _split(fields)
+    if not paths:
+        return ALL
+    tree = {}
+    for path in paths + _split(expand):
+        node = tree
+        *parents, leaf = path.split('.')
+        for name in parents:
+            if name in node and node[name] is ALL:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[leaf] = ALL
+    return tree
+
+
+def request_fieldset(request):
+    if request is None or request.method != 'GET':
+        return ALL
+    if not hasattr(request, '_fieldset'):
+        params = getattr(request, 'query_params', request.GET)
+        request._fieldset = parse_fieldset(params.get('fields'), params.get('expand'))
+    return request._fieldset
+
+
+class FieldsetMixin:
+    """Serializer mixin that drops fields the request did not ask for."""
+
+    def fieldset(self):
+        """Requested subtree for this serializer, wherever it is nested."""
+        if hasattr(self, '_fieldset'):
+            return self._fieldset
+        path, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        tree = request_fieldset(node.context.get('request'))
+        for name in reversed(path):
+            if tree is ALL:
+                break
+            tree = tree.get(name, ALL)
+        self._fieldset = tree
+        return tree
+
+    def subfields(self, name):
+        tree = self.fieldset()
+        return ALL if tree is ALL else tree.get(name, ALL)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        tree = self.fieldset()
+        if tree is ALL:
+            return fields
+        return {name: field for name, field in fields.items() if name in tree or name == 'id'}
+
+
+def pick(data, tree):
+    """Apply a fieldset tree to an already built dict."""
+    if tree is ALL:
+        return data
+    return {key: value for key, value in data.items() if key in tree or key == 'id'}
+
+
+def requested_extras(request, names):
+    """Which of the opt-in ``names`` (not serializer fields) the request asks for."""
+    if request is None or request.method != 'GET':
+        return set()
+    params = getattr(request, 'query_params', request.GET)
+    asked = {path.split('.')[0] for path in _split(params.get('fields')) + _split(params.get('expand'))}
+    return asked & set(names)
+
+
+def _query_parts(serializer, prefix=''):
+    """Columns, select_related paths and prefetches ``serializer`` reads.
+
+    ``columns`` is None when some field reads the whole object and the
+    model cannot be restricted with ``only()``.
+    """
+    model = serializer.Meta.model
+    sources = getattr(serializer.Meta, 'fieldset_sources', {})
+    columns, related, prefetches = {prefix + model._meta.pk.name}, set(), []
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            remote = model._meta.get_field(field.source).field
+            child_columns, child_related, child_prefetches = _query_parts(child)
+            queryset = child.Meta.model.objects.all()
+            if child_related:
+                queryset = queryset.select_related(*child_related)
+            if child_prefetches:
+                queryset = queryset.prefetch_related(*child_prefetches)
+            if child_columns is not None:
+                queryset = queryset.only(*child_columns, remote.attname)
+            prefetches.append(Prefetch(prefix + field.source, queryset=queryset))
+        elif isinstance(field, serializers.BaseSerializer):
+            path = prefix + field.source.replace('.', '__')
+            related.add(path)
+            nested_columns, nested_related, nested_prefetches = _query_parts(field, path + '__')
+            if columns is not None:
+                columns = None if nested_columns is None else columns | nested_columns
+            related |= nested_related
+            prefetches += nested_prefetches
+        elif name in sources:
+            for source in sources[name]:
+                if '__' in source:
+                    related.add(prefix + source.rsplit('__', 1)[0])
+            if columns is not None:
+                columns |= {prefix + source for source in sources[name]}
+        elif field.source == '*':
+            columns = None
+        else:
+            parts = field.source.split('.')
+            if len(parts) > 1:
+                related.add(prefix + '__'.join(parts[:-1]))
+            if columns is not None:
+                columns.add(prefix + '__'.join(parts))
+    return columns, related, prefetches
+
+
+def prune_queryset(queryset, serializer_class, request):
+    """Load only what ``serializer_class`` will output for ``request``."""
+    serializer = serializer_class(context={'request': request})
+    columns, related, prefetches = _query_parts(serializer)
+    if related:
+        queryset = queryset.select_related(*related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    if columns is not None:
+        queryset = queryset.only(*columns)
+    return queryset
@@ -0,0 +1,129 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+
+
+def fingerprint(request):
+    payload = json.dumps(
+        [request.method, request.path, request.data],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim(user, key, request_fingerprint):
+    """Insert the key for ``user``. Returns ``(record, created)``.
+
+    The unique constraint on (user, key) guarantees only one concurrent
+    request gets ``created=True``; expired keys are replaced. A key whose
+    request has held it past IDEMPOTENCY_LEASE without a result is taken
+    over by a request with the same payload, which also gets ``created=True``.
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    fingerprint=request_fingerprint,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                continue
+            if record.expires_at > now:
+                if _take_over(record, request_fingerprint, now):
+                    return record, True
+                return record, False
+            IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+    return record, False
+
+
+def _take_over(record, request_fingerprint, now):
+    if record.status_code is not None or record.fingerprint != request_fingerprint:
+        return False
+    if record.claimed_at > now - settings.IDEMPOTENCY_LEASE:
+        return False
+    # Conditional on the old claim, so only one retry wins the takeover.
+    taken = IdempotencyKey.objects.filter(
+        pk=record.pk, status_code__isnull=True, claimed_at=record.claimed_at,
+    ).update(claimed_at=now)
+    record.claimed_at = now
+    return taken == 1
+
+
+def _held(record):
+    """The key row, as long as ``record``'s claim has not been taken over."""
+    return IdempotencyKey.objects.filter(pk=record.pk, claimed_at=record.claimed_at)
+
+
+def _wait_for_result(record):
+    if record is None:
+        return None
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record.status_code is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            return None
+    return record
+
+
+def idempotent(view_method):
+    """Honour the ``Idempotency-Key`` header on an APIView method.
+
+    The first request with a key does the work and its response is stored;
+    repeats with the same payload replay it. A repeat that arrives while the
+    first is still running waits briefly, then gets a 409, until the first
+    request's lease runs out and a repeat runs the view again.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} must be at most 255 characters'}, status=400)
+
+        request_fingerprint = fingerprint(request)
+        record, created = claim(request.user, key, request_fingerprint)
+        if not created:
+            if record is not None and record.fingerprint != request_fingerprint:
+                return Response({'error': f'{HEADER} was already used for a different request'}, status=422)
+            record = _wait_for_result(record)
+            if record is None or record.status_code is None:
+                return Response(
+                    {'error': f'A request with this {HEADER} is still in progress'},
+                    status=409,
+                    headers={'Retry-After': '1'},
+                )
+            return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            _held(record).delete()
+            raise
+        if response.status_code >= 500:
+            # Server errors are not final, let the client retry with the same key.
+            _held(record).delete()
+        else:
+            _held(record).update(status_code=response.status_code, response_body=response.data)
+        return response
+
+    return wrapper
@@ -0,0 +1,189 @@
+"""Stock tracking with reservations held until payment.
+
+A product's available stock is split over one or more StockShard rows.
+Checkout takes units with a conditional ``UPDATE ... WHERE available >= n``,
+so two checkouts can never both take the last unit and nothing reads the
+product row under a lock. Several shards let concurrent checkouts of a hot
+product update different rows. Units taken are recorded as held
+StockReservations that payment confirms and cancellation or expiry returns.
+
+Shards are always locked in (product, shard) order, except for the single
+shard a checkout takes a product's whole quantity from, so concurrent
+checkouts, releases and the expiry sweeper cannot deadlock on each other.
+"""
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .events import record_status_changes
+from .models import Order, StockReservation, StockShard
+from .popularity import SOLD_STATUSES
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, requested, available):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        super().__init__(f"Only {available} left in stock for product {product_id}")
+
+
+def set_stock(product_id, quantity, shards=1):
+    """Replace a product's available stock, spread over ``shards`` rows.
+
+    ``quantity=None`` stops tracking stock for the product.
+    """
+    with transaction.atomic():
+        StockShard.objects.filter(product_id=product_id).delete()
+        if quantity is None:
+            return
+        base, extra = divmod(quantity, shards)
+        StockShard.objects.bulk_create([
+            StockShard(product_id=product_id, shard=i, available=base + (i < extra))
+            for i in range(shards)
+        ])
+
+
+def stock_levels(product_id):
+    shards = StockShard.objects.filter(product_id=product_id)
+    held = StockReservation.objects.filter(product_id=product_id, status=StockReservation.HELD)
+    return {
+        'tracked': shards.exists(),
+        'available': shards.aggregate(total=Sum('available'))['total'] or 0,
+        'held': held.aggregate(total=Sum('quantity'))['total'] or 0,
+        'shards': shards.count(),
+    }
+
+
+def _take(product_id, shard, quantity):
+    return StockShard.objects.filter(
+        product_id=product_id, shard=shard, available__gte=quantity
+    ).update(available=F('available') - quantity) == 1
+
+
+def _take_whole(product_id, shard, quantity):
+    # An UPDATE that waited on a row keeps its lock even when the row no
+    # longer matches; roll a miss back so no shard stays locked out of order.
+    sid = transaction.savepoint()
+    if _take(product_id, shard, quantity):
+        transaction.savepoint_commit(sid)
+        return True
+    transaction.savepoint_rollback(sid)
+    return False
+
+
+def _take_from(product_id, shards, quantity):
+    """Take ``quantity`` units from ``shards``. Returns ``[(shard, units)]``."""
+    # Usually a single shard has enough; start at a random one to spread load.
+    start = random.randrange(len(shards))
+    for shard in shards[start:] + shards[:start]:
+        if _take_whole(product_id, shard, quantity):
+            return [(shard, quantity)]
+
+    # Otherwise gather what is left, in shard order.
+    taken, remaining = [], quantity
+    for shard in shards:
+        while remaining:
+            available = StockShard.objects.filter(product_id=product_id, shard=shard).values_list('available', flat=True).first() or 0
+            units = min(available, remaining)
+            if not units:
+                break
+            if _take(product_id, shard, units):
+                taken.append((shard, units))
+                remaining -= units
+        if not remaining:
+            return taken
+    raise OutOfStock(product_id, quantity, quantity - remaining)
+
+
+def reserve(order, items, ttl=None):
+    """Hold stock for the OrderItems of ``order``. Raises OutOfStock.
+
+    Must run in the checkout transaction; nothing is taken if any product
+    is short. Products without stock shards are not limited.
+    """
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item.product_id] += int(item.quantity)
+    shards = defaultdict(list)
+    for product_id, shard in (
+        StockShard.objects.filter(product_id__in=list(quantities))
+        .order_by('product_id', 'shard').values_list('product_id', 'shard')
+    ):
+        shards[product_id].append(shard)
+    if not shards:
+        return []
+
+    expires_at = timezone.now() + (ttl or settings.STOCK_RESERVATION_TTL)
+    reservations = []
+    with transaction.atomic():
+        for product_id in sorted(shards):
+            for shard, units in _take_from(product_id, shards[product_id], quantities[product_id]):
+                reservations.append(StockReservation(
+                    order=order, product_id=product_id, shard=shard, quantity=units, expires_at=expires_at,
+                ))
+        StockReservation.objects.bulk_create(reservations)
+    return reservations
+
+
+def confirm(order_ids):
+    return StockReservation.objects.filter(order_id__in=order_ids, status=StockReservation.HELD).update(
+        status=StockReservation.CONFIRMED
+    )
+
+
+def release(order_ids):
+    """Put the units of held reservations for ``order_ids`` back in stock."""
+    with transaction.atomic():
+        held = list(
+            StockReservation.objects.filter(order_id__in=order_ids, status=StockReservation.HELD)
+            .select_for_update()
+        )
+        if not held:
+            return 0
+        units = defaultdict(int)
+        for reservation in held:
+            units[(reservation.product_id, reservation.shard)] += reservation.quantity
+        for (product_id, shard), quantity in sorted(units.items()):
+            if not StockShard.objects.filter(product_id=product_id, shard=shard).update(available=F('available') + quantity):
+                # The product was re-sharded since; any remaining shard will do.
+                first = StockShard.objects.filter(product_id=product_id).order_by('shard').values_list('shard', flat=True).first()
+                if first is not None:
+                    StockShard.objects.filter(product_id=product_id, shard=first).update(available=F('available') + quantity)
+        StockReservation.objects.filter(pk__in=[r.pk for r in held]).update(status=StockReservation.RELEASED)
+    return len(held)
+
+
+def settle(orders):
+    """Confirm held stock of paid orders and return it for cancelled ones."""
+    paid = [order.pk for order in orders if order.status in SOLD_STATUSES]
+    cancelled = [order.pk for order in orders if order.status == 'cancelled']
+    if paid:
+        confirm(paid)
+    if cancelled:
+        release(cancelled)
+
+
+def release_expired(batch_size=200, now=None):
+    """Cancel one batch of unpaid orders whose reservations expired. Returns the batch size."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        order_ids = set(
+            StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lt=now)
+            .order_by('expires_at').values_list('order_id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+        # Orders being paid right now are locked by the payment path; skip them.
+        orders = list(Order.objects.filter(id__in=order_ids).select_for_update(skip_locked=True))
+        expired = [order for order in orders if order.status == 'pending']
+        for order in expired:
+            order.status = 'cancelled'
+        Order.objects.bulk_update(expired, ['status'])
+        settle(orders)
+        record_status_changes(expired)
+    return len(orders)
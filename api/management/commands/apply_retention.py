@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from dessertshop_backend.db_router import primary
+
+from api.retention import POLICIES, apply_policy, enabled_policies
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete rows past their retention window in small batches, for every policy in "
+        "RETENTION_POLICIES: " + "; ".join(f"{name}: {policy.help}" for name, policy in POLICIES.items()) + "."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', action='append', dest='policies', help="Only run this policy (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to pause between batches")
+        parser.add_argument('--dry-run', action='store_true', help="Count what would be deleted, delete nothing")
+
+    @primary()
+    def handle(self, *args, **options):
+        policies = enabled_policies()
+        if options['policies']:
+            unknown = set(options['policies']) - {policy.name for policy in policies}
+            if unknown:
+                raise CommandError(f"Not enabled in RETENTION_POLICIES: {', '.join(sorted(unknown))}")
+            policies = [policy for policy in policies if policy.name in options['policies']]
+
+        total_rows = 0
+        total_bytes = None
+        for policy in policies:
+            rows, size, batches = apply_policy(
+                policy, options['batch_size'], options['sleep'], options['dry_run'],
+            )
+            total_rows += rows
+            if size is not None:
+                total_bytes = (total_bytes or 0) + size
+            size = 'size unknown' if size is None else f"~{filesizeformat(size)}"
+            if options['dry_run']:
+                self.stdout.write(f"{policy.name}: would delete {rows} rows ({size})")
+            else:
+                self.stdout.write(f"{policy.name}: deleted {rows} rows ({size}) in {batches} batches")
+
+        verb = "Would reclaim" if options['dry_run'] else "Reclaimed"
+        size = 'size unknown' if total_bytes is None else f"~{filesizeformat(total_bytes)}"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {total_rows} rows ({size}). "
+            "The space is reused once (auto)vacuum has processed the tables."
+        ))
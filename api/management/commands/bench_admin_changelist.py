@@ -0,0 +1,159 @@
+import statistics
+import time
+import types
+from contextlib import contextmanager
+
+from django.contrib import admin
+from django.contrib.admin import ModelAdmin
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api import partitions
+from api.models import Cart, Category, Order, OrderItem, Product, User
+
+
+EMAIL_DOMAIN = '@admin-bench.invalid'
+
+# The admin options before they were tuned for large tables.
+LEGACY_OPTIONS = {
+    Order: {'list_filter': ('status', 'created_at'), 'search_fields': ('user__email',), 'date_hierarchy': None},
+    Cart: {'list_filter': ('user',)},
+    OrderItem: {'search_fields': ('product__name',)},
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def legacy_admin():
+    """Temporarily give the benchmarked ModelAdmins their old, untuned options."""
+    patched = []
+    for model, options in LEGACY_OPTIONS.items():
+        model_admin = admin.site._registry[model]
+        options = dict(
+            options, list_select_related=False, paginator=Paginator,
+            show_full_result_count=True, show_facets=admin.ShowFacets.ALLOW,
+        )
+        if model is Order:
+            options['get_search_results'] = types.MethodType(ModelAdmin.get_search_results, model_admin)
+        for name, value in options.items():
+            setattr(model_admin, name, value)
+        patched.append((model_admin, options))
+    try:
+        yield
+    finally:
+        for model_admin, options in patched:
+            for name in options:
+                delattr(model_admin, name)
+
+
+class Command(BaseCommand):
+    help = (
+        "Render Django admin changelists over a synthetic dataset with the old and the "
+        "current admin options. Needs PostgreSQL; everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help="Orders, order items and cart rows each")
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Planner estimates need PostgreSQL")
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        superuser = User.objects.create_superuser(email=f'admin{EMAIL_DOMAIN}', name='admin bench')
+        sample = self.populate(options)
+        # (label, model, query with the old options, query with the current ones)
+        pages = [
+            ('orders', Order, {}, {}),
+            ('orders by status', Order, {'status__exact': 'delivered'}, {'status__exact': 'delivered'}),
+            ('orders by email', Order, {'q': sample.email}, {'q': sample.email}),
+            ('carts', Cart, {}, {}),
+            ('carts by user', Cart, {'user__id__exact': sample.pk}, {'user_email': sample.email}),
+            ('order items search', OrderItem, {'q': 'Bench dessert 1'}, {'q': 'Bench dessert 1'}),
+        ]
+        self.stdout.write(f"{'page':<20} {'old ms':>9} {'old queries':>12} {'new ms':>9} {'new queries':>12}")
+        for label, model, old_params, params in pages:
+            with legacy_admin():
+                old_ms, old_queries = self.render(model, old_params, superuser, options['repeat'])
+            new_ms, new_queries = self.render(model, params, superuser, options['repeat'])
+            self.stdout.write(f"{label:<20} {old_ms:>9.1f} {old_queries:>12} {new_ms:>9.1f} {new_queries:>12}")
+
+    def populate(self, options):
+        started = time.perf_counter()
+        User.objects.bulk_create([
+            User(email=f'user-{i}{EMAIL_DOMAIN}', name=f'user {i}') for i in range(options['users'])
+        ], batch_size=5000)
+        user_ids = list(User.objects.filter(email__endswith=EMAIL_DOMAIN).values_list('id', flat=True))
+        category = Category.objects.create(name='admin-bench', image='')
+        Product.objects.bulk_create([
+            Product(name=f'Bench dessert {i}', brand='bench', price=10, description='', category=category, image='')
+            for i in range(200)
+        ])
+        product_ids = list(Product.objects.filter(category=category).values_list('id', flat=True))
+
+        current = partitions.month_start(timezone.now())
+        first = partitions.add_months(current, -23)
+        if partitions.is_partitioned():
+            partitions.ensure_partitions(first, current)
+        rows = options['rows']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO api_order (total, status, created_at, user_id) "
+                "SELECT (random() * 1000)::numeric(10, 2), "
+                "(ARRAY['pending', 'processing', 'shipped', 'delivered', 'cancelled'])[1 + floor(random() * 5)::int], "
+                "%s::timestamptz + random() * (now() - %s::timestamptz), "
+                "(%s::bigint[])[1 + floor(random() * %s)::int] "
+                "FROM generate_series(1, %s)",
+                [first.isoformat(), first.isoformat(), user_ids, len(user_ids), rows],
+            )
+            cursor.execute(
+                "INSERT INTO api_orderitem (order_id, product_id, quantity, price, "
+                "product_name, product_brand, product_image, category_name) "
+                "SELECT o.id, p.id, 1, 10, p.name, p.brand, '', 'admin-bench' "
+                "FROM (SELECT id, (%s::bigint[])[1 + floor(random() * %s)::int] AS product_id "
+                "      FROM api_order WHERE user_id = ANY(%s)) o "
+                "JOIN api_product p ON p.id = o.product_id",
+                [product_ids, len(product_ids), user_ids],
+            )
+            cursor.execute(
+                "INSERT INTO api_cart (user_id, product_id, quantity) "
+                "SELECT (%s::bigint[])[1 + floor(random() * %s)::int], "
+                "(%s::bigint[])[1 + floor(random() * %s)::int], 1 FROM generate_series(1, %s)",
+                [user_ids, len(user_ids), product_ids, len(product_ids), rows],
+            )
+            for table in ('api_user', 'api_order', 'api_orderitem', 'api_cart'):
+                cursor.execute(f"ANALYZE {table}")
+        self.stdout.write(f"{rows} rows per table loaded in {time.perf_counter() - started:.0f}s")
+        return User.objects.get(email=f'user-1{EMAIL_DOMAIN}')
+
+    def render(self, model, params, user, repeat):
+        model_admin = admin.site._registry[model]
+        opts = model._meta
+        path = f'/admin/{opts.app_label}/{opts.model_name}/'
+        timings = []
+        for _ in range(repeat):
+            request = RequestFactory().get(path, params)
+            request.user = user
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = model_admin.changelist_view(request)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code} for {params}")
+                response.render()
+                timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000, len(queries)
@@ -0,0 +1,107 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api import partitions
+from api.models import Order, User
+from api.views import AdminStatsView, AdminUserListView, OrderListView
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark hot-partition order queries and the order list, admin stats and admin "
+        "user list views as synthetic order history grows; none should slow down with it. "
+        "Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', default='3,12,36', help="Comma separated months of history")
+        parser.add_argument('--orders-per-month', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError("api_order is not partitioned; this needs PostgreSQL with migration 0011 applied")
+        steps = sorted(int(step) for step in options['steps'].split(','))
+        try:
+            with transaction.atomic():
+                self.run(steps, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, steps, options):
+        users = User.objects.bulk_create([
+            User(email=f'bench-{i}@partitions.invalid', name=f'bench {i}') for i in range(options['users'])
+        ])
+        user_ids = [user.id for user in User.objects.filter(email__endswith='@partitions.invalid').order_by('id')]
+        admin = User.objects.create_superuser(email='bench-admin@partitions.invalid', name='bench admin', password=None)
+        self.factory = APIRequestFactory()
+        current = partitions.month_start(timezone.now())
+        hot_start = partitions.history_start(1)
+        filled = 0
+
+        self.stdout.write(
+            f"{'months':>7} {'orders':>10} {'recent list ms':>15} {'month revenue ms':>17} "
+            f"{'order list ms':>14} {'admin stats ms':>15} {'user list ms':>15}"
+        )
+        for months in steps:
+            partitions.ensure_partitions(partitions.add_months(current, -(months - 1)), current)
+            with connection.cursor() as cursor:
+                for offset in range(filled, months):
+                    month = partitions.add_months(current, -offset)
+                    cursor.execute(
+                        "INSERT INTO api_order (total, status, created_at, user_id) "
+                        "SELECT (random() * 1000)::numeric(10, 2), "
+                        "(ARRAY['completed', 'processing', 'delivered'])[1 + floor(random() * 3)::int], "
+                        "%s::timestamptz + random() * (%s::timestamptz - %s::timestamptz), "
+                        "(%s::bigint[])[1 + floor(random() * %s)::int] "
+                        "FROM generate_series(1, %s)",
+                        [
+                            month.isoformat(), partitions.add_months(month, 1).isoformat(), month.isoformat(),
+                            user_ids, len(user_ids), options['orders_per_month'],
+                        ],
+                    )
+                cursor.execute("ANALYZE api_order")
+            filled = months
+
+            customer = User.objects.get(pk=user_ids[0])
+            recent = self.time(options['repeat'], lambda: list(
+                Order.objects.filter(user=customer, created_at__gte=hot_start).order_by('-created_at')[:20]
+            ))
+            revenue = self.time(options['repeat'], lambda: Order.objects.filter(
+                created_at__gte=hot_start, status='completed'
+            ).aggregate(total=Sum('total')))
+            order_list = self.time(options['repeat'], lambda: self.call(OrderListView, customer))
+            stats = self.time(options['repeat'], lambda: self.call(AdminStatsView, admin))
+            users = self.time(options['repeat'], lambda: self.call(AdminUserListView, admin))
+            total = months * options['orders_per_month']
+            self.stdout.write(
+                f"{months:>7} {total:>10} {recent:>15.2f} {revenue:>17.2f} "
+                f"{order_list:>14.2f} {stats:>15.2f} {users:>15.2f}"
+            )
+
+    def call(self, view, user):
+        request = self.factory.get('/')
+        force_authenticate(request, user=user)
+        response = view.as_view()(request)
+        assert response.status_code == 200, response.status_code
+        return response.data
+
+    def time(self, repeat, func):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from api.archival import archive_products
+from api.models import Cart, Category, Order, OrderItem, Product, User, Wishlist
+
+
+EMAIL_DOMAIN = '@bench-product-delete.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare deleting a product with a long history against archiving it: how long the "
+        "transaction holds its locks and how long a concurrent cart update waits. "
+        "Needs PostgreSQL; test data is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order-items', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=5000, help="Cart and wishlist rows each")
+        parser.add_argument('--items-per-order', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError("SQLite locks the whole database; run this against PostgreSQL")
+        users = [User(email=f'user-{i}{EMAIL_DOMAIN}', name=f'user {i}') for i in range(options['carts'])]
+        User.objects.bulk_create(users, batch_size=1000)
+        users = list(User.objects.filter(email__endswith=EMAIL_DOMAIN).order_by('id'))
+        category = Category.objects.create(name='bench-product-delete', image='')
+        try:
+            self.stdout.write(f"{'mode':>8} {'locks held ms':>14} {'cart update waited ms':>22}")
+            for mode in ('delete', 'archive'):
+                product = self.make_product(category, users, options)
+                held, waited = self.measure(mode, product)
+                self.stdout.write(f"{mode:>8} {held * 1000:>14.1f} {waited * 1000:>22.1f}")
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            category.delete()
+
+    def make_product(self, category, users, options):
+        product = Product.objects.create(
+            name='Bench dessert', brand='bench', price=1, description='', category=category, image=''
+        )
+        per_order = options['items_per_order']
+        orders = Order.objects.bulk_create([
+            Order(user=users[i % len(users)], total=per_order, status='delivered')
+            for i in range(-(-options['order_items'] // per_order))
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem.from_product(order, product, 1) for order in orders for _ in range(per_order)
+        ][:options['order_items']], batch_size=5000)
+        Cart.objects.bulk_create([Cart(user=user, product=product) for user in users], batch_size=5000)
+        Wishlist.objects.bulk_create([Wishlist(user=user, product=product) for user in users], batch_size=5000)
+        return product
+
+    def measure(self, mode, product):
+        """Run ``mode`` on ``product`` while another connection updates one of its cart rows."""
+        cart_id = Cart.objects.filter(product=product).values_list('pk', flat=True).first()
+        started = threading.Event()
+        result = {}
+
+        def worker():
+            connection.ensure_connection()
+            try:
+                with transaction.atomic():
+                    started.set()
+                    begin = time.perf_counter()
+                    if mode == 'delete':
+                        Product.objects.get(pk=product.pk).delete()
+                    else:
+                        archive_products([product.pk])
+                result['held'] = time.perf_counter() - begin
+            finally:
+                connections.close_all()
+
+        def probe():
+            connection.ensure_connection()
+            started.wait()
+            time.sleep(0.005)
+            begin = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    Cart.objects.filter(pk=cart_id).update(quantity=2)
+                result['waited'] = time.perf_counter() - begin
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker), threading.Thread(target=probe)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result['held'], result['waited']
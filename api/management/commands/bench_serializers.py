@@ -0,0 +1,86 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework import serializers
+
+from api.models import Cart, Category, Product, User, Wishlist
+from api.serializers import CartSerializer, CategorySerializer, ProductSerializer, WishlistSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/s of the values()-based list fast path against the model serializers "
+        "on synthetic data. Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, rows, repeat):
+        Category.objects.bulk_create([
+            Category(name=f'bench category {i}', image=f'categories/bench-{i}.jpg') for i in range(20)
+        ])
+        categories = list(Category.objects.filter(name__startswith='bench category '))
+        Product.objects.bulk_create([
+            Product(
+                name=f'bench product {i}', price=f'{i % 500}.50', description='benchmark row ' * 10,
+                brand='Bench', image=f'products/bench {i}.jpg', category=categories[i % len(categories)],
+            )
+            for i in range(rows)
+        ])
+        products = list(Product.objects.filter(name__startswith='bench product ').values_list('id', flat=True))
+        user = User.objects.create_user(f'bench-serializers@{rows}.invalid', 'bench')
+        Cart.objects.bulk_create([Cart(user=user, product_id=pk, quantity=1 + pk % 3) for pk in products])
+        Wishlist.objects.bulk_create([Wishlist(user=user, product_id=pk) for pk in products])
+
+        hosts = [host for host in settings.ALLOWED_HOSTS if host and '*' not in host and not host.startswith('.')]
+        request = RequestFactory(HTTP_HOST=hosts[0] if hosts else 'localhost').get('/api/products/')
+        context = {'request': request}
+
+        cases = [
+            ('products', ProductSerializer, Product.objects.filter(name__startswith='bench product ').order_by('id')),
+            ('categories', CategorySerializer, Category.objects.filter(name__startswith='bench category ').order_by('id')),
+            ('cart', CartSerializer, Cart.objects.filter(user=user).order_by('id')),
+            ('wishlist', WishlistSerializer, Wishlist.objects.filter(user=user).order_by('id')),
+        ]
+        self.stdout.write(f"{'payload':<12} {'rows':>7} {'model rows/s':>14} {'fast rows/s':>13} {'speedup':>8}")
+        for name, serializer_class, queryset in cases:
+            def model_path():
+                return serializers.ListSerializer(queryset.all(), child=serializer_class(), context=context).data
+
+            def fast_path():
+                return serializer_class(queryset.all(), many=True, context=context).data
+
+            expected, actual = model_path(), fast_path()
+            if [dict(row) for row in expected] != [dict(row) for row in actual]:
+                raise CommandError(f"Fast path output differs for {name}")
+            count = len(actual)
+            model_rate = count / self.best(model_path, repeat)
+            fast_rate = count / self.best(fast_path, repeat)
+            self.stdout.write(
+                f"{name:<12} {count:>7} {model_rate:>14.0f} {fast_rate:>13.0f} {fast_rate / model_rate:>7.1f}x"
+            )
+
+    def best(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.recommendations import build
+
+
+class Command(BaseCommand):
+    help = "Update co-purchase counts from new orders and rebuild top-K related products."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--rebuild', action='store_true', help="Drop all counts and start from the first order")
+        parser.add_argument('--orders-per-chunk', type=int, default=50000)
+        parser.add_argument('--lag-minutes', type=int, default=None,
+                            help="Leave orders newer than this for the next run "
+                                 "(default: the stock reservation TTL plus 5 minutes)")
+
+    @primary()
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        orders, products = build(
+            top_k=options['top_k'],
+            rebuild=options['rebuild'],
+            orders_per_chunk=options['orders_per_chunk'],
+            lag=None if options['lag_minutes'] is None else timedelta(minutes=options['lag_minutes']),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {orders} orders, updated {products} products in {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dessertshop_backend.db_router import primary
+
+from api.catalog_import import guess_format, import_catalog, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk upsert products and categories from a CSV or JSON file plus an optional image zip."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON catalog file")
+        parser.add_argument('--images', help="Zip archive holding the images named in the catalog")
+        parser.add_argument('--format', choices=['csv', 'json'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None, help="Image worker processes")
+
+    @primary()
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        if not fmt:
+            raise CommandError("Cannot tell the catalog format, pass --format")
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                rows = read_rows(fileobj, fmt)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        report = import_catalog(
+            rows,
+            image_archive=options['images'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+        )
+        for error in report.errors:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report.created} created, {report.updated} updated, "
+            f"{report.categories_created} categories created, "
+            f"{report.images_stored} images stored, {len(report.errors)} errors"
+        ))
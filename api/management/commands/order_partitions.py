@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from dessertshop_backend.db_router import primary
+
+from api import partitions
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly order partitions and archive old ones (PostgreSQL only)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help="Months to create past the current one")
+        parser.add_argument('--retain-months', type=int, default=None,
+                            help="Archive partitions older than this many months")
+        parser.add_argument('--archive-dir', default=None)
+        parser.add_argument('--keep-detached', action='store_true',
+                            help="Detach archived partitions instead of dropping them")
+        parser.add_argument('--list', action='store_true', help="Only list partitions")
+
+    @primary()
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError("api_order is not partitioned; this needs PostgreSQL with migration 0011 applied")
+
+        if options['list']:
+            for name, month, estimate in partitions.list_partitions():
+                self.stdout.write(f"{name}  {month:%Y-%m}  ~{estimate} rows")
+            return
+
+        current = partitions.month_start(timezone.now())
+        created = partitions.ensure_partitions(current, partitions.add_months(current, options['ahead']))
+        for name in created:
+            self.stdout.write(f"created {name}")
+
+        if options['retain_months'] is not None:
+            cutoff = partitions.add_months(current, -options['retain_months'])
+            archive_dir = options['archive_dir'] or settings.ORDER_ARCHIVE_DIR
+            for name, month, _ in partitions.list_partitions():
+                if month >= cutoff:
+                    break
+                path, count = partitions.archive_partition(name, archive_dir, drop=not options['keep_detached'])
+                self.stdout.write(f"archived {name}: {count} orders -> {path}")
+
+        self.stdout.write(self.style.SUCCESS("Order partitions up to date."))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.uploads import process_queued_uploads
+
+
+class Command(BaseCommand):
+    help = "Decode, resize and store queued product and category image uploads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit")
+
+    @primary()
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                count = process_queued_uploads(options['batch_size'])
+                processed += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} image uploads."))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.payments import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Apply queued Razorpay webhook events to orders in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the inbox is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the inbox and exit")
+
+    @primary()
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                count = process_pending_events(options['batch_size'])
+                processed += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} payment events."))
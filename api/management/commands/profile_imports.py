@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Report import-time cost of starting a worker, using python -X importtime in a fresh interpreter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', help="Modules to import after django.setup()")
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or [settings.ROOT_URLCONF]
+        code = "import django; django.setup(); " + "; ".join(f"import {module}" for module in modules)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'dessertshop_backend.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, env=env, cwd=str(settings.BASE_DIR),
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr else "Import failed")
+
+        rows = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            rows.append((int(self_us), int(cumulative_us), name.rstrip(), name.strip()))
+
+        total = sum(row[0] for row in rows)
+        key = 0 if options['sort'] == 'self' else 1
+        self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+        for self_us, cumulative_us, tree_name, _ in sorted(rows, key=lambda row: row[key], reverse=True)[:options['top']]:
+            self.stdout.write(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {tree_name.strip()}")
+
+        by_package = {}
+        for self_us, _, _, name in rows:
+            package = name.split('.')[0]
+            by_package[package] = by_package.get(package, 0) + self_us
+        self.stdout.write("")
+        self.stdout.write("Top-level packages by self time:")
+        for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:10]:
+            self.stdout.write(f"{self_us / 1000:9.1f}  {package}")
+        self.stdout.write(self.style.SUCCESS(f"{len(rows)} modules imported in {total / 1000:.1f} ms."))
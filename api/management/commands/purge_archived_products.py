@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.archival import PURGED_MODELS, purge_archived_rows
+
+
+class Command(BaseCommand):
+    help = "Delete cart and wishlist rows that point at archived products, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help="Seconds to pause between batches")
+
+    @primary()
+    def handle(self, *args, **options):
+        for model in PURGED_MODELS:
+            deleted = 0
+            while True:
+                count = purge_archived_rows(model, options['batch_size'])
+                if not count:
+                    break
+                deleted += count
+                time.sleep(options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {deleted} {model._meta.verbose_name} rows of archived products."
+            ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.popularity import rebuild, refresh
+
+
+class Command(BaseCommand):
+    help = "Fold recent sales into the product sales windows and recount wishlists. Run every few minutes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recompute daily sales from order history first (after deploy or data fixes)")
+
+    @primary()
+    def handle(self, *args, **options):
+        changed = rebuild() if options['rebuild'] else refresh()
+        self.stdout.write(self.style.SUCCESS(f"Product popularity counters refreshed ({changed} updated)."))
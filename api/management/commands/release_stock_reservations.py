@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dessertshop_backend.db_router import primary
+
+from api.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = "Cancel unpaid orders whose stock reservations expired and return their stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=30.0, help="Seconds to wait when nothing has expired")
+        parser.add_argument('--once', action='store_true', help="Release everything expired and exit")
+
+    @primary()
+    def handle(self, *args, **options):
+        released = 0
+        try:
+            while True:
+                count = release_expired(options['batch_size'])
+                released += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Released stock of {released} orders."))
@@ -0,0 +1,142 @@
+import hashlib
+import hmac
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Order
+
+
+WEBHOOK_PATH = '/api/payments/razorpay/webhook/'
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay signed synthetic Razorpay webhook events, shuffled and with duplicates, "
+        "against a running server or the in-process test client."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100, help="Orders to generate events for")
+        parser.add_argument('--existing', action='store_true', help="Use razorpay_order_id of existing orders")
+        parser.add_argument('--duplicates', type=float, default=0.1, help="Fraction of events sent twice")
+        parser.add_argument('--refunds', type=float, default=0.05, help="Fraction of orders that get refunded")
+        parser.add_argument('--no-shuffle', action='store_true')
+        parser.add_argument('--url', help="Server base URL, e.g. http://localhost:8000")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--secret', default=None)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        secret = options['secret'] or settings.RAZORPAY_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError("No webhook secret, set RAZORPAY_WEBHOOK_SECRET or pass --secret")
+        rng = random.Random(options['seed'])
+
+        if options['existing']:
+            order_ids = list(
+                Order.objects.exclude(razorpay_order_id__isnull=True)
+                .values_list('razorpay_order_id', flat=True)[:options['orders']]
+            )
+        else:
+            order_ids = [f'order_replay{uuid.uuid4().hex[:12]}' for _ in range(options['orders'])]
+
+        events = []
+        now = int(time.time())
+        for order_id in order_ids:
+            names = ['payment.authorized', 'payment.captured', 'order.paid']
+            if rng.random() < options['refunds']:
+                names.append('refund.processed')
+            payment_id = f'pay_replay{uuid.uuid4().hex[:12]}'
+            for offset, name in enumerate(names):
+                events.append((uuid.uuid4().hex, self.payload(name, order_id, payment_id, now + offset)))
+        events += [event for event in events if rng.random() < options['duplicates']]
+        if not options['no_shuffle']:
+            rng.shuffle(events)
+
+        send = self.http_sender(options['url']) if options['url'] else self.client_sender()
+        latencies, statuses = [], Counter()
+        lock = threading.Lock()
+
+        def deliver(event):
+            event_id, body = event
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            start = time.perf_counter()
+            status = send(body, signature, event_id)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(deliver, events))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        self.stdout.write(f"events sent: {len(events)} ({len(order_ids)} orders)")
+        self.stdout.write(f"throughput: {len(events) / elapsed:.1f} events/s")
+        self.stdout.write(
+            f"latency ms: p50={statistics.median(latencies):.2f} "
+            f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f} max={latencies[-1]:.2f}"
+        )
+        self.stdout.write(f"statuses: {dict(statuses)}")
+
+    def payload(self, name, order_id, payment_id, created_at):
+        payload = {
+            'entity': 'event',
+            'event': name,
+            'created_at': created_at,
+            'payload': {
+                'payment': {'entity': {'id': payment_id, 'order_id': order_id, 'status': name.split('.')[-1]}},
+            },
+        }
+        if name == 'order.paid':
+            payload['payload']['order'] = {'entity': {'id': order_id, 'status': 'paid'}}
+        return json.dumps(payload).encode()
+
+    def http_sender(self, base_url):
+        import requests
+
+        local = threading.local()
+
+        def send(body, signature, event_id):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            response = local.session.post(
+                base_url.rstrip('/') + WEBHOOK_PATH,
+                data=body,
+                headers={
+                    'Content-Type': 'application/json',
+                    'X-Razorpay-Signature': signature,
+                    'X-Razorpay-Event-Id': event_id,
+                },
+            )
+            return response.status_code
+        return send
+
+    def client_sender(self):
+        from django.test import Client
+
+        local = threading.local()
+
+        def send(body, signature, event_id):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            response = local.client.post(
+                WEBHOOK_PATH,
+                data=body,
+                content_type='application/json',
+                HTTP_X_RAZORPAY_SIGNATURE=signature,
+                HTTP_X_RAZORPAY_EVENT_ID=event_id,
+            )
+            return response.status_code
+        return send
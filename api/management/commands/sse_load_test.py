@@ -0,0 +1,136 @@
+import asyncio
+import os
+import resource
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.events import record_status_changes
+from api.models import Order, User
+
+
+LOAD_USER = 'sse-load@load-test.invalid'
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, in clock ticks.
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Open many idle order-event streams against a running ASGI server and report "
+        "the server's CPU and memory while they sit idle, then time one event fanning out to all of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/orders/events/')
+        parser.add_argument('--subscribers', type=int, default=2000)
+        parser.add_argument('--idle', type=float, default=30.0, help="Seconds to hold the streams idle")
+        parser.add_argument('--server-pid', type=int, help="Server process to sample CPU and memory from")
+        parser.add_argument('--connect-concurrency', type=int, default=200)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError("Only plain http URLs are supported")
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < options['subscribers'] + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options['subscribers'] + 100), hard))
+
+        user, _ = User.objects.get_or_create(email=LOAD_USER, defaults={'name': 'SSE load test'})
+        order = Order.objects.create(user=user, total=0, status='pending')
+        try:
+            asyncio.run(self.run(url, str(AccessToken.for_user(user)), order, options))
+        finally:
+            order.delete()
+
+    async def run(self, url, token, order, options):
+        pid = options['server_pid']
+        request = (
+            f"GET {url.path or '/'} HTTP/1.1\r\nHost: {url.netloc}\r\n"
+            f"Authorization: Bearer {token}\r\nAccept: text/event-stream\r\n\r\n"
+        ).encode()
+        gate = asyncio.Semaphore(options['connect_concurrency'])
+        connected = asyncio.Event()
+        received = []
+        ready = 0
+
+        async def subscriber():
+            nonlocal ready
+            async with gate:
+                reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                writer.write(request)
+                status = await reader.readline()
+                if b' 200 ' not in status:
+                    raise CommandError(f"Stream refused: {status.decode().strip()}")
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+            ready += 1
+            if ready == options['subscribers']:
+                connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        return
+                    if line.startswith(b'event: order_status'):
+                        received.append(time.perf_counter())
+            finally:
+                writer.close()
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber()) for _ in range(options['subscribers'])]
+        waiter = asyncio.create_task(connected.wait())
+        await asyncio.wait([waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        if not connected.is_set():
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+        self.stdout.write(f"{ready} streams open in {time.perf_counter() - started:.1f}s")
+
+        cpu_before = cpu_seconds(pid) if pid else None
+        await asyncio.sleep(options['idle'])
+        if pid:
+            cpu = cpu_seconds(pid) - cpu_before
+            self.stdout.write(
+                f"idle {options['idle']:.0f}s: server CPU {cpu:.2f}s ({cpu / options['idle'] * 100:.1f}%), "
+                f"RSS {rss_mb(pid):.0f} MB"
+            )
+
+        def change_status():
+            with transaction.atomic():
+                order.status = 'cancelled'
+                order.save(update_fields=['status'])
+                record_status_changes([order])
+
+        sent = time.perf_counter()
+        await asyncio.to_thread(change_status)
+        deadline = sent + 30
+        while len(received) < ready and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        if received:
+            self.stdout.write(
+                f"event reached {len(received)}/{ready} streams, "
+                f"last after {(max(received) - sent) * 1000:.0f}ms"
+            )
+        else:
+            self.stdout.write(self.style.WARNING(
+                "No stream saw the event; the server needs ORDER_EVENTS_BACKEND=postgres to hear other processes"
+            ))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Sum
+
+from api.inventory import OutOfStock, reserve, set_stock
+from api.models import Category, Order, OrderItem, Product, StockReservation, StockShard, User
+
+
+EMAIL_DOMAIN = '@stress-checkout.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one limited product with concurrent checkouts, report throughput "
+        "and check that no unit was sold twice. Needs PostgreSQL; test data is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=2000)
+        parser.add_argument('--shards', type=int, default=8)
+        parser.add_argument('--workers', type=int, default=32)
+        parser.add_argument('--quantity', type=int, default=1, help="Units per checkout")
+        parser.add_argument('--naive', action='store_true',
+                            help="Lock the product row for the whole checkout instead, for comparison")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError("SQLite serializes all writers; run this against PostgreSQL")
+        category = Category.objects.create(name='stress-checkout', image='')
+        product = Product.objects.create(
+            name='Stress test dessert', brand='stress', price=1, description='', category=category, image=''
+        )
+        users = User.objects.bulk_create([
+            User(email=f'buyer-{i}{EMAIL_DOMAIN}', name=f'buyer {i}') for i in range(options['workers'])
+        ])
+        users = list(User.objects.filter(email__endswith=EMAIL_DOMAIN).order_by('id'))
+        set_stock(product.id, options['stock'], options['shards'])
+        try:
+            self.run(product, users, options)
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+            category.delete()
+
+    def run(self, product, users, options):
+        outcomes = Counter()
+        latencies = []
+        lock = threading.Lock()
+        start_line = threading.Barrier(len(users))
+
+        def buyer(user):
+            mine, times = Counter(), []
+            start_line.wait()
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            if options['naive']:
+                                Product.objects.select_for_update().get(pk=product.pk)
+                            order = Order.objects.create(user=user, total=product.price * options['quantity'], status='pending')
+                            items = [OrderItem.from_product(order, product, options['quantity'])]
+                            OrderItem.objects.bulk_create(items)
+                            reserve(order, items)
+                        mine['sold'] += 1
+                    except OutOfStock:
+                        mine['out of stock'] += 1
+                        break
+                    except DatabaseError:
+                        mine['errors'] += 1
+                    times.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+            with lock:
+                outcomes.update(mine)
+                latencies.extend(times)
+
+        threads = [threading.Thread(target=buyer, args=(user,)) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        remaining = StockShard.objects.filter(product=product).aggregate(total=Sum('available'))['total'] or 0
+        held = StockReservation.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+        sold_units = outcomes['sold'] * options['quantity']
+        latencies.sort()
+
+        mode = 'naive row lock' if options['naive'] else f"{options['shards']} shards"
+        self.stdout.write(
+            f"{mode}, "
+            f"{len(users)} workers: {outcomes['sold']} checkouts in {elapsed:.2f}s "
+            f"({outcomes['sold'] / elapsed:.0f}/s), {outcomes['errors']} errors"
+        )
+        if latencies:
+            self.stdout.write(
+                f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms"
+            )
+        self.stdout.write(f"stock {options['stock']}, sold {sold_units}, reserved {held}, left {remaining}")
+        if sold_units != held or held + remaining != options['stock'] or sold_units > options['stock']:
+            raise CommandError("Stock accounting mismatch: units were oversold or lost")
+        self.stdout.write(self.style.SUCCESS("No overselling."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Run the worker warm-up steps and report how long each takes."
+
+    def handle(self, *args, **options):
+        timings = warm_up()
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name:<12} {seconds * 1000:8.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"Warm-up done in {sum(timings.values()) * 1000:.1f} ms."))
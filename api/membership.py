@@ -0,0 +1,60 @@
+"""Per-user wishlist and cart membership for product responses.
+
+Product bodies are the same for every user. ``is_wishlisted`` and
+``cart_quantity`` are added on top from a small cached record of the
+user's wishlisted product ids and cart quantities, which wishlist and cart
+writes invalidate once their transaction commits.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .fieldsets import requested_extras
+from .models import Cart, Wishlist
+
+
+MEMBERSHIP_FIELDS = ('is_wishlisted', 'cart_quantity')
+
+
+def _key(user_id):
+    return f'membership:{user_id}'
+
+
+def get_membership(user_id):
+    """``(wishlisted product ids, {product id: cart quantity})`` for the user."""
+    membership = cache.get(_key(user_id))
+    if membership is None:
+        membership = (
+            frozenset(Wishlist.objects.filter(user_id=user_id).values_list('product_id', flat=True)),
+            dict(
+                Cart.objects.filter(user_id=user_id).values('product_id')
+                .annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+            ),
+        )
+        cache.set(_key(user_id), membership, settings.MEMBERSHIP_CACHE_SECONDS)
+    return membership
+
+
+def invalidate_membership(user_id):
+    transaction.on_commit(lambda: cache.delete(_key(user_id)))
+
+
+def with_membership(data, request):
+    """Add the requested membership flags to one serialized product or a list of them."""
+    extras = requested_extras(request, MEMBERSHIP_FIELDS)
+    if not extras or not request.user.is_authenticated:
+        return data
+    wishlist, cart = get_membership(request.user.pk)
+
+    def add(product):
+        product = dict(product)
+        if 'is_wishlisted' in extras:
+            product['is_wishlisted'] = product['id'] in wishlist
+        if 'cart_quantity' in extras:
+            product['cart_quantity'] = cart.get(product['id'], 0)
+        return product
+
+    if isinstance(data, list):
+        return [add(product) for product in data]
+    return add(data)
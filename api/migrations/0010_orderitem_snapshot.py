@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('api', 'OrderItem')
+    items = OrderItem.objects.filter(product__isnull=False).select_related('product__category')
+    batch = []
+    for item in items.iterator(chunk_size=1000):
+        item.product_name = item.product.name
+        item.product_brand = item.product.brand
+        item.product_image = item.product.image.name or ''
+        item.category_name = item.product.category.name
+        batch.append(item)
+        if len(batch) >= 1000:
+            OrderItem.objects.bulk_update(batch, ['product_name', 'product_brand', 'product_image', 'category_name'])
+            batch = []
+    if batch:
+        OrderItem.objects.bulk_update(batch, ['product_name', 'product_brand', 'product_image', 'category_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='category_name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_brand',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.product'),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
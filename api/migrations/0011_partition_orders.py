@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:08
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def partition_orders(apps, schema_editor):
+    # Declarative partitioning is PostgreSQL only; other backends keep the plain table.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT date_trunc('month', COALESCE(MIN(created_at), now()) AT TIME ZONE 'UTC')::date, "
+            "(date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months')::date, "
+            "COALESCE(MAX(id), 0) FROM api_order"
+        )
+        first, last, max_id = cursor.fetchone()
+        statements = [
+            "ALTER TABLE api_order RENAME TO api_order_unpartitioned",
+            "CREATE SEQUENCE IF NOT EXISTS api_order_partitioned_id_seq",
+            "SELECT setval('api_order_partitioned_id_seq', %d, true)" % (max_id or 1),
+            "CREATE TABLE api_order (LIKE api_order_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)",
+            "ALTER TABLE api_order ALTER COLUMN id SET DEFAULT nextval('api_order_partitioned_id_seq')",
+            "ALTER SEQUENCE api_order_partitioned_id_seq OWNED BY api_order.id",
+            "ALTER TABLE api_order ADD CONSTRAINT api_order_pkey_partitioned PRIMARY KEY (id, created_at)",
+            "ALTER TABLE api_order ADD CONSTRAINT api_order_user_id_fk_partitioned FOREIGN KEY (user_id) "
+            "REFERENCES api_user (id) DEFERRABLE INITIALLY DEFERRED",
+            "CREATE INDEX api_order_user_id_partitioned ON api_order (user_id)",
+            "CREATE TABLE api_order_default PARTITION OF api_order DEFAULT",
+        ]
+        month = first
+        while month <= last:
+            following = (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+            statements.append(
+                f"CREATE TABLE api_order_p{month:%Y_%m} PARTITION OF api_order "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{following:%Y-%m-%d} 00:00:00+00')"
+            )
+            month = following
+        statements += [
+            "INSERT INTO api_order SELECT * FROM api_order_unpartitioned",
+            "DROP TABLE api_order_unpartitioned",
+        ]
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def unpartition_orders(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in [
+            "ALTER TABLE api_order RENAME TO api_order_partitioned",
+            "CREATE TABLE api_order (LIKE api_order_partitioned INCLUDING DEFAULTS)",
+            "ALTER TABLE api_order ADD PRIMARY KEY (id)",
+            "ALTER TABLE api_order ADD CONSTRAINT api_order_user_id_fk_unpartitioned FOREIGN KEY (user_id) "
+            "REFERENCES api_user (id) DEFERRABLE INITIALLY DEFERRED",
+            "CREATE INDEX api_order_user_id_unpartitioned ON api_order (user_id)",
+            "ALTER SEQUENCE api_order_partitioned_id_seq OWNED BY api_order.id",
+            "INSERT INTO api_order SELECT * FROM api_order_partitioned",
+            "DROP TABLE api_order_partitioned CASCADE",
+        ]:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_orderitem_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='api.order'),
+        ),
+        migrations.RunPython(partition_orders, unpartition_orders),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_wishlist_counts(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    Wishlist = apps.get_model('api', 'Wishlist')
+    wishlisted = (
+        Wishlist.objects.filter(product=models.OuterRef('pk'))
+        .values('product').annotate(n=models.Count('id')).values('n')
+    )
+    Product.objects.update(wishlist_count=Coalesce(models.Subquery(wishlisted), models.Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sales_count_30d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sales_count_7d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='wishlist_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', '-sales_count_7d', 'id'], name='product_sales_7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', '-sales_count_30d', 'id'], name='product_sales_30d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', '-wishlist_count', 'id'], name='product_wishlist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='productdailysales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productdailysales',
+            index=models.Index(fields=['day'], name='productdailysales_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_day_sales'),
+        ),
+        migrations.RunPython(backfill_wishlist_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+def backfill_change_seq(apps, schema_editor):
+    JobCheckpoint = apps.get_model('api', 'JobCheckpoint')
+    seq = 0
+    for model_name in ('Category', 'Product'):
+        model = apps.get_model('api', model_name)
+        ids = list(model.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), 1000):
+            seq += 1
+            model.objects.filter(id__in=ids[start:start + 1000]).update(change_seq=seq)
+    JobCheckpoint.objects.update_or_create(name='catalog.change_seq', defaults={'value': seq})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_order_status_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'Product'), ('category', 'Category')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('change_seq', models.BigIntegerField(db_index=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_catalog_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('archived_at__isnull', False)), fields=['archived_at'], name='product_archived_idx'),
+        ),
+    ]
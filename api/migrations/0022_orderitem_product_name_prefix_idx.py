@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_prefix_index(apps, schema_editor):
+    # Serves the admin's case-insensitive prefix search on product_name,
+    # which Django runs as UPPER(product_name::text) LIKE 'X%'.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS orderitem_product_name_prefix_idx "
+        "ON api_orderitem (UPPER(product_name::text) text_pattern_ops)"
+    )
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS orderitem_product_name_prefix_idx")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('api', '0021_request_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_orderitem_product_name_prefix_idx'),
+    ]
+
+    operations = [
+        # Existing carts count as touched now, so the first retention run
+        # after deploying does not delete them.
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_paymentevent_retries'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='productdailysales',
+            name='unique_product_day_sales',
+        ),
+        migrations.AddField(
+            model_name='productdailysales',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day', 'shard'), name='unique_product_day_shard_sales'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:25
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('api', 'OrderItem')
+    Product = apps.get_model('api', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    OrderItem.objects.filter(product__isnull=False).update(
+        product_description=Subquery(product.values('description')[:1]),
+        product_category_id=Subquery(product.values('category_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_productdailysales_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_category_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_description',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
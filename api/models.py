@@ -1,4 +1,8 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager,PermissionsMixin
 
 
@@ -46,6 +50,8 @@ class User(AbstractBaseUser, PermissionsMixin):
 class Category(models.Model):
     name = models.CharField(max_length=100)
     image = models.ImageField(upload_to="categories/")
+    # Catalog change sequence of the last write, see api.catalog.
+    change_seq = models.BigIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return self.name
@@ -60,6 +66,27 @@ class Product(models.Model):
     image = models.ImageField(upload_to='products/')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     active = models.BooleanField(default=True)
+    # Set when the product is deleted; archived products are also inactive.
+    # See api.archival.
+    archived_at = models.DateTimeField(null=True, blank=True)
+    # Maintained by api.popularity; the sales windows are re-derived from
+    # ProductDailySales by refresh_popularity, never in a payment.
+    sales_count_7d = models.IntegerField(default=0)
+    sales_count_30d = models.IntegerField(default=0)
+    wishlist_count = models.IntegerField(default=0)
+    # Catalog change sequence of the last write, see api.catalog.
+    change_seq = models.BigIntegerField(default=0, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', '-sales_count_7d', 'id'], name='product_sales_7d_idx'),
+            models.Index(fields=['active', '-sales_count_30d', 'id'], name='product_sales_30d_idx'),
+            models.Index(fields=['active', '-wishlist_count', 'id'], name='product_wishlist_idx'),
+            models.Index(fields=['active', 'price', 'id'], name='product_price_idx'),
+            models.Index(
+                fields=['archived_at'], name='product_archived_idx', condition=models.Q(archived_at__isnull=False)
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -69,6 +96,7 @@ class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Wishlist(models.Model):
@@ -84,6 +112,8 @@ class Order(models.Model):
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
     )
+    # A cancelled order has released its stock; an admin cannot reopen it.
+    FINAL_STATUSES = {'cancelled'}
     user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='orders')
     total = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
@@ -91,10 +121,264 @@ class Order(models.Model):
     razorpay_order_id = models.CharField(max_length=100, blank=True, null=True)
     razorpay_payment_id = models.CharField(max_length=100, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_at_idx'),
+            models.Index(fields=['total'], name='order_total_idx'),
+        ]
+
 
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # No database constraint: on PostgreSQL api_order is partitioned by
+    # created_at, so its primary key is (id, created_at).
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    # Snapshot of the product taken when the order is placed, so order
+    # history renders without touching Product and survives its deletion.
+    product_name = models.CharField(max_length=100, blank=True, default='')
+    product_brand = models.CharField(max_length=100, blank=True, default='')
+    product_image = models.CharField(max_length=255, blank=True, default='')
+    product_description = models.TextField(blank=True, default='')
+    # Not a foreign key: the category may be deleted after the order.
+    product_category_id = models.BigIntegerField(null=True, blank=True)
+    category_name = models.CharField(max_length=100, blank=True, default='')
+
+    @classmethod
+    def from_product(cls, order, product, quantity):
+        return cls(
+            order=order,
+            product=product,
+            quantity=quantity,
+            price=product.price,
+            product_name=product.name,
+            product_brand=product.brand,
+            product_image=product.image.name or '',
+            product_description=product.description,
+            product_category_id=product.category_id,
+            category_name=product.category.name,
+        )
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still being processed.
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # When the request processing the key took it. Past IDEMPOTENCY_LEASE
+    # without a result, that request is presumed dead and a retry takes over.
+    claimed_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+
+class PaymentEvent(models.Model):
+    """Raw Razorpay webhook event, stored on receipt and applied later by a worker."""
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=50)
+    razorpay_order_id = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    payload = models.JSONField()
+    occurred_at = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, blank=True, default='')
+    # Events for an order not committed yet are retried with backoff.
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['occurred_at'],
+                name='paymentevent_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+
+class ProductCoPurchase(models.Model):
+    """How many orders contained both products. Stored in both directions."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_copurchase_pair'),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """Top-K co-purchased products per product, rebuilt by build_recommendations."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='relatedproduct_lookup_idx'),
+        ]
+
+
+class JobCheckpoint(models.Model):
+    """High-water mark of an incremental background job."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductDailySales(models.Model):
+    """Units sold per product per order day, for rolling popularity windows.
+
+    A day's sales are spread over a few shard rows so concurrent payments
+    of a hot product rarely update the same row.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day', 'shard'], name='unique_product_day_shard_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='productdailysales_day_idx'),
+        ]
+
+
+class StockShard(models.Model):
+    """Part of a product's available stock.
+
+    Products without shards are not stock-tracked. Hot products get several
+    shards so concurrent checkouts decrement different rows.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField(default=0)
+    available = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='unique_stock_shard'),
+            models.CheckConstraint(condition=models.Q(available__gte=0), name='stock_shard_available_gte_0'),
+        ]
+
+
+class StockReservation(models.Model):
+    HELD = 'held'
+    CONFIRMED = 'confirmed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations', db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['expires_at'],
+                name='stockreservation_held_idx',
+                condition=models.Q(status='held'),
+            ),
+        ]
+
+
+class OrderStatusEvent(models.Model):
+    """A committed order status change, streamed to the order's owner."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events', db_constraint=False)
+    status = models.CharField(max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='orderstatusevent_user_idx'),
+        ]
+
+
+class CatalogTombstone(models.Model):
+    """A deleted or archived product or a deleted category, kept so delta syncs can report it."""
+    KIND_CHOICES = [
+        ('product', 'Product'),
+        ('category', 'Category'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField(db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+
+class RequestProfile(models.Model):
+    """One request profiled on an admin's request, see api.profiling."""
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField()
+    sql_ms = models.FloatField()
+    serializer_ms = models.FloatField()
+    samples = models.PositiveIntegerField()
+    # Folded stacks, one "root;...;leaf count" line per distinct stack.
+    stacks = models.TextField(blank=True, default='')
+    queries = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ImageUpload(models.Model):
+    """A product or category image on its way to storage, see api.uploads."""
+    UPLOADING = 'uploading'
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+    KIND_CHOICES = [
+        ('product', 'Product'),
+        ('category', 'Category'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
+    error = models.CharField(max_length=255, blank=True, default='')
+    # Storage name of the processed image once ready.
+    image = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='imageupload_queued_idx', condition=models.Q(status='queued')),
+        ]
@@ -0,0 +1,152 @@
+"""Monthly range partitions of ``api_order`` on PostgreSQL.
+
+Partitions are named ``api_order_pYYYY_MM`` and cover one calendar month of
+``created_at`` in UTC. Rows outside every partition land in ``api_order_default``.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OrderItem, OrderStatusEvent, StockReservation
+
+
+PARENT_TABLE = 'api_order'
+DEFAULT_PARTITION = 'api_order_default'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def history_start(months=None):
+    """Start of the oldest of the last ``months`` monthly partitions (``ORDER_HISTORY_MONTHS`` by default).
+
+    Filtering ``created_at`` from here lets PostgreSQL skip every older partition.
+    """
+    months = months or settings.ORDER_HISTORY_MONTHS
+    first = add_months(month_start(timezone.now().astimezone(dt_timezone.utc)), -(months - 1))
+    return datetime.combine(first, time.min, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_p{month:%Y_%m}'
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s",
+            [PARENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Return ``[(name, month, estimated_rows)]`` for the monthly partitions, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, c.reltuples FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [PARENT_TABLE],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    prefix = PARENT_TABLE + '_p'
+    for name, estimate in rows:
+        if not name.startswith(prefix):
+            continue
+        year, month = name[len(prefix):].split('_')
+        partitions.append((name, date(int(year), int(month), 1), max(int(estimate), 0)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(month):
+    """Create the partition for ``month``, moving matching rows out of the default partition."""
+    name = partition_name(month)
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return False
+        cursor.execute(f'CREATE TABLE "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS)')
+        range_filter = f'created_at >= {lower} AND created_at < {upper}'
+        cursor.execute(f'INSERT INTO "{name}" SELECT * FROM "{DEFAULT_PARTITION}" WHERE {range_filter}')
+        cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE {range_filter}')
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM ({lower}) TO ({upper})'
+        )
+    return True
+
+
+def ensure_partitions(first_month, last_month):
+    created = []
+    month = first_month
+    while month <= last_month:
+        if create_partition(month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def archive_partition(name, archive_dir, drop=True, batch_size=1000):
+    """Export a partition with its items to gzipped JSON lines, then detach it.
+
+    The export runs before the detach so the parent table is only locked for
+    the detach itself. Their foreign keys have no database constraint, so the
+    items, status events and stock reservations of the archived orders are
+    deleted in batches afterwards; items and status events are in the export.
+    Returns ``(path, order_count)``.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.jsonl.gz')
+    order_ids = []
+    with gzip.open(path, 'wt', encoding='utf-8') as out, connection.cursor() as cursor:
+        cursor.execute(f'SELECT * FROM "{name}" ORDER BY id')
+        columns = [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            orders = [dict(zip(columns, row)) for row in rows]
+            ids = [o['id'] for o in orders]
+            items, events = {}, {}
+            for item in OrderItem.objects.filter(order_id__in=ids).values():
+                items.setdefault(item['order_id'], []).append(item)
+            for event in OrderStatusEvent.objects.filter(order_id__in=ids).order_by('id').values():
+                events.setdefault(event['order_id'], []).append(event)
+            for order in orders:
+                order['items'] = items.get(order['id'], [])
+                order['status_events'] = events.get(order['id'], [])
+                out.write(json.dumps(order, cls=DjangoJSONEncoder) + '\n')
+                order_ids.append(order['id'])
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"')
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        for model in (OrderItem, OrderStatusEvent, StockReservation):
+            model.objects.filter(order_id__in=batch).delete()
+    if drop:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE "{name}"')
+    return path, len(order_ids)
@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .clients import razorpay_client
+from .models import Order, PaymentEvent
+from .events import record_status_changes
+from .inventory import OutOfStock, reserve, settle
+from .popularity import record_sales, sales_sign
+
+
+logger = logging.getLogger(__name__)
+
+
+# Order status each Razorpay event moves the order to.
+EVENT_STATUS = {
+    'payment.captured': 'completed',
+    'order.paid': 'completed',
+    'refund.processed': 'cancelled',
+}
+
+# Webhooks can arrive out of order, so a status is only applied when the
+# order is in one of these earlier states. A late payment.captured can't
+# undo a refund, and nothing overrides a manual shipped/delivered.
+ALLOWED_FROM = {
+    'completed': {'pending'},
+    'cancelled': {'pending', 'completed', 'processing'},
+}
+
+
+def verify_webhook_signature(body, signature, secret=None):
+    secret = secret or settings.RAZORPAY_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def can_transition(current, new):
+    return current in ALLOWED_FROM.get(new, ())
+
+
+def apply_payment_status(order, new_status, payment_id=None):
+    """Move ``order`` to ``new_status`` if allowed. Does not save."""
+    if not can_transition(order.status, new_status):
+        return False
+    order.status = new_status
+    if payment_id:
+        order.razorpay_payment_id = payment_id
+    return True
+
+
+# complete_payment outcomes.
+APPLIED = 'applied'
+ALREADY_PAID = 'already_paid'
+SOLD_OUT = 'sold_out'
+STALE = 'stale'
+
+
+def is_late_payment(order, new_status):
+    """Whether a payment is for an order cancelled before it was ever paid.
+
+    That is what the reservation sweeper leaves behind when the customer pays
+    after the stock hold expired; the payment still went through.
+    """
+    return new_status == 'completed' and order.status == 'cancelled' and not order.razorpay_payment_id
+
+
+def take_stock_again(order):
+    """Reserve a cancelled order's items again. Returns False when one has sold out."""
+    try:
+        with transaction.atomic():
+            reserve(order, list(order.items.all()))
+    except OutOfStock:
+        return False
+    return True
+
+
+def refund_payment(payment_id):
+    """Refund a captured payment in full. Returns False, after logging, if that failed."""
+    try:
+        razorpay_client().payment.refund(payment_id, {})
+    except Exception:
+        logger.exception("Refund of payment %s failed; it must be refunded by hand", payment_id)
+        return False
+    return True
+
+
+def complete_payment(order, payment_id):
+    """Record ``payment_id`` as paying for ``order``, which must be locked.
+
+    Returns APPLIED, or ALREADY_PAID when the order already has this payment.
+    A late payment for a swept order takes its stock again and completes it;
+    if an item sold out meanwhile, the order stays cancelled with the payment
+    recorded, and SOLD_OUT tells the caller to refund it. Anything else is
+    STALE and changes nothing.
+    """
+    previous = order.status
+    if is_late_payment(order, 'completed'):
+        order.razorpay_payment_id = payment_id
+        if not take_stock_again(order):
+            order.save(update_fields=['razorpay_payment_id'])
+            return SOLD_OUT
+        order.status = 'completed'
+    elif not apply_payment_status(order, 'completed', payment_id):
+        if order.razorpay_payment_id == payment_id and order.status != 'cancelled':
+            return ALREADY_PAID
+        return STALE
+    order.save(update_fields=['status', 'razorpay_payment_id'])
+    record_sales([order], sales_sign(previous, order.status))
+    settle([order])
+    record_status_changes([order])
+    return APPLIED
+
+
+def _entity(payload, name):
+    for key in ('payload', name, 'entity'):
+        payload = payload.get(key) if isinstance(payload, dict) else None
+    return payload if isinstance(payload, dict) else {}
+
+
+def _text(value, field):
+    if not isinstance(value, str) or len(value) > PaymentEvent._meta.get_field(field).max_length:
+        raise ValueError(f"Invalid {field}")
+    return value
+
+
+def parse_event(body, event_id=None):
+    """Build an unsaved PaymentEvent from a raw webhook body. Raises ValueError or TypeError."""
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Payload must be a JSON object")
+    payment = _entity(payload, 'payment')
+    order_id = payment.get('order_id') or _entity(payload, 'order').get('id') or ''
+    created = payload.get('created_at')
+    try:
+        occurred_at = datetime.fromtimestamp(created, tz=dt_timezone.utc) if created else timezone.now()
+    except (OverflowError, OSError):
+        raise ValueError("Invalid created_at")
+    return PaymentEvent(
+        event_id=event_id or hashlib.sha256(body).hexdigest(),
+        event=_text(payload.get('event', ''), 'event'),
+        razorpay_order_id=_text(order_id, 'razorpay_order_id'),
+        payload=payload,
+        occurred_at=occurred_at,
+    )
+
+
+def retry_delay(attempts):
+    return settings.PAYMENT_EVENT_RETRY_BASE * 2 ** (attempts - 1)
+
+
+def process_pending_events(batch_size=200):
+    """Apply one batch of due unprocessed events to their orders. Returns the batch size.
+
+    An event whose order does not exist yet stays unprocessed and is retried
+    with backoff, as the webhook may have beaten the order's commit.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.filter(processed_at__isnull=True)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by('occurred_at', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+        orders = {
+            order.razorpay_order_id: order
+            for order in Order.objects.filter(
+                razorpay_order_id__in={e.razorpay_order_id for e in events if e.razorpay_order_id}
+            ).select_for_update()
+        }
+        original = {order.pk: order.status for order in orders.values()}
+        changed = {}
+        refunds = []
+        for event in events:
+            order = orders.get(event.razorpay_order_id)
+            new_status = EVENT_STATUS.get(event.event)
+            event.attempts += 1
+            if order is None:
+                event.outcome = 'unmatched'
+                if event.razorpay_order_id and event.attempts < settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+                    event.next_attempt_at = now + retry_delay(event.attempts)
+                    continue
+            elif new_status is None:
+                event.outcome = 'ignored'
+            elif is_late_payment(order, new_status) and _entity(event.payload, 'payment').get('id'):
+                order.razorpay_payment_id = _entity(event.payload, 'payment')['id']
+                changed[order.pk] = order
+                if take_stock_again(order):
+                    order.status = new_status
+                    event.outcome = 'applied'
+                else:
+                    refunds.append(order.razorpay_payment_id)
+                    event.outcome = SOLD_OUT
+            elif apply_payment_status(order, new_status, _entity(event.payload, 'payment').get('id')):
+                event.outcome = 'applied'
+                changed[order.pk] = order
+            else:
+                event.outcome = 'stale'
+            event.processed_at = now
+
+        if changed:
+            Order.objects.bulk_update(changed.values(), ['status', 'razorpay_payment_id'])
+            for sign in (1, -1):
+                record_sales(
+                    [o for o in changed.values() if sales_sign(original[o.pk], o.status) == sign], sign
+                )
+            settle(changed.values())
+            record_status_changes([o for o in changed.values() if o.status != original[o.pk]])
+        PaymentEvent.objects.bulk_update(events, ['outcome', 'processed_at', 'attempts', 'next_attempt_at'])
+    for payment_id in refunds:
+        refund_payment(payment_id)
+    return len(events)
@@ -0,0 +1,153 @@
+"""Per-product popularity counters used to sort the product list.
+
+Payments and status changes only add their units to ProductDailySales, per
+order day, so they never lock the product rows the catalog reads and edits.
+``refresh`` (run every few minutes by ``refresh_popularity``) derives the
+rolling ``sales_count_7d``/``sales_count_30d`` columns from the daily rows,
+which also lets old sales fall out of the window, and recounts
+``wishlist_count``; it only writes the products whose counts changed.
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from .models import OrderItem, Product, ProductDailySales, Wishlist
+
+
+# Statuses of an order whose items count as sold.
+SOLD_STATUSES = {'completed', 'processing', 'shipped', 'delivered'}
+
+WINDOWS = {'sales_count_7d': 7, 'sales_count_30d': 30}
+
+# Rows per product and day; each record_sales call adds to a random one.
+SALES_SHARDS = 4
+
+# ?sort= values for the product list. Each matches an index on Product.
+PRODUCT_SORTS = {
+    'bestselling': ('-sales_count_30d', 'id'),
+    'trending': ('-sales_count_7d', 'id'),
+    'most_wishlisted': ('-wishlist_count', 'id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+}
+
+
+def _today():
+    return timezone.now().astimezone(dt_timezone.utc).date()
+
+
+def _order_day(order):
+    return order.created_at.astimezone(dt_timezone.utc).date()
+
+
+def sales_sign(old_status, new_status):
+    """+1 when an order becomes sold, -1 when a sold order is cancelled, else 0."""
+    return (new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES)
+
+
+def _add_daily(product_id, day, shard, quantity):
+    rows = ProductDailySales.objects.filter(product_id=product_id, day=day, shard=shard)
+    if rows.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with transaction.atomic():
+            ProductDailySales.objects.create(product_id=product_id, day=day, shard=shard, quantity=quantity)
+    except IntegrityError:
+        rows.update(quantity=F('quantity') + quantity)
+
+
+def record_sales(orders, sign=1):
+    """Add the units in ``orders`` to the daily sales, or remove them with ``sign=-1``.
+
+    Sales are bucketed on the order's creation day, so a later cancellation
+    takes the units back out of the same bucket and windows. The product
+    columns catch up on the next ``refresh``.
+    """
+    if not sign:
+        return
+    days = {order.pk: _order_day(order) for order in orders}
+    if not days:
+        return
+
+    per_day = defaultdict(int)
+    for order_id, product_id, quantity in OrderItem.objects.filter(
+        order_id__in=list(days), product__isnull=False
+    ).values_list('order_id', 'product_id', 'quantity'):
+        per_day[(product_id, days[order_id])] += sign * quantity
+
+    shard = random.randrange(SALES_SHARDS)
+    # Sorted so concurrent writers lock rows in the same order.
+    for (product_id, day), quantity in sorted(per_day.items()):
+        if quantity:
+            _add_daily(product_id, day, shard, quantity)
+
+
+def record_wishlist(product_id, delta):
+    if delta:
+        Product.objects.filter(pk=product_id).update(wishlist_count=F('wishlist_count') + delta)
+
+
+def _wishlisted():
+    return Coalesce(Subquery(
+        Wishlist.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(n=Count('id')).values('n')
+    ), Value(0))
+
+
+def recount_wishlists(product_ids):
+    Product.objects.filter(pk__in=product_ids).update(wishlist_count=_wishlisted())
+
+
+def refresh(today=None):
+    """Recompute the sales windows and wishlist counts and drop expired daily rows.
+
+    Only rows whose counts changed are written; returns how many writes that
+    took, one per product and count.
+    """
+    today = today or _today()
+    changed = 0
+    for field, length in WINDOWS.items():
+        since = today - timedelta(days=length - 1)
+        in_window = ProductDailySales.objects.filter(day__gte=since, day__lte=today)
+        total = Greatest(Coalesce(Subquery(
+            in_window.filter(product=OuterRef('pk'))
+            .values('product').annotate(total=Sum('quantity')).values('total')
+        ), Value(0)), Value(0))
+        stale = Product.objects.filter(~Q(**{field: 0}) | Q(pk__in=in_window.values('product'))).exclude(
+            **{field: total}
+        )
+        changed += stale.update(**{field: total})
+
+    changed += Product.objects.exclude(wishlist_count=_wishlisted()).update(wishlist_count=_wishlisted())
+
+    oldest = today - timedelta(days=max(WINDOWS.values()) - 1)
+    ProductDailySales.objects.filter(day__lt=oldest).delete()
+    return changed
+
+
+def rebuild(today=None):
+    """Rebuild the daily sales rows from order history, then ``refresh``."""
+    today = today or _today()
+    oldest = today - timedelta(days=max(WINDOWS.values()) - 1)
+    rows = (
+        OrderItem.objects.filter(
+            order__status__in=SOLD_STATUSES,
+            order__created_at__gte=datetime.combine(oldest, time.min, tzinfo=dt_timezone.utc),
+            product__isnull=False,
+        )
+        .annotate(day=TruncDate('order__created_at', tzinfo=dt_timezone.utc))
+        .values('product_id', 'day')
+        .annotate(quantity=Sum('quantity'))
+    )
+    with transaction.atomic():
+        ProductDailySales.objects.all().delete()
+        ProductDailySales.objects.bulk_create(
+            [ProductDailySales(product_id=r['product_id'], day=r['day'], quantity=r['quantity']) for r in rows],
+            batch_size=1000,
+        )
+        return refresh(today)
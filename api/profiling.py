@@ -0,0 +1,256 @@
+"""On-demand profiling of single requests, for admins.
+
+An admin gets a signed token from ``POST /api/admin/profiles/token/`` and
+sends it back in the ``X-Profile`` header (or ``?_profile=``) of the
+request to look at. That one request is then run under a sampling
+profiler with every SQL statement logged, and stored as a RequestProfile
+whose stacks download as a folded file for flamegraph.pl or speedscope.
+
+Requests without the header only pay for one header lookup; with
+``REQUEST_PROFILING`` off the middleware is not installed at all.
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from functools import lru_cache
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import close_old_connections, connections
+
+from .models import RequestProfile, User
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+TOKEN_SALT = 'api.profiling'
+MAX_QUERIES = 2000
+MAX_SQL_LENGTH = 4000
+ORIGIN_FRAMES = 5
+
+# Samples inside these files count as serializer time.
+SERIALIZER_FILES = ('rest_framework/serializers.py', 'api/serializers.py', 'api/fastpath.py', 'api/fieldsets.py')
+
+
+def make_token(user):
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user.pk))
+
+
+def token_user_id(token):
+    """The admin a profiling token was issued to, or None if it is invalid or expired."""
+    try:
+        user_id = int(signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.REQUEST_PROFILE_TOKEN_MAX_AGE
+        ))
+    except (signing.BadSignature, ValueError):
+        return None
+    if not User.objects.filter(pk=user_id, role='admin', is_active=True).exists():
+        return None
+    return user_id
+
+
+def _request_token(request):
+    token = request.META.get('HTTP_X_PROFILE')
+    if token is None and PROFILE_PARAM in request.META.get('QUERY_STRING', ''):
+        token = request.GET.get(PROFILE_PARAM)
+    return token
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename):
+    path = Path(filename)
+    if 'site-packages' in path.parts:
+        return '/'.join(path.parts[path.parts.index('site-packages') + 1:])
+    try:
+        return str(path.relative_to(settings.BASE_DIR))
+    except ValueError:
+        return path.name
+
+
+def _label(code):
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    """Records the stack of one thread every ``interval`` seconds."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+    def folded(self):
+        """Stacks in the folded format: ``root;...;leaf count`` per line."""
+        return ''.join(
+            f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.stacks.items())
+        )
+
+    def share(self, files):
+        """Fraction of samples with a frame in any of ``files``."""
+        total = sum(self.stacks.values())
+        if not total:
+            return 0.0
+        hits = sum(
+            count for stack, count in self.stacks.items()
+            if any(f"({path}:" in label for label in stack for path in files)
+        )
+        return hits / total
+
+
+def _origin():
+    """The innermost project frames that led to a query."""
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(str(settings.BASE_DIR))
+        and 'site-packages' not in frame.filename
+        and not frame.filename.endswith('profiling.py')
+    ]
+    return [
+        f"{_short_path(frame.filename)}:{frame.lineno} in {frame.name}" for frame in frames[-ORIGIN_FRAMES:]
+    ]
+
+
+class QueryLog:
+    """``execute_wrapper`` that times every statement and notes where it came from."""
+
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self.total = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.total += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({
+                    'db': context['connection'].alias,
+                    'sql': sql[:MAX_SQL_LENGTH],
+                    'ms': round(elapsed * 1000, 3),
+                    'many': many,
+                    'origin': _origin(),
+                })
+
+
+def profile_request(request, get_response, user_id):
+    """Run ``get_response(request)`` in this thread under the profiler and store the result."""
+    queries = QueryLog()
+    sampler = Sampler(threading.get_ident(), settings.REQUEST_PROFILE_INTERVAL)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(queries))
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = get_response(request)
+        finally:
+            sampler.stop()
+            duration = time.perf_counter() - started
+
+    try:
+        profile = save_profile(request, response, user_id, duration, sampler, queries)
+    except Exception:
+        logger.exception("Could not store the profile of %s %s", request.method, request.path)
+    else:
+        response['X-Profile-Id'] = str(profile.pk)
+    return response
+
+
+def _profiled_path(request):
+    if PROFILE_PARAM not in request.GET:
+        return request.get_full_path()
+    params = request.GET.copy()
+    del params[PROFILE_PARAM]
+    return f"{request.path}?{params.urlencode()}" if params else request.path
+
+
+def save_profile(request, response, user_id, duration, sampler, queries):
+    profile = RequestProfile.objects.create(
+        user_id=user_id,
+        method=request.method,
+        path=_profiled_path(request)[:500],
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        sql_count=queries.count,
+        sql_ms=queries.total * 1000,
+        serializer_ms=duration * 1000 * sampler.share(SERIALIZER_FILES),
+        samples=sum(sampler.stacks.values()),
+        stacks=sampler.folded(),
+        queries=queries.queries,
+    )
+    keep = settings.REQUEST_PROFILE_KEEP
+    oldest_kept = RequestProfile.objects.order_by('-id').values_list('id', flat=True)[keep - 1:keep]
+    RequestProfile.objects.filter(id__lt=oldest_kept).delete()
+    return profile
+
+
+class RequestProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _request_token(request)
+        if token is None:
+            return self.get_response(request)
+        user_id = token_user_id(token)
+        if user_id is None:
+            return self.get_response(request)
+        return profile_request(request, self.get_response, user_id)
+
+    async def __acall__(self, request):
+        token = _request_token(request)
+        if token is None:
+            return await self.get_response(request)
+        user_id = await sync_to_async(token_user_id)(token)
+        if user_id is None:
+            return await self.get_response(request)
+
+        # Run the rest of the chain from a worker thread. Sync views called
+        # from inside async_to_sync come back to that same thread, so the
+        # sampler and the query log see them.
+        def run():
+            close_old_connections()
+            try:
+                return profile_request(request, async_to_sync(self.get_response), user_id)
+            finally:
+                close_old_connections()
+        return await sync_to_async(run, thread_sensitive=False)()
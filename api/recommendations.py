@@ -0,0 +1,148 @@
+"""Offline "frequently bought together" counts.
+
+Line items are streamed in order-id order, turned into per-order product
+sets and counted as sparse pairs. Runs are incremental: only orders above
+the last checkpoint are read, their pair counts are added to
+ProductCoPurchase, and top-K neighbours are rebuilt only for the products
+whose counts changed.
+"""
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from dessertshop_backend.cache import invalidate_tags
+
+from .models import JobCheckpoint, Order, OrderItem, ProductCoPurchase, RelatedProduct
+from .popularity import SOLD_STATUSES
+
+
+CHECKPOINT = 'recommendations.last_order_id'
+RECOMMENDATIONS_TAG = 'recommendations'
+
+
+def _order_baskets(after_id, until_id, chunk_size):
+    items = (
+        OrderItem.objects.filter(order_id__gt=after_id, order_id__lte=until_id, product__isnull=False)
+        .filter(order__status__in=SOLD_STATUSES)
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    current, basket = None, set()
+    for order_id, product_id in items:
+        if order_id != current:
+            if len(basket) > 1:
+                yield basket
+            current, basket = order_id, set()
+        basket.add(product_id)
+    if len(basket) > 1:
+        yield basket
+
+
+def count_pairs(baskets):
+    pairs = Counter()
+    for basket in baskets:
+        pairs.update(combinations(sorted(basket), 2))
+    return pairs
+
+
+def _apply_counts(pairs, batch_size=1000):
+    """Add ``{(a, b): n}`` with a < b to the stored counts in both directions."""
+    items = list(pairs.items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        wanted = {}
+        for (a, b), n in chunk:
+            wanted[(a, b)] = wanted.get((a, b), 0) + n
+            wanted[(b, a)] = wanted.get((b, a), 0) + n
+        products = {a for a, _ in wanted}
+        existing = {
+            (row['product_id'], row['related_id']): row['count']
+            for row in ProductCoPurchase.objects.filter(product_id__in=products, related_id__in=products)
+            .values('product_id', 'related_id', 'count')
+        }
+        ProductCoPurchase.objects.bulk_create(
+            [
+                ProductCoPurchase(product_id=a, related_id=b, count=existing.get((a, b), 0) + n)
+                for (a, b), n in wanted.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['product', 'related'],
+            update_fields=['count'],
+        )
+
+
+def rebuild_top_k(product_ids, top_k, batch_size=500):
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        ranked = (
+            ProductCoPurchase.objects.filter(product_id__in=batch)
+            .annotate(rank=Window(RowNumber(), partition_by=F('product_id'), order_by=[F('count').desc(), F('related_id')]))
+            .filter(rank__lte=top_k)
+            .values_list('product_id', 'related_id', 'rank', 'count')
+        )
+        rows = [
+            RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=count)
+            for product_id, related_id, rank, count in ranked
+        ]
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=batch).delete()
+            RelatedProduct.objects.bulk_create(rows)
+
+
+def default_lag():
+    # By then an unpaid order's stock hold has expired and the sweeper has
+    # cancelled it, so pending orders read are abandoned carts.
+    return settings.STOCK_RESERVATION_TTL + timedelta(minutes=5)
+
+
+def build(top_k=10, rebuild=False, orders_per_chunk=50000, lag=None):
+    """Fold orders placed since the last run into the recommendation tables.
+
+    Only paid orders (``SOLD_STATUSES``) count. Orders newer than ``lag``
+    (``default_lag()``) are left for the next run, so transactions still in
+    flight with lower ids are not skipped and checkouts have had time to be
+    paid. Returns ``(orders_read, products_updated)``.
+    """
+    if lag is None:
+        lag = default_lag()
+    if rebuild:
+        with transaction.atomic():
+            ProductCoPurchase.objects.all().delete()
+            RelatedProduct.objects.all().delete()
+            JobCheckpoint.objects.filter(name=CHECKPOINT).delete()
+
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    until_id = (
+        Order.objects.filter(created_at__lt=timezone.now() - lag)
+        .order_by('-id').values_list('id', flat=True).first()
+    ) or 0
+    if until_id <= checkpoint.value:
+        return 0, 0
+
+    orders_read, touched = 0, set()
+    after = checkpoint.value
+    while after < until_id:
+        pending = Order.objects.filter(id__gt=after, id__lte=until_id).order_by('id').values_list('id', flat=True)
+        upper = list(pending[orders_per_chunk - 1:orders_per_chunk])
+        upper = upper[0] if upper else until_id
+        orders_read += pending.filter(id__lte=upper).count()
+
+        pairs = count_pairs(_order_baskets(after, upper, chunk_size=10000))
+        products = {product_id for pair in pairs for product_id in pair}
+        with transaction.atomic():
+            _apply_counts(pairs)
+            checkpoint.value = upper
+            checkpoint.save(update_fields=['value', 'updated_at'])
+        rebuild_top_k(products, top_k)
+        touched |= products
+        after = upper
+    invalidate_tags(RECOMMENDATIONS_TAG)
+    return orders_read, len(touched)
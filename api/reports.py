@@ -0,0 +1,221 @@
+import uuid
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Trunc
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from dessertshop_backend.db_router import primary
+
+from .models import Order
+
+
+GRANULARITIES = ('day', 'week', 'month')
+DEFAULT_BUCKETS = {'day': 30, 'week': 12, 'month': 12}
+
+
+def parse_when(value, end=False):
+    """Parse an ISO date or datetime. Plain dates cover the whole day."""
+    if not value:
+        return None
+    # Dates first: parse_datetime also takes a plain date, as midnight.
+    day = parse_date(value)
+    if day is not None:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def filter_orders(queryset, params):
+    """Apply the admin order list filters. Raises ValueError on bad input."""
+    statuses = [s for s in params.get('status', '').split(',') if s]
+    if statuses:
+        unknown = set(statuses) - set(dict(Order.STATUS_CHOICES)) - {'pending', 'completed'}
+        if unknown:
+            raise ValueError(f"Invalid status: {', '.join(sorted(unknown))}")
+        queryset = queryset.filter(status__in=statuses)
+    date_from = parse_when(params.get('date_from'))
+    if date_from:
+        queryset = queryset.filter(created_at__gte=date_from)
+    date_to = parse_when(params.get('date_to'), end=True)
+    if date_to:
+        queryset = queryset.filter(created_at__lt=date_to)
+    if params.get('email'):
+        queryset = queryset.filter(user__email=params['email'].strip())
+    for param, lookup in (('min_total', 'total__gte'), ('max_total', 'total__lte')):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: Decimal(params[param])})
+            except ArithmeticError:
+                raise ValueError(f"Invalid {param}")
+    return queryset
+
+
+def bucket_start(moment, granularity):
+    day = moment.astimezone(dt_timezone.utc).date()
+    if granularity == 'week':
+        day -= timedelta(days=day.weekday())
+    elif granularity == 'month':
+        day = day.replace(day=1)
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def next_bucket(start, granularity):
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _generation_key(granularity, start):
+    return f'revenue:{granularity}:{start:%Y-%m-%d}:generation'
+
+
+def _cache_key(granularity, start, generation):
+    return f'revenue:{granularity}:{start:%Y-%m-%d}:{generation}'
+
+
+def _generations(granularity, buckets):
+    """The current generation of each bucket, starting one where it has none.
+
+    Cached values are keyed by generation, so a value computed before an
+    invalidation is written where no reader looks any more.
+    """
+    keys = {b: _generation_key(granularity, b) for b in buckets}
+    found = cache.get_many(list(keys.values()))
+    for key in set(keys.values()) - set(found):
+        cache.add(key, uuid.uuid4().hex, None)
+    if len(found) < len(keys):
+        found = cache.get_many(list(keys.values()))
+    # A generation evicted since the add just leaves its bucket uncached.
+    return {b: found.get(key, uuid.uuid4().hex) for b, key in keys.items()}
+
+
+def invalidate_revenue(orders):
+    """Start new generations of the buckets holding ``orders`` once the change commits.
+
+    Call it whenever an order's status or total changes or it is deleted;
+    saves and deletes through the ORM are covered by the receivers below.
+    """
+    keys = {
+        _generation_key(granularity, bucket_start(order.created_at, granularity))
+        for order in orders if order.created_at
+        for granularity in GRANULARITIES
+    }
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, None))
+
+
+@receiver(post_save, sender=Order)
+def _order_saved(sender, instance, created=False, raw=False, **kwargs):
+    # A new order falls in the current bucket, which is never cached.
+    if not created and not raw:
+        invalidate_revenue([instance])
+
+
+@receiver(post_delete, sender=Order)
+def _order_deleted(sender, instance, **kwargs):
+    invalidate_revenue([instance])
+
+
+def _aggregate(granularity, start, end):
+    rows = (
+        Order.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(bucket=Trunc('created_at', granularity, tzinfo=dt_timezone.utc))
+        .values('bucket')
+        .annotate(revenue=Sum('total', filter=Q(status='completed')), orders=Count('id'))
+    )
+    return {
+        row['bucket']: {'revenue': row['revenue'] or Decimal('0'), 'orders': row['orders']}
+        for row in rows
+    }
+
+
+def _bucket_values(granularity, buckets, current):
+    """``{bucket: {'revenue', 'orders'}}``, from the cache for closed buckets."""
+    closed = [b for b in buckets if b < current]
+    # Read before computing: an invalidation from here on starts a new generation.
+    keys = {b: _cache_key(granularity, b, generation) for b, generation in _generations(granularity, closed).items()}
+    cached = cache.get_many(list(keys.values()))
+    values = {b: cached[key] for b, key in keys.items() if key in cached}
+
+    missing = [b for b in closed if b not in values]
+    if missing:
+        computed = _aggregate(granularity, missing[0], next_bucket(missing[-1], granularity))
+        fresh = {b: computed.get(b, {'revenue': Decimal('0'), 'orders': 0}) for b in missing}
+        cache.set_many({keys[b]: v for b, v in fresh.items()}, settings.REVENUE_CACHE_SECONDS)
+        values.update(fresh)
+    if buckets and buckets[-1] == current:
+        values[current] = _aggregate(granularity, current, next_bucket(current, granularity)).get(
+            current, {'revenue': Decimal('0'), 'orders': 0}
+        )
+
+    return values
+
+
+@primary()
+def revenue_series(granularity, start=None, end=None):
+    """Revenue and order count per bucket from ``start`` up to ``end``.
+
+    Closed buckets are computed on the primary, cached for
+    ``REVENUE_CACHE_SECONDS`` and replaced by ``invalidate_revenue`` when one
+    of their orders changes; the bucket containing now is recomputed on every
+    call. Raises ValueError for a range of more than ``REVENUE_MAX_BUCKETS``
+    buckets.
+    """
+    now = timezone.now()
+    current = bucket_start(now, granularity)
+    # ``end`` is exclusive, like the date_to order filter.
+    last = bucket_start(min(end - timedelta(microseconds=1), now) if end else now, granularity)
+    if start:
+        first = bucket_start(start, granularity)
+    else:
+        first = last
+        for _ in range(DEFAULT_BUCKETS[granularity] - 1):
+            first = bucket_start(first - timedelta(days=1), granularity)
+
+    buckets = []
+    cursor = first
+    while cursor <= last:
+        if len(buckets) == settings.REVENUE_MAX_BUCKETS:
+            raise ValueError(f"At most {settings.REVENUE_MAX_BUCKETS} {granularity} buckets per request")
+        buckets.append(cursor)
+        cursor = next_bucket(cursor, granularity)
+
+    values = _bucket_values(granularity, buckets, current)
+    return [
+        {'start': b, 'revenue': '{:.2f}'.format(values[b]['revenue']), 'orders': values[b]['orders']}
+        for b in buckets
+    ]
+
+
+@primary()
+def order_totals():
+    """``(orders, completed revenue)`` over the whole history.
+
+    Summed from the month buckets, one per order partition: closed months
+    come from the revenue cache, so only the current partition is scanned
+    once they are cached.
+    """
+    oldest = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    if oldest is None:
+        return 0, 0
+    current = bucket_start(timezone.now(), 'month')
+    months = [bucket_start(oldest, 'month')]
+    while months[-1] < current:
+        months.append(next_bucket(months[-1], 'month'))
+    values = _bucket_values('month', months, current).values()
+    return sum(v['orders'] for v in values), sum(v['revenue'] for v in values)
@@ -0,0 +1,155 @@
+"""Batched deletion of rows that have outlived their use.
+
+Each policy selects the stale rows of one table. ``apply_policy`` walks
+them in primary key order, deleting one small batch per transaction and
+pausing between batches, so no statement holds its locks for long and the
+hot queries on the same table keep running. ``RETENTION_POLICIES`` in the
+settings enables policies and sets their windows.
+
+Deleted rows only become reusable space once (auto)vacuum has run, so the
+bytes reported are an estimate from the table's average row size,
+indexes included.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .membership import invalidate_membership
+from .models import Cart, ImageUpload, OrderStatusEvent, StockReservation, Wishlist
+from .popularity import recount_wishlists
+
+
+def _cutoff(options):
+    return timezone.now() - timedelta(days=options['days'])
+
+
+def abandoned_carts(options):
+    # Whole carts only: a user's items go once none has been touched for
+    # the window, never the old half of a cart that is still in use.
+    cutoff = _cutoff(options)
+    return Cart.objects.filter(updated_at__lt=cutoff).filter(
+        ~Exists(Cart.objects.filter(user_id=OuterRef('user_id'), updated_at__gte=cutoff))
+    )
+
+
+def expired_sessions(options):
+    return Session.objects.filter(expire_date__lt=timezone.now())
+
+
+def inactive_wishlists(options):
+    # Archived long enough that a restore is unlikely; merely inactive
+    # products may come back, so their wishlists stay.
+    return Wishlist.objects.filter(product__archived_at__lt=_cutoff(options))
+
+
+def order_status_events(options):
+    return OrderStatusEvent.objects.filter(created_at__lt=_cutoff(options))
+
+
+def stock_reservations(options):
+    return StockReservation.objects.exclude(status=StockReservation.HELD).filter(expires_at__lt=_cutoff(options))
+
+
+def image_uploads(options):
+    # Queued and processing uploads are the worker's; deleting the rest
+    # also removes their partial files.
+    return ImageUpload.objects.exclude(status__in=[ImageUpload.QUEUED, ImageUpload.PROCESSING]).filter(
+        updated_at__lt=_cutoff(options),
+    )
+
+
+class Policy:
+    def __init__(self, name, rows, help, membership=False, wishlist_counts=False):
+        self.name = name
+        self.rows = rows
+        self.help = help
+        # Rows feed the per-user membership cache, which must be invalidated.
+        self.membership = membership
+        # Rows are counted in Product.wishlist_count, recounted per batch.
+        self.wishlist_counts = wishlist_counts
+
+    def queryset(self):
+        return self.rows(settings.RETENTION_POLICIES[self.name])
+
+
+POLICIES = {policy.name: policy for policy in [
+    Policy('abandoned_carts', abandoned_carts, "carts untouched for 'days'", membership=True),
+    Policy('expired_sessions', expired_sessions, "expired django_session rows"),
+    Policy('inactive_wishlists', inactive_wishlists, "wishlist rows of products archived for 'days'",
+           membership=True, wishlist_counts=True),
+    Policy('order_status_events', order_status_events, "order status events older than 'days'"),
+    Policy('stock_reservations', stock_reservations, "settled stock reservations older than 'days'"),
+    Policy('image_uploads', image_uploads, "finished or abandoned image uploads older than 'days'"),
+]}
+
+
+def enabled_policies():
+    return [POLICIES[name] for name in settings.RETENTION_POLICIES]
+
+
+def row_bytes(model):
+    """Average bytes per row of ``model``'s table with its indexes, or None if unknown."""
+    connection = connections[model.objects.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_total_relation_size(c.oid), c.reltuples FROM pg_class c WHERE c.oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        size, rows = cursor.fetchone()
+    if rows <= 0:
+        # Not analyzed yet, which only stays so for small tables.
+        rows = model.objects.count()
+    return size / rows if rows else None
+
+
+def delete_batch(policy, after, batch_size):
+    """Delete the next batch of ``policy``'s rows with a primary key above ``after``.
+
+    Returns ``(last primary key selected, rows deleted)``; the key is None when done.
+    """
+    queryset = policy.queryset()
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    fields = ['pk']
+    if policy.membership:
+        fields.append('user_id')
+    if policy.wishlist_counts:
+        fields.append('product_id')
+    with transaction.atomic():
+        rows = list(queryset.order_by('pk').values(*fields)[:batch_size])
+        if not rows:
+            return None, 0
+        # The policy is re-checked in the DELETE, in case a row was touched since.
+        _, deleted = policy.queryset().filter(pk__in=[row['pk'] for row in rows]).delete()
+        if policy.membership:
+            for user_id in {row['user_id'] for row in rows}:
+                invalidate_membership(user_id)
+        if policy.wishlist_counts:
+            recount_wishlists({row['product_id'] for row in rows})
+    return rows[-1]['pk'], deleted.get(queryset.model._meta.label, 0)
+
+
+def apply_policy(policy, batch_size=1000, sleep=0.1, dry_run=False):
+    """Run one policy; returns ``(rows, estimated bytes or None, batches)``."""
+    per_row = row_bytes(policy.queryset().model)
+    if dry_run:
+        rows = policy.queryset().count()
+        return rows, None if per_row is None else int(rows * per_row), 0
+
+    rows = batches = 0
+    after = None
+    while True:
+        after, deleted = delete_batch(policy, after, batch_size)
+        if after is None:
+            break
+        rows += deleted
+        batches += 1
+        time.sleep(sleep)
+    return rows, None if per_row is None else int(rows * per_row), batches
@@ -1,22 +1,28 @@
 from rest_framework import serializers
 from .models import User, Category, Product, Cart, Wishlist, Order, OrderItem
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db.models import Sum
+from .fastpath import CART_PLAN, CATEGORY_PLAN, PRODUCT_PLAN, WISHLIST_PLAN, FastListSerializer, decimal
+from .fieldsets import FieldsetMixin, pick
+from .partitions import history_start
+from .uploads import UploadRejected, inspect_image, queue_upload, upload_state
 
 User=get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(FieldsetMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     totalSpent = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ['id', 'email', 'name', 'password', 'role', 'is_active','totalSpent']
+        fieldset_sources = {'totalSpent': []}
 
     
     def get_totalSpent(self, obj):
-        
-        result = obj.orders.filter(status='completed').aggregate(total=Sum('total'))
+        # Over the recent order partitions only; see ORDER_HISTORY_MONTHS.
+        result = obj.orders.filter(status='completed', created_at__gte=history_start()).aggregate(total=Sum('total'))
         total = result.get('total') or 0
         return float(total)
     
@@ -41,61 +47,128 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 
-class CategorySerializer(serializers.ModelSerializer):
-    image = serializers.SerializerMethodField()
+class ImageField(serializers.Field):
+    """The image's absolute URL; takes an uploaded file, checked from its header only."""
 
-    def get_image(self, obj):
+    def to_representation(self, value):
         request = self.context.get('request')
-        return request.build_absolute_uri(obj.image.url) if obj.image and request else None
-        
+        return request.build_absolute_uri(value.url) if value and request else None
+
+    def to_internal_value(self, data):
+        if not hasattr(data, 'chunks'):
+            raise serializers.ValidationError("Upload an image file.")
+        try:
+            inspect_image(data)
+        except UploadRejected as e:
+            raise serializers.ValidationError(str(e))
+        return data
+
+
+class QueuedImageMixin:
+    """Queues an uploaded ``image`` for the upload worker instead of storing it in the request.
+
+    The response then carries the queued upload as ``image_upload``.
+    """
+    image_upload = None
+
+    def save(self, **kwargs):
+        file = self.validated_data.pop('image', None)
+        instance = super().save(**kwargs)
+        if file is not None:
+            request = self.context.get('request')
+            self.image_upload = queue_upload(getattr(request, 'user', None), instance, file)
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.image_upload is not None:
+            data['image_upload'] = upload_state(self.image_upload, self.context.get('request'))
+        return data
+
+
+class CategorySerializer(QueuedImageMixin, FieldsetMixin, serializers.ModelSerializer):
+    image = ImageField(required=False)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'image']
+        fieldset_sources = {'image': ['image']}
+        list_serializer_class = FastListSerializer
+        fast_plan = CATEGORY_PLAN
 
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(QueuedImageMixin, FieldsetMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
-    image = serializers.SerializerMethodField()
-
-    def get_image(self, obj):
-        request = self.context.get('request')
-        return request.build_absolute_uri(obj.image.url) if obj.image and request else None
-
+    image = ImageField(required=False)
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'price', 'description', 'brand', 'image', 'category', 'category_name', 'active']
+        fieldset_sources = {'image': ['image']}
+        list_serializer_class = FastListSerializer
+        fast_plan = PRODUCT_PLAN
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(FieldsetMixin, serializers.ModelSerializer):
     product_details = ProductSerializer(source='product', read_only=True)
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = Cart
         fields = ['id', 'user', 'product', 'quantity', 'product_details']
+        list_serializer_class = FastListSerializer
+        fast_plan = CART_PLAN
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(FieldsetMixin, serializers.ModelSerializer):
     product_details = ProductSerializer(source='product', read_only=True)
     user = serializers.PrimaryKeyRelatedField(read_only=True)
     class Meta:
         model = Wishlist
         fields = ['id','user','product','product_details']
+        list_serializer_class = FastListSerializer
+        fast_plan = WISHLIST_PLAN
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product_details = ProductSerializer(source='product', read_only=True)
+item_price = decimal(10, 2)
+
+
+class OrderItemSerializer(FieldsetMixin, serializers.ModelSerializer):
+    product_details = serializers.SerializerMethodField()
+
+    def get_product_details(self, obj):
+        request = self.context.get('request')
+        image = None
+        if obj.product_image and request:
+            image = request.build_absolute_uri(default_storage.url(obj.product_image))
+        # The product as it was when ordered; ``price`` is the unit price paid
+        # and ``active`` is live, false once the product has been deleted.
+        return pick({
+            'id': obj.product_id,
+            'name': obj.product_name,
+            'price': item_price(obj.price),
+            'description': obj.product_description,
+            'brand': obj.product_brand,
+            'image': image,
+            'category': obj.product_category_id,
+            'category_name': obj.category_name,
+            'active': obj.product is not None and obj.product.active,
+        }, self.subfields('product_details'))
 
     class Meta:
         model = OrderItem
         fields = ['id', 'order', 'product', 'quantity', 'price', 'product_details']
+        fieldset_sources = {
+            'product_details': [
+                'product', 'product_name', 'price', 'product_description', 'product_brand', 'product_image',
+                'product_category_id', 'category_name', 'product__active',
+            ],
+        }
 
         
 
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(FieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     email = serializers.EmailField(source='user.email', read_only=True)
 
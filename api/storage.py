@@ -0,0 +1,61 @@
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentHashMixin:
+    """Store files under a name derived from their content.
+
+    ``products/cake.jpg`` is saved as ``products/<sha256 prefix>.jpg``, so a
+    stored file never changes behind its URL and can be cached forever.
+    Uploading identical bytes again reuses the existing file.
+    """
+    hash_length = 32
+
+    def hashed_name(self, name, content):
+        """The name ``content`` is stored under when saved as ``name``."""
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        dirname, filename = posixpath.split(name.replace('\\', '/'))
+        ext = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(dirname, digest.hexdigest()[:self.hash_length] + ext)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+class HashedFileSystemStorage(ContentHashMixin, FileSystemStorage):
+    pass
+
+
+class LocalObjectStorage(ContentHashMixin, FileSystemStorage):
+    """Local stand-in for an object store bucket.
+
+    Objects are written to ``<root>/<bucket>/<key>`` and linked as
+    ``<endpoint_url>/<bucket>/<key>``, so media is served by whatever answers
+    on the endpoint (``python -m http.server --directory <root>`` locally)
+    and never by Django.
+    """
+
+    def __init__(self, endpoint_url=None, bucket=None, root=None, **kwargs):
+        endpoint_url = endpoint_url or settings.OBJECT_STORE_ENDPOINT_URL
+        bucket = bucket or settings.OBJECT_STORE_BUCKET
+        root = root or settings.OBJECT_STORE_ROOT
+        super().__init__(
+            location=os.path.join(root, bucket),
+            base_url=f"{endpoint_url.rstrip('/')}/{bucket}/",
+            **kwargs,
+        )
@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, router, transaction
+from django.http import Http404, HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from dessertshop_backend import db_router
+from dessertshop_backend.cache import cache_response, tiered_cache
+
+from . import (
+    events, idempotency, inventory, membership, partitions, popularity, profiling, recommendations, reports, retention,
+    uploads, warmup,
+)
+from .admin import EstimatedCountPaginator, estimated_count
+from .archival import archive_products
+from .catalog import catalog_changes, current_change_seq
+from .catalog_import import import_catalog
+from .models import (
+    Cart, CatalogTombstone, Category, IdempotencyKey, ImageUpload, Order, OrderItem, OrderStatusEvent, PaymentEvent,
+    Product, RequestProfile, StockReservation, User, Wishlist,
+)
+from .payments import process_pending_events
+from .serializers import CartSerializer, CategorySerializer, ProductSerializer, WishlistSerializer
+from .views import serve_media
+
+
+def make_user(email='user@example.com', **extra):
+    return User.objects.create_user(email=email, name=email.split('@')[0], password='secret', **extra)
+
+
+def make_admin(email='admin@example.com'):
+    return User.objects.create_superuser(email=email, name='admin', password='secret')
+
+
+def auth(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+
+def make_product(name='Cake', category=None, **extra):
+    category = category or Category.objects.get_or_create(name='Cakes', defaults={'image': ''})[0]
+    fields = {'price': 10, 'brand': 'Goeat', 'description': '', 'image': '', 'active': True}
+    fields.update(extra)
+    return Product.objects.create(name=name, category=category, **fields)
+
+
+def clear_caches():
+    cache.clear()
+    tiered_cache.local.clear()
+
+
+class CacheTestCase(TestCase):
+    """Starts and ends with empty shared and local caches."""
+
+    def setUp(self):
+        super().setUp()
+        clear_caches()
+        self.addCleanup(clear_caches)
+
+
+LAGGING = 'lagging'
+
+
+class OwnAtomic:
+    """The primary as the router sees it: in a transaction only inside the test's own atomic blocks."""
+
+    def __init__(self):
+        self.depth = len(connection.atomic_blocks)
+
+    @property
+    def in_atomic_block(self):
+        return len(connection.atomic_blocks) > self.depth
+
+
+def in_memory_test_db():
+    name = connection.settings_dict['TEST']['NAME']
+    return connection.vendor == 'sqlite' and (not name or connection.creation.is_in_memory_db(name))
+
+
+@skipUnless(not in_memory_test_db(), "a second connection cannot open an in-memory test database")
+class LaggingReplicaTestCase(CacheTestCase):
+    """Reads outside transactions go to a replica that has not caught up.
+
+    The replica is a second connection to the test database, which cannot
+    see the rows the test has written but not committed.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test runner has set up its databases, which would
+        # otherwise try to create this one.
+        connections.settings[LAGGING] = dict(connections['default'].settings_dict)
+        cls.databases = cls.databases | {LAGGING}
+        cls.addClassCleanup(cls.drop_replica)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.databases = cls.databases - {LAGGING}
+        super().tearDownClass()
+
+    @classmethod
+    def drop_replica(cls):
+        connections[LAGGING].close()
+        del connections[LAGGING]
+        del connections.settings[LAGGING]
+
+    def setUp(self):
+        super().setUp()
+        weights = override_settings(DATABASE_REPLICA_WEIGHTS={LAGGING: 1})
+        weights.enable()
+        self.addCleanup(weights.disable)
+        for patcher in (
+            mock.patch.object(router, 'routers', [db_router.PrimaryReplicaRouter()]),
+            mock.patch.object(db_router, 'connections', {'default': OwnAtomic()}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@contextmanager
+def gateway():
+    """Stand in for the Razorpay client; yields the mock."""
+    client = mock.Mock()
+    client.order.create.side_effect = lambda data: {
+        'id': f'order_rp_{next(razorpay_ids)}', 'amount': data['amount'], 'currency': data['currency'],
+    }
+    with mock.patch('api.views.razorpay_client', return_value=client), \
+            mock.patch('api.payments.razorpay_client', return_value=client):
+        yield client
+
+
+razorpay_ids = itertools.count(1)
+
+
+def checkout(client, user, items, total=10, **extra):
+    with gateway():
+        return client.post('/api/orders/create/', {'items': items, 'total': total},
+                           content_type='application/json', **auth(user), **extra)
+
+
+def post_payment(client, user, order_id, payment_id):
+    order = Order.objects.get(pk=order_id)
+    data = {'order_id': order.pk, 'razorpay_order_id': order.razorpay_order_id,
+            'razorpay_payment_id': payment_id, 'razorpay_signature': 'sig'}
+    return client.post('/api/orders/verify-payment/', data, content_type='application/json', **auth(user))
+
+
+def verify_payment(client, user, order_id, payment_id='pay_1'):
+    with gateway() as razorpay:
+        return post_payment(client, user, order_id, payment_id), razorpay
+
+
+def image_bytes(size=(4, 4), fmt='PNG', color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, fmt)
+    return output.getvalue()
+
+
+class MediaTestCase(TestCase):
+    """Runs with MEDIA_ROOT in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class CatalogImportTests(MediaTestCase):
+    def archive(self, members):
+        path = os.path.join(self.media_root, 'images.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        return path
+
+    def test_upserts_on_name_and_brand(self):
+        make_product(name='Brownie', brand='Goeat', price=5)
+        report = import_catalog([
+            {'name': 'Brownie', 'brand': 'Goeat', 'category': 'Bakes', 'price': '7.50'},
+            {'name': 'Tart', 'brand': 'Goeat', 'category': 'Bakes', 'price': 4, 'active': 'no'},
+        ])
+        self.assertEqual((report.created, report.updated, report.categories_created), (1, 1, 1))
+        self.assertEqual(str(Product.objects.get(name='Brownie').price), '7.50')
+        self.assertFalse(Product.objects.get(name='Tart').active)
+
+    def test_bad_rows_are_reported_not_fatal(self):
+        report = import_catalog([
+            {'name': 'NaN cake', 'brand': 'b', 'category': 'c', 'price': 'NaN'},
+            {'name': 'Huge', 'brand': 'b', 'category': 'c', 'price': 'Infinity'},
+            {'name': 'Negative', 'brand': 'b', 'category': 'c', 'price': '-1'},
+            {'name': 5, 'brand': 'b', 'category': 'c', 'price': 2, 'description': 5},
+            ['not', 'an', 'object'],
+            {'brand': 'b', 'category': 'c', 'price': 1},
+        ])
+        self.assertEqual([error['row'] for error in report.errors], [1, 2, 3, 5, 6])
+        self.assertEqual(report.created, 1)
+        self.assertEqual(Product.objects.get().description, '5')
+
+    def test_images_stored_and_invalid_ones_reported(self):
+        archive = self.archive({'cake.png': image_bytes(), 'broken.png': b'not an image'})
+        report = import_catalog([
+            {'name': 'Cake', 'brand': 'b', 'category': 'c', 'price': 1, 'image': 'cake.png'},
+            {'name': 'Pie', 'brand': 'b', 'category': 'c', 'price': 1, 'image': 'broken.png'},
+        ], image_archive=archive, workers=1)
+        self.assertEqual(report.images_stored, 1)
+        self.assertEqual(report.errors[0]['row'], 2)
+        self.assertTrue(default_storage.exists(Product.objects.get(name='Cake').image.name))
+
+    def test_failed_upsert_removes_new_images(self):
+        archive = self.archive({'cake.png': image_bytes()})
+        with mock.patch('api.catalog_import._upsert_products', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            import_catalog([
+                {'name': 'Cake', 'brand': 'b', 'category': 'c', 'price': 1, 'image': 'cake.png'},
+            ], image_archive=archive, workers=1)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'products')), [])
+
+    def test_failed_upsert_keeps_images_in_use(self):
+        archive = self.archive({'cake.png': image_bytes()})
+        import_catalog([{'name': 'Cake', 'brand': 'b', 'category': 'c', 'price': 1, 'image': 'cake.png'}],
+                       image_archive=archive, workers=1)
+        with mock.patch('api.catalog_import._upsert_products', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            import_catalog([{'name': 'Pie', 'brand': 'b', 'category': 'c', 'price': 1, 'image': 'cake.png'}],
+                           image_archive=archive, workers=1)
+        self.assertTrue(default_storage.exists(Product.objects.get(name='Cake').image.name))
+
+    def test_admin_endpoint(self):
+        admin = make_admin()
+        upload = SimpleUploadedFile('catalog.json', json.dumps([
+            {'name': 'Cake', 'brand': 'b', 'category': 'c', 'price': 'NaN'},
+            {'name': 'Pie', 'brand': 'b', 'category': 'c', 'price': '3'},
+        ]).encode())
+        response = self.client.post('/api/admin/products/import/', {'file': upload}, **auth(admin))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'], [{'row': 1, 'error': 'Invalid price'}])
+        self.assertEqual(self.client.post('/api/admin/products/import/', {}, **auth(make_user())).status_code, 403)
+
+
+class OrderSnapshotTests(TestCase):
+    def test_items_keep_product_details_after_product_changes(self):
+        user = make_user()
+        product = make_product(name='Cake', brand='Goeat', price='12.50', image='products/cake.png',
+                               description='Chocolate')
+        response = checkout(self.client, user, [{'product': product.pk, 'quantity': 2}], total=25)
+        self.assertEqual(response.status_code, 201)
+        details = lambda: self.client.get('/api/orders/', **auth(user)).json()[0]['items'][0]['product_details']
+        live = details()
+        self.assertEqual(set(live), set(ProductSerializer.Meta.fields))
+        self.assertEqual(
+            {key: live[key] for key in ('price', 'description', 'category', 'active')},
+            {'price': '12.50', 'description': 'Chocolate', 'category': product.category_id, 'active': True},
+        )
+
+        item = OrderItem.objects.get()
+        self.assertEqual((item.product_name, item.product_brand, item.category_name, str(item.price)),
+                         ('Cake', 'Goeat', 'Cakes', '12.50'))
+        product.name, product.price = 'Renamed', 99
+        product.save()
+        Product.objects.filter(pk=product.pk).delete()
+
+        snapshot = details()
+        self.assertTrue(snapshot.pop('image').endswith('products/cake.png'))
+        self.assertEqual(snapshot, {
+            'id': None, 'name': 'Cake', 'price': '12.50', 'description': 'Chocolate', 'brand': 'Goeat',
+            'category': product.category_id, 'category_name': 'Cakes', 'active': False,
+        })
+
+
+@skipUnless(connection.vendor == 'postgresql', "order partitions need PostgreSQL")
+class OrderPartitionTests(TransactionTestCase):
+    def test_archive_removes_the_partitions_orders_and_their_rows(self):
+        self.assertTrue(partitions.is_partitioned())
+        month = datetime(2001, 2, 1).date()
+        partitions.create_partition(month)
+        user = make_user()
+        product = make_product()
+        old = Order.objects.create(user=user, total=5, status='completed')
+        Order.objects.filter(pk=old.pk).update(created_at=datetime(2001, 2, 10, tzinfo=dt_timezone.utc))
+        kept = Order.objects.create(user=user, total=7, status='completed')
+        for order in (old, kept):
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=5)
+            OrderStatusEvent.objects.create(user=user, order=order, status='completed')
+            StockReservation.objects.create(order=order, product=product, shard=0, quantity=1,
+                                            expires_at=datetime(2001, 2, 10, tzinfo=dt_timezone.utc))
+
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        path, count = partitions.archive_partition(partitions.partition_name(month), archive_dir)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [kept.pk])
+        for model in (OrderItem, OrderStatusEvent, StockReservation):
+            self.assertEqual(list(model.objects.values_list('order_id', flat=True)), [kept.pk])
+        with gzip.open(path, 'rt') as archived:
+            [line] = archived.readlines()
+        order = json.loads(line)
+        self.assertEqual((order['id'], len(order['items']), order['status_events'][0]['status']),
+                         (old.pk, 1, 'completed'))
+
+
+@override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.items = [{'product': make_product().pk, 'quantity': 1}]
+
+    def create(self, key='key-1', items=None):
+        return checkout(self.client, self.user, items or self.items, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_replays_the_first_response(self):
+        first, second = self.create(), self.create()
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_another_payload(self):
+        self.create()
+        other = [{'product': make_product(name='Pie').pk, 'quantity': 1}]
+        self.assertEqual(self.create(items=other).status_code, 422)
+
+    def test_server_error_frees_the_key(self):
+        with mock.patch('api.views.razorpay_client', side_effect=RuntimeError('gateway down')):
+            response = self.client.post('/api/orders/create/', {'items': self.items, 'total': 10},
+                                        content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1',
+                                        **auth(self.user))
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create().status_code, 201)
+
+    def claim_abandoned(self, age):
+        """A claim left by a request that died ``age`` ago."""
+        request = mock.Mock(method='POST', path='/api/orders/create/', data={'items': self.items, 'total': 10})
+        record, created = idempotency.claim(self.user, 'key-1', idempotency.fingerprint(request))
+        self.assertTrue(created)
+        IdempotencyKey.objects.filter(pk=record.pk).update(claimed_at=record.claimed_at - age)
+        return IdempotencyKey.objects.get(pk=record.pk)
+
+    def test_retry_within_the_lease_conflicts(self):
+        self.claim_abandoned(timedelta(seconds=1))
+        response = self.create()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Order.objects.exists())
+
+    def test_retry_after_the_lease_takes_the_key_over(self):
+        abandoned = self.claim_abandoned(settings.IDEMPOTENCY_LEASE + timedelta(seconds=1))
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+        # The original request, should it still finish, cannot overwrite the new result.
+        self.assertEqual(idempotency._held(abandoned).update(status_code=500), 0)
+        self.assertEqual(self.create().json(), response.json())
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec')
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(user=make_user(), total=10, status='pending', razorpay_order_id='order_1')
+
+    def send(self, payload, event_id='evt_1', secret='whsec'):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post('/api/payments/razorpay/webhook/', body, content_type='application/json',
+                                HTTP_X_RAZORPAY_SIGNATURE=signature, HTTP_X_RAZORPAY_EVENT_ID=event_id)
+
+    def captured(self, order_id='order_1'):
+        return {'event': 'payment.captured', 'created_at': 1700000000,
+                'payload': {'payment': {'entity': {'id': 'pay_1', 'order_id': order_id}}}}
+
+    def test_events_are_stored_once_and_applied_by_the_worker(self):
+        self.assertEqual(self.send(self.captured()).status_code, 200)
+        self.assertEqual(self.send(self.captured()).status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+        self.assertEqual(process_pending_events(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.razorpay_payment_id), ('completed', 'pay_1'))
+        self.assertEqual(PaymentEvent.objects.get().outcome, 'applied')
+
+    def test_rejects_bad_signatures_and_payloads(self):
+        self.assertEqual(self.send(self.captured(), secret='other').status_code, 400)
+        for payload in (b'[]', b'"text"', b'{', {'event': ['x']}, {'event': 'a', 'created_at': 10 ** 20}):
+            self.assertEqual(self.send(payload).status_code, 400, payload)
+        self.assertFalse(PaymentEvent.objects.exists())
+        # Odd shapes below the top level only leave the event without an order.
+        self.assertEqual(self.send({'event': 'a', 'payload': []}).status_code, 200)
+        self.assertEqual(PaymentEvent.objects.get().razorpay_order_id, '')
+
+    def test_event_for_an_uncommitted_order_is_retried(self):
+        self.send(self.captured('order_2'))
+        with mock.patch('api.payments.timezone.now', return_value=timezone.now()) as now:
+            self.assertEqual(process_pending_events(), 1)
+            event = PaymentEvent.objects.get()
+            self.assertIsNone(event.processed_at)
+            self.assertEqual((event.attempts, event.outcome), (1, 'unmatched'))
+            self.assertEqual(process_pending_events(), 0)
+
+            order = Order.objects.create(user=self.order.user, total=10, status='pending', razorpay_order_id='order_2')
+            now.return_value += settings.PAYMENT_EVENT_RETRY_BASE
+            self.assertEqual(process_pending_events(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+        self.assertEqual(PaymentEvent.objects.get().outcome, 'applied')
+
+    @override_settings(PAYMENT_EVENT_MAX_ATTEMPTS=2)
+    def test_unmatched_event_is_given_up_after_max_attempts(self):
+        self.send(self.captured('order_missing'))
+        with mock.patch('api.payments.timezone.now', return_value=timezone.now()) as now:
+            process_pending_events()
+            now.return_value += settings.PAYMENT_EVENT_RETRY_BASE
+            process_pending_events()
+        event = PaymentEvent.objects.get()
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual((event.attempts, event.outcome), (2, 'unmatched'))
+
+
+class FastListSerializationTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        category = Category.objects.create(name='Cakes', image='categories/cakes.png')
+        self.products = [
+            make_product(name='Cake', category=category, price='12.50', image='products/a b.png'),
+            make_product(name='Pie', category=category, price=3, image='', active=False),
+        ]
+        for product in self.products:
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+            Wishlist.objects.create(user=self.user, product=product)
+        self.request = APIRequestFactory().get('/api/products/')
+
+    def assertSameAsModelSerializer(self, serializer_class, queryset):
+        context = {'request': self.request}
+        fast = serializer_class(queryset, many=True, context=context).data
+        slow = [serializer_class(instance, context=context).data for instance in queryset]
+        self.assertEqual(fast, slow)
+
+    def test_lists_match_the_model_serializers(self):
+        self.assertSameAsModelSerializer(CategorySerializer, Category.objects.order_by('pk'))
+        self.assertSameAsModelSerializer(ProductSerializer, Product.objects.order_by('pk'))
+        self.assertSameAsModelSerializer(CartSerializer, Cart.objects.order_by('pk'))
+        self.assertSameAsModelSerializer(WishlistSerializer, Wishlist.objects.order_by('pk'))
+
+    def test_cart_list_reads_no_model_instances(self):
+        with self.assertNumQueries(1):
+            data = CartSerializer(Cart.objects.all(), many=True, context={'request': self.request}).data
+        self.assertEqual(data[0]['product_details']['image'], 'http://testserver/media/products/a%20b.png')
+        self.assertIsNone(data[1]['product_details']['image'])
+
+
+class FieldsetTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.cake = make_product(name='Cake', price=12, description='Chocolate')
+        Cart.objects.create(user=self.user, product=self.cake, quantity=2)
+        order = Order.objects.create(user=self.user, total=24, status='completed')
+        OrderItem.from_product(order, self.cake, 2).save()
+
+    def get(self, url):
+        response = self.client.get(url, **auth(self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fields_pick_top_level_and_nested_keys(self):
+        self.assertEqual(self.get('/api/products/?fields=name,price'),
+                         [{'id': self.cake.pk, 'name': 'Cake', 'price': '12.00'}])
+        self.assertEqual(self.get('/api/cart/?fields=quantity,product_details.name'), [
+            {'id': Cart.objects.get().pk, 'quantity': 2, 'product_details': {'id': self.cake.pk, 'name': 'Cake'}},
+        ])
+        [order] = self.get('/api/orders/?fields=status,items.quantity')
+        self.assertEqual(order, {'id': order['id'], 'status': 'completed',
+                                 'items': [{'id': order['items'][0]['id'], 'quantity': 2}]})
+
+    def test_nested_objects_need_expand(self):
+        [item] = self.get('/api/cart/?fields=quantity')
+        self.assertNotIn('product_details', item)
+        [item] = self.get('/api/cart/?fields=quantity&expand=product_details')
+        self.assertEqual(item['product_details']['description'], 'Chocolate')
+        [order] = self.get('/api/orders/?fields=status,items.product_details.name')
+        self.assertEqual(order['items'][0]['product_details'], {'id': self.cake.pk, 'name': 'Cake'})
+
+    def test_without_fields_responses_are_unchanged(self):
+        [product] = self.get('/api/products/')
+        self.assertEqual(set(product), set(ProductSerializer.Meta.fields))
+        [order] = self.get('/api/orders/?expand=items')
+        self.assertEqual(set(order), {'id', 'email', 'total', 'status', 'created_at', 'items'})
+
+    def test_unrequested_relations_are_not_loaded(self):
+        self.client.get('/api/orders/', **auth(self.user))
+        with self.assertNumQueries(2):
+            self.client.get('/api/orders/?fields=status,total', **auth(self.user))
+
+
+class MembershipTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, self.other = make_user(), make_user('other@example.com')
+        self.cake, self.pie = make_product(name='Cake'), make_product(name='Pie')
+
+    def flags(self, user, url='/api/products/?fields=name,is_wishlisted,cart_quantity'):
+        response = self.client.get(url, **auth(user))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return {p['name']: (p['is_wishlisted'], p['cart_quantity']) for p in (data if isinstance(data, list) else [data])}
+
+    def post(self, url, data, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, data, content_type='application/json', **auth(user or self.user))
+
+    def test_flags_are_per_user_on_a_shared_cached_body(self):
+        self.assertEqual(self.flags(self.user), {'Cake': (False, 0), 'Pie': (False, 0)})
+        self.post('/api/wishlist/', {'product': self.cake.pk})
+        self.post('/api/cart/', {'product': self.pie.pk, 'quantity': 2})
+        self.post('/api/cart/', {'product': self.pie.pk, 'quantity': 1})
+        self.assertEqual(self.flags(self.user), {'Cake': (True, 0), 'Pie': (False, 3)})
+        self.assertEqual(self.flags(self.other), {'Cake': (False, 0), 'Pie': (False, 0)})
+        self.assertEqual(self.flags(self.user, f'/api/products/{self.pie.pk}/?expand=is_wishlisted,cart_quantity'),
+                         {'Pie': (False, 3)})
+
+    def test_removing_invalidates_the_cached_membership(self):
+        self.post('/api/wishlist/', {'product': self.cake.pk})
+        self.assertEqual(self.flags(self.user)['Cake'], (True, 0))
+        self.post('/api/wishlist/', {'product': self.cake.pk})
+        self.assertEqual(self.flags(self.user)['Cake'], (False, 0))
+
+    def test_flags_are_opt_in_and_need_a_user(self):
+        self.assertNotIn('is_wishlisted', self.client.get('/api/products/', **auth(self.user)).json()[0])
+        anonymous = self.client.get('/api/products/?fields=name,is_wishlisted').json()
+        self.assertEqual([set(product) for product in anonymous], [{'id', 'name'}] * 2)
+
+
+async def next_frame(stream, timeout=5):
+    return await asyncio.wait_for(stream.__anext__(), timeout)
+
+
+class OrderEventStreamTests(TransactionTestCase):
+    # Streams read from a thread pool, so the events must really be committed.
+
+    def setUp(self):
+        self.user, self.admin = make_user(), make_admin()
+        self.order = Order.objects.create(user=self.user, total=10, status='pending', razorpay_order_id='order_rp_sse')
+
+    def change(self, new_status):
+        self.order.status = new_status
+        self.order.save()
+        events.record_status_changes([self.order])
+        return events.latest_event_id(self.user.pk)
+
+    def open(self, last_id=None):
+        headers = {'Authorization': auth(self.user)['HTTP_AUTHORIZATION']}
+        if last_id is not None:
+            headers['Last-Event-ID'] = str(last_id)
+        return AsyncClient().get('/api/orders/events/', headers=headers)
+
+    def test_resumes_after_last_event_id(self):
+        first = self.change('processing')
+        self.change('shipped')
+
+        async def scenario():
+            response = await self.open(first)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = aiter(response.streaming_content)
+            self.assertEqual(await next_frame(stream), b'retry: 3000\n\n')
+            frame = (await next_frame(stream)).decode()
+            self.assertTrue(frame.startswith(f'id: {first + 1}\nevent: order_status\n'))
+            self.assertEqual(json.loads(frame.split('data: ')[1])['status'], 'shipped')
+
+        asyncio.run(scenario())
+
+    @override_settings(ORDER_EVENTS_HEARTBEAT_SECONDS=0.05)
+    def test_new_streams_skip_history_and_send_heartbeats(self):
+        self.change('processing')
+
+        async def scenario():
+            stream = aiter((await self.open()).streaming_content)
+            await next_frame(stream)
+            self.assertEqual(await next_frame(stream), b': heartbeat\n\n')
+            self.assertEqual(await next_frame(stream), b': heartbeat\n\n')
+
+        asyncio.run(scenario())
+
+    def deliver(self, action):
+        """The frames a stream opened before ``action`` runs receives for it."""
+        last_id = events.latest_event_id(self.user.pk)
+
+        async def scenario():
+            stream = events.event_stream(self.user.pk, last_id, heartbeat=60)
+            await next_frame(stream)
+            pending = asyncio.ensure_future(next_frame(stream))
+            await asyncio.sleep(0.1)
+            await asyncio.to_thread(action)
+            try:
+                return json.loads((await pending).split('data: ')[1])
+            finally:
+                await stream.aclose()
+        return asyncio.run(scenario())
+
+    def test_payment_is_pushed_to_the_stream(self):
+        def pay():
+            self.assertEqual(post_payment(Client(), self.user, self.order.pk, 'pay_sse').status_code, 200)
+        with gateway():
+            event = self.deliver(pay)
+        self.assertEqual((event['order_id'], event['status']), (self.order.pk, 'completed'))
+
+    def test_admin_status_change_is_pushed_to_the_stream(self):
+        def ship():
+            response = Client().patch(f'/api/admin/orders/{self.order.pk}/status/', {'status': 'shipped'},
+                                      content_type='application/json', **auth(self.admin))
+            self.assertEqual(response.status_code, 200)
+        event = self.deliver(ship)
+        self.assertEqual((event['order_id'], event['status']), (self.order.pk, 'shipped'))
+
+
+class CatalogChangesTests(TestCase):
+    def setUp(self):
+        self.cake = make_product(name='Cake')
+        self.pie = make_product(name='Pie')
+
+    def changes(self, since):
+        response = self.client.get(f'/api/catalog/changes/?since={since}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def sync(self, since):
+        """Follow ``has_more`` pages; returns the final token and the pages."""
+        pages = [self.changes(since)]
+        while pages[-1]['has_more']:
+            pages.append(self.changes(pages[-1]['token']))
+        return pages[-1]['token'], pages
+
+    def test_full_sync_then_only_later_changes(self):
+        first = self.changes(0)
+        self.assertFalse(first['has_more'])
+        self.assertEqual([c['name'] for c in first['categories']], ['Cakes'])
+        self.assertEqual([p['name'] for p in first['products']], ['Cake', 'Pie'])
+
+        self.pie.price = 4
+        self.pie.save()
+        later = self.changes(first['token'])
+        self.assertEqual([(p['name'], p['price']) for p in later['products']], [('Pie', '4.00')])
+        self.assertEqual(later['categories'], [])
+        self.assertGreater(int(later['token']), int(first['token']))
+        self.assertEqual(self.changes(later['token'])['products'], [])
+
+    def test_deleted_rows_are_reported(self):
+        token = self.changes(0)['token']
+        category = Category.objects.create(name='Pies', image='')
+        pk = category.pk
+        category.delete()
+        later = self.changes(token)
+        self.assertEqual(later['deleted'], {'categories': [pk], 'products': []})
+        self.assertEqual(later['categories'], [])
+
+    def test_archived_products_are_deleted_until_restored(self):
+        admin = make_admin()
+        token = self.changes(0)['token']
+        self.client.delete(f'/api/admin/products/{self.cake.pk}/', **auth(admin))
+        archived = self.changes(token)
+        self.assertEqual((archived['products'], archived['deleted']['products']), ([], [self.cake.pk]))
+
+        self.cake.refresh_from_db()
+        self.cake.active = True
+        self.cake.archived_at = None
+        self.cake.save()
+        restored = self.changes(archived['token'])
+        self.assertEqual(([p['name'] for p in restored['products']], restored['deleted']['products']), (['Cake'], []))
+        both = self.changes(token)
+        self.assertEqual(([p['name'] for p in both['products']], both['deleted']['products']), (['Cake'], []))
+
+    def test_purging_an_archived_product_adds_no_second_tombstone(self):
+        archive_products([self.pie.pk])
+        Product.objects.filter(pk=self.pie.pk).delete()
+        self.assertEqual(list(CatalogTombstone.objects.values_list('kind', 'object_id')), [('product', self.pie.pk)])
+
+    @override_settings(CATALOG_CHANGES_PAGE_SIZE=1)
+    def test_pages_cover_every_change_once(self):
+        make_product(name='Tart')
+        token, pages = self.sync(0)
+        self.assertGreater(len(pages), 3)
+        names = [p['name'] for page in pages for p in page['products']]
+        self.assertEqual(sorted(names), ['Cake', 'Pie', 'Tart'])
+        self.assertTrue(all(len(page['products']) + len(page['categories']) <= 1 for page in pages))
+        self.assertEqual(self.changes(token), {
+            'token': token, 'has_more': False, 'categories': [], 'products': [],
+            'deleted': {'categories': [], 'products': []},
+        })
+
+    def test_rejects_bad_tokens(self):
+        for since in ('-1', 'abc'):
+            self.assertEqual(self.client.get(f'/api/catalog/changes/?since={since}').status_code, 400)
+
+
+class RequestProfilingTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_admin()
+        make_product()
+        response = self.client.post('/api/admin/profiles/token/', **auth(self.admin))
+        self.assertEqual(response.status_code, 201)
+        self.token = response.json()['token']
+
+    def test_profiled_request_is_stored_with_its_queries_and_stacks(self):
+        response = self.client.get(f'/api/products/?category=Cakes&_profile={self.token}')
+        self.assertEqual((response.status_code, len(response.json())), (200, 1))
+        profile_id = response['X-Profile-Id']
+
+        detail = self.client.get(f'/api/admin/profiles/{profile_id}/', **auth(self.admin)).json()
+        self.assertEqual((detail['method'], detail['path'], detail['status_code']),
+                         ('GET', '/api/products/?category=Cakes', 200))
+        self.assertEqual(detail['sql_count'], len(detail['queries']))
+        self.assertTrue(any('api_product' in query['sql'] for query in detail['queries']))
+        self.assertTrue(any('api/views.py' in line for query in detail['queries'] for line in query['origin']))
+
+        stacks = self.client.get(f'/api/admin/profiles/{profile_id}/stacks/', **auth(self.admin))
+        self.assertEqual(stacks['Content-Disposition'], f'attachment; filename="profile-{profile_id}.folded"')
+        for line in stacks.content.decode().splitlines():
+            self.assertRegex(line, r'^\S.* \d+$')
+
+    def test_only_valid_admin_tokens_profile(self):
+        user = make_user()
+        for token in ('nonsense', profiling.make_token(user)):
+            response = self.client.get('/api/products/', HTTP_X_PROFILE=token)
+            self.assertNotIn('X-Profile-Id', response)
+        User.objects.filter(pk=self.admin.pk).update(is_active=False)
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/products/', HTTP_X_PROFILE=self.token))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILE_KEEP=2)
+    def test_only_the_latest_profiles_are_kept(self):
+        ids = [int(self.client.get('/api/products/', HTTP_X_PROFILE=self.token)['X-Profile-Id']) for _ in range(3)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('id', flat=True)), ids[1:])
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = make_admin()
+        self.client.force_login(self.admin)
+        self.alice, self.bob = make_user('alice@example.com'), make_user('bob@example.com')
+        self.orders = []
+        for user, created in ((self.alice, datetime(2026, 1, 15)), (self.bob, datetime(2026, 3, 2))):
+            order = Order.objects.create(user=user, total=10, status='pending')
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.make_aware(created))
+            self.orders.append(order)
+
+    def listed(self, query=''):
+        response = self.client.get('/admin/api/order/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [order.pk for order in response.context['cl'].result_list]
+
+    def test_order_search_matches_ids_and_exact_emails(self):
+        alice, bob = (order.pk for order in self.orders)
+        self.assertEqual(self.listed(f'?q={bob}'), [bob])
+        self.assertEqual(self.listed('?q=alice@example.com'), [alice])
+        self.assertEqual(self.listed('?q=alice'), [])
+        self.assertEqual(self.listed('?user_email=bob@example.com'), [bob])
+
+    def test_date_hierarchy_lists_months_from_the_range(self):
+        months = admin.site._registry[Order].get_queryset(None).datetimes('created_at', 'month')
+        self.assertEqual([(m.year, m.month) for m in months], [(2026, 1), (2026, 2), (2026, 3)])
+        response = self.client.get('/admin/api/order/?created_at__year=2026')
+        self.assertContains(response, 'created_at__month=2')
+
+    def test_large_tables_show_the_planner_estimate(self):
+        queryset = Order.objects.all()
+        with mock.patch('api.admin.estimated_count', return_value=10 ** 6):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 10 ** 6)
+        with mock.patch('api.admin.estimated_count', return_value=3):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 2)
+        with mock.patch('api.admin.estimated_count', return_value=10 ** 6):
+            self.assertEqual(self.client.get('/admin/api/order/').context['cl'].result_count, 10 ** 6)
+
+    @skipUnless(connection.vendor == 'postgresql', "estimates come from the PostgreSQL planner")
+    def test_estimate_comes_from_the_planner(self):
+        self.assertIsInstance(estimated_count(Order.objects.filter(status='pending')), int)
+
+    def test_deleting_a_product_archives_it(self):
+        product = make_product()
+        response = self.client.post(f'/admin/api/product/{product.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        product.refresh_from_db()
+        self.assertIsNotNone(product.archived_at)
+        self.assertFalse(product.active)
+
+
+class EchoView(APIView):
+    requests = []
+
+    @cache_response(0, stale_ttl=60)
+    def get(self, request):
+        EchoView.requests.append(request)
+        return Response({'url': request.build_absolute_uri(), 'user': str(request.user), 'run': len(EchoView.requests)})
+
+
+class TieredCacheTests(CacheTestCase):
+    def wait_for_refreshes(self):
+        for _ in range(100):
+            if not tiered_cache.refreshing:
+                return
+            time.sleep(0.02)
+        self.fail("background refresh did not finish")
+
+    def test_responses_are_computed_from_the_url_only(self):
+        EchoView.requests = []
+        get = APIRequestFactory().get('/echo/?b=2&a=1&a=3', secure=True)
+        force_authenticate(get, user=make_user())
+        first = EchoView.as_view()(get).data
+        self.assertEqual(first, {'url': 'https://testserver/echo/?a=1&a=3&b=2', 'user': 'AnonymousUser', 'run': 1})
+
+        # Stale: served as is while a background refresh runs without the finished request.
+        self.assertEqual(EchoView.as_view()(APIRequestFactory().get('/echo/?a=1&a=3&b=2', secure=True)).data, first)
+        self.wait_for_refreshes()
+        refreshed = EchoView.as_view()(APIRequestFactory().get('/echo/?a=1&a=3&b=2', secure=True)).data
+        self.assertEqual(refreshed['run'], 2)
+        self.assertEqual(refreshed['url'], 'https://testserver/echo/?a=1&a=3&b=2')
+        self.assertIsNot(EchoView.requests[1], EchoView.requests[0])
+        self.assertEqual(EchoView.as_view()(APIRequestFactory().get('/echo/?a=1&a=3&b=2')).data['url'][:5], 'http:')
+
+    def test_one_thread_computes_while_the_others_wait_on_the_key(self):
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(tiered_cache.get_or_set, 'test:slow', slow, 60)]
+            started.wait(5)
+            futures += [pool.submit(tiered_cache.get_or_set, 'test:slow', slow, 60) for _ in range(2)]
+            # Other keys never queue behind the flight.
+            self.assertEqual(pool.submit(tiered_cache.get_or_set, 'test:fast', lambda: 'fast', 60).result(1), 'fast')
+            release.set()
+            self.assertEqual([future.result(5) for future in futures], ['slow'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(tiered_cache.flights, {})
+
+    def test_waiters_compute_themselves_when_the_leader_fails(self):
+        started, release = threading.Event(), threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise RuntimeError('boom')
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(tiered_cache.get_or_set, 'test:fail', failing, 60)
+            started.wait(5)
+            waiter = pool.submit(tiered_cache.get_or_set, 'test:fail', lambda: 'ok', 60)
+            time.sleep(0.05)
+            release.set()
+            with self.assertRaises(RuntimeError):
+                leader.result(5)
+            self.assertEqual(waiter.result(5), 'ok')
+
+
+class RetentionTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.active, self.gone = make_user(), make_user('gone@example.com')
+        self.cake, self.pie = make_product(name='Cake'), make_product(name='Pie')
+        old = timezone.now() - timedelta(days=61)
+        for user, product, updated_at in ((self.active, self.cake, old), (self.active, self.pie, timezone.now()),
+                                          (self.gone, self.cake, old), (self.gone, self.pie, old)):
+            cart = Cart.objects.create(user=user, product=product)
+            Cart.objects.filter(pk=cart.pk).update(updated_at=updated_at)
+
+    def run_policy(self, name, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            return retention.apply_policy(retention.POLICIES[name], sleep=0, **options)
+
+    def test_only_whole_abandoned_carts_go(self):
+        membership.get_membership(self.gone.pk)
+        rows, _, batches = self.run_policy('abandoned_carts', batch_size=1)
+        self.assertEqual((rows, batches), (2, 2))
+        self.assertEqual(set(Cart.objects.values_list('user_id', flat=True)), {self.active.pk})
+        self.assertEqual(membership.get_membership(self.gone.pk), (frozenset(), {}))
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(self.run_policy('abandoned_carts', dry_run=True)[::2], (2, 0))
+        self.assertEqual(Cart.objects.count(), 4)
+
+    def test_settled_reservations_and_old_events_go(self):
+        order = Order.objects.create(user=self.active, total=1)
+        long_ago = timezone.now() - timedelta(days=120)
+        for status in (StockReservation.HELD, StockReservation.RELEASED):
+            StockReservation.objects.create(order=order, product=self.cake, shard=0, quantity=1, status=status,
+                                            expires_at=long_ago)
+        for created_at in (long_ago, timezone.now()):
+            event = OrderStatusEvent.objects.create(user=self.active, order_id=order.pk, status='pending')
+            OrderStatusEvent.objects.filter(pk=event.pk).update(created_at=created_at)
+        self.assertEqual(self.run_policy('stock_reservations')[0], 1)
+        self.assertEqual(self.run_policy('order_status_events')[0], 1)
+        self.assertEqual(list(StockReservation.objects.values_list('status', flat=True)), [StockReservation.HELD])
+        self.assertEqual(OrderStatusEvent.objects.get().created_at.date(), timezone.now().date())
+
+    def test_wishlists_of_long_archived_products_go(self):
+        tart = make_product(name='Tart')
+        Product.objects.filter(pk=self.cake.pk).update(active=False, archived_at=timezone.now() - timedelta(days=31))
+        Product.objects.filter(pk=self.pie.pk).update(active=False, archived_at=timezone.now() - timedelta(days=1))
+        Product.objects.filter(pk=tart.pk).update(active=False)
+        for user in (self.active, self.gone):
+            for product in (self.cake, self.pie, tart):
+                Wishlist.objects.create(user=user, product=product)
+        popularity.refresh()
+        self.assertEqual(self.run_policy('inactive_wishlists', batch_size=1)[0], 2)
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'wishlist_count')), {'Cake': 0, 'Pie': 2, 'Tart': 2},
+        )
+        self.assertFalse(Wishlist.objects.filter(product=self.cake).exists())
+
+    def test_command_runs_the_chosen_policies(self):
+        out = io.StringIO()
+        call_command('apply_retention', policies=['abandoned_carts'], sleep=0, stdout=out)
+        self.assertIn('abandoned_carts: deleted 2 rows', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('apply_retention', policies=['everything'], stdout=out)
+
+    def test_api_requests_get_no_session(self):
+        response = self.client.get('/api/products/')
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.client.force_login(make_admin())
+        self.client.get('/api/products/')
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(self.client.get('/admin/').status_code, 200)
+
+
+class ImageUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = override_settings(IMAGE_UPLOAD_DIR=upload_dir, IMAGE_STORED_MAX_DIMENSION=8)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.admin = make_admin()
+        self.product = make_product()
+
+    def create_product(self, content, name='cake.png'):
+        data = {'name': 'Pie', 'price': '3.00', 'brand': 'Goeat', 'description': 'Apple',
+                'category': self.product.category_id, 'image': SimpleUploadedFile(name, content)}
+        return self.client.post('/api/products/', data, **auth(self.admin))
+
+    def test_multipart_images_are_queued_and_processed_by_the_worker(self):
+        response = self.create_product(image_bytes((32, 16)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['image_upload']['status'], ImageUpload.QUEUED)
+        product = Product.objects.get(name='Pie')
+        self.assertFalse(product.image)
+
+        self.assertEqual(uploads.process_queued_uploads(), 1)
+        product.refresh_from_db()
+        with default_storage.open(product.image.name) as stored, Image.open(stored) as image:
+            self.assertEqual(image.size, (8, 4))
+        upload = ImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.image), (ImageUpload.READY, product.image.name))
+        self.assertEqual(os.listdir(settings.IMAGE_UPLOAD_DIR), [])
+
+    def test_bad_images_are_rejected_before_decoding(self):
+        self.assertEqual(self.create_product(b'not an image').status_code, 400)
+        with self.settings(IMAGE_MAX_DIMENSION=20):
+            response = self.create_product(image_bytes((21, 2)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('21x2', response.json()['image'][0])
+        with self.settings(IMAGE_UPLOAD_MAX_BYTES=64):
+            self.assertEqual(self.create_product(image_bytes((64, 64), color='blue') * 4).status_code, 413)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def send(self, upload_id, content, first, size):
+        return self.client.patch(
+            f'/api/admin/uploads/{upload_id}/', content, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {first}-{first + len(content) - 1}/{size}', **auth(self.admin),
+        )
+
+    def test_resumable_upload_continues_from_the_reported_offset(self):
+        content = image_bytes((16, 16), 'JPEG')
+        started = self.client.post('/api/admin/uploads/', {
+            'kind': 'product', 'object_id': self.product.pk, 'filename': 'cake.jpg', 'size': len(content),
+        }, content_type='application/json', **auth(self.admin))
+        self.assertEqual(started.status_code, 201)
+        upload_id, half = started.json()['id'], len(content) // 2
+
+        self.assertEqual(self.send(upload_id, content[:half], 0, len(content)).json()['offset'], half)
+        conflict = self.send(upload_id, content[half + 1:], half + 1, len(content))
+        self.assertEqual((conflict.status_code, conflict.json()['offset']), (409, half))
+        offset = self.client.get(f'/api/admin/uploads/{upload_id}/', **auth(self.admin)).json()['offset']
+        done = self.send(upload_id, content[offset:], offset, len(content))
+        self.assertEqual(done.json()['status'], ImageUpload.QUEUED)
+
+        uploads.process_queued_uploads()
+        state = self.client.get(f'/api/admin/uploads/{upload_id}/', **auth(self.admin)).json()
+        self.assertEqual(state['status'], ImageUpload.READY)
+        self.product.refresh_from_db()
+        self.assertTrue(state['image'].endswith(self.product.image.name))
+
+    def test_uploads_abandoned_by_a_dead_worker_are_retried(self):
+        upload = uploads.queue_upload(self.admin, self.product, SimpleUploadedFile('cake.png', image_bytes()))
+        self.assertEqual(uploads.claim_uploads(10), [upload])
+        self.assertEqual(uploads.claim_uploads(10), [])
+        ImageUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now() - timedelta(minutes=11))
+        self.assertEqual(uploads.process_queued_uploads(), 1)
+        self.assertEqual(ImageUpload.objects.get().status, ImageUpload.READY)
+
+
+class BulkAdminTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_admin()
+        self.user = make_user()
+        self.cake = make_product(name='Cake')
+        inventory.set_stock(self.cake.pk, 100)
+
+    def orders(self, count, status='pending'):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, total=10, status=status)
+            OrderItem.from_product(order, self.cake, 1).save()
+            inventory.reserve(order, order.items.all())
+            orders.append(order)
+        return orders
+
+    def patch(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(url, data, content_type='application/json', **auth(self.admin))
+
+    def test_orders_move_with_their_side_effects_once(self):
+        orders = self.orders(3)
+        response = self.patch('/api/admin/orders/', {'filter': {'status': 'pending'}, 'status': 'processing'})
+        self.assertEqual(response.json(), {'matched': 3, 'updated': 3})
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'processing'})
+        popularity.refresh()
+        self.assertEqual(Product.objects.get(pk=self.cake.pk).sales_count_7d, 3)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.CONFIRMED).count(), 3)
+        self.assertEqual(OrderStatusEvent.objects.filter(status='processing').count(), 3)
+
+        ids = [order.pk for order in orders[:2]] + [10 ** 6]
+        again = self.patch('/api/admin/orders/', {'ids': ids, 'status': 'cancelled'}).json()
+        self.assertEqual(again, {'matched': 2, 'updated': 2, 'not_found': [10 ** 6]})
+        popularity.refresh()
+        self.assertEqual(Product.objects.get(pk=self.cake.pk).sales_count_7d, 1)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def queries(count):
+            ids = [order.pk for order in self.orders(count)]
+            with CaptureQueriesContext(connection) as captured:
+                self.patch('/api/admin/orders/', {'ids': ids, 'status': 'processing'})
+            return len(captured)
+        # The first batch also creates the day's sales row, in the one shard.
+        with mock.patch.object(popularity, 'SALES_SHARDS', 1):
+            queries(1)
+            self.assertEqual(queries(2), queries(8))
+
+    def test_bad_requests_change_nothing(self):
+        self.orders(3)
+        for data in (
+            {'filter': {'stauts': 'pending'}, 'status': 'processing'},
+            {'ids': [1], 'filter': {'status': 'pending'}, 'status': 'processing'},
+            {'ids': ['1'], 'status': 'processing'},
+            {'filter': {'status': 'pending'}, 'status': 'lost'},
+        ):
+            self.assertEqual(self.patch('/api/admin/orders/', data).status_code, 400)
+        with self.settings(ADMIN_BULK_MAX_ROWS=2):
+            response = self.patch('/api/admin/orders/', {'filter': {'status': 'pending'}, 'status': 'processing'})
+        self.assertEqual(response.json(), {'error': 'Matches more than 2 rows; narrow the filter'})
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'pending'})
+
+    def test_cancelled_orders_stay_cancelled(self):
+        cancelled, pending = self.orders(2)
+        self.patch('/api/admin/orders/', {'ids': [cancelled.pk], 'status': 'cancelled'})
+        response = self.patch('/api/admin/orders/', {'ids': [cancelled.pk, pending.pk], 'status': 'processing'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(cancelled.pk), response.json()['error'])
+        self.assertEqual(
+            dict(Order.objects.values_list('pk', 'status')), {cancelled.pk: 'cancelled', pending.pk: 'pending'},
+        )
+
+        url = f'/api/admin/orders/{cancelled.pk}/status/'
+        self.assertEqual(self.patch(url, {'status': 'shipped'}).status_code, 400)
+        self.assertEqual(self.patch(url, {'status': 'cancelled'}).status_code, 200)
+        self.assertEqual(OrderStatusEvent.objects.filter(order_id=cancelled.pk).count(), 1)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.HELD).count(), 1)
+
+    def test_products_and_users(self):
+        pie = make_product(name='Pie')
+        archived = make_product(name='Tart')
+        archive_products([archived.pk])
+        token = current_change_seq()
+        response = self.patch('/api/admin/products/', {'filter': {'category': self.cake.category_id}, 'active': False})
+        self.assertEqual(response.json(), {'matched': 2, 'updated': 2})
+        self.assertEqual(self.client.get('/api/products/').json(), [])
+        changed = self.client.get(f'/api/catalog/changes/?since={token}').json()['products']
+        self.assertEqual(sorted(p['name'] for p in changed), ['Cake', 'Pie'])
+        self.assertEqual(len({p['id'] for p in changed} & {pie.pk, self.cake.pk}), 2)
+
+        other = make_user('other@example.com')
+        response = self.patch('/api/admin/users/', {'ids': [self.user.pk, other.pk, self.admin.pk], 'is_active': False})
+        self.assertEqual(response.json(), {'matched': 2, 'updated': 2, 'not_found': [self.admin.pk]})
+        bad = self.patch('/api/admin/users/', {'filter': {'is_active': 'no'}, 'is_active': True})
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(self.patch('/api/admin/users/', {'filter': {'is_active': False}, 'is_active': True}).json(),
+                         {'matched': 2, 'updated': 2})
+
+
+class MediaStorageTests(MediaTestCase):
+    def test_names_are_content_hashes_and_duplicates_reuse_the_file(self):
+        first = default_storage.save('products/Cake.JPG', ContentFile(b'cake'))
+        again = default_storage.save('products/other.jpg', ContentFile(b'cake'))
+        other = default_storage.save('products/cake.jpg', ContentFile(b'pie'))
+        self.assertEqual(first, 'products/' + hashlib.sha256(b'cake').hexdigest()[:32] + '.jpg')
+        self.assertEqual(again, first)
+        self.assertNotEqual(other, first)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'products'))), 2)
+
+    def serve(self, path):
+        return serve_media(RequestFactory().get('/media/' + path), path)
+
+    def test_served_media_is_cached_forever(self):
+        name = default_storage.save('products/cake.png', ContentFile(b'png'))
+        response = self.serve(name)
+        self.assertEqual(b''.join(response.streaming_content), b'png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(f'max-age={settings.MEDIA_CACHE_MAX_AGE}', response['Cache-Control'])
+
+    def test_offloaded_media_is_sent_by_the_web_server(self):
+        name = default_storage.save('products/cake.png', ContentFile(b'png'))
+        with self.settings(MEDIA_OFFLOAD='x-accel'):
+            response = self.serve(name)
+            self.assertEqual(response['X-Accel-Redirect'], settings.MEDIA_ACCEL_PREFIX + name)
+            self.assertEqual((response['Content-Type'], response.content), ('image/png', b''))
+            for path in ('../settings.py', 'products/missing.png'):
+                with self.assertRaises(Http404):
+                    self.serve(path)
+        with self.settings(MEDIA_OFFLOAD='x-sendfile'):
+            self.assertEqual(self.serve(name)['X-Sendfile'], os.path.join(self.media_root, name))
+
+
+class HealthTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(warmup, '_ready', threading.Event())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def failing(self, step, error):
+        steps = [(name, mock.Mock(side_effect=error) if name == step else func) for name, func in warmup.STEPS]
+        return mock.patch.object(warmup, 'STEPS', steps)
+
+    def test_liveness(self):
+        self.assertEqual(self.client.get('/api/health/live/').json(), {'status': 'alive'})
+
+    def test_readiness_warms_up_the_process(self):
+        response = self.client.get('/api/health/ready/')
+        self.assertEqual((response.status_code, response.json()), (200, {'status': 'ready'}))
+        self.assertTrue(warmup.is_ready())
+
+    def test_failed_warm_up_reports_unavailable_and_is_retried(self):
+        with self.failing('database', DatabaseError('down')):
+            response = self.client.get('/api/health/ready/')
+        self.assertEqual((response.status_code, response.json()), (503, {'status': 'database unavailable'}))
+        with self.failing('caches', ConnectionError('cache down')), self.assertLogs('api.views', 'ERROR'):
+            self.assertEqual(self.client.get('/api/health/ready/').status_code, 503)
+        self.assertFalse(warmup.is_ready())
+        self.assertEqual(self.client.get('/api/health/ready/').status_code, 200)
+
+    @override_settings(WARMUP_ON_START=True)
+    def test_start_up_survives_a_failed_warm_up_and_closes_connections(self):
+        with self.failing('database', DatabaseError('down')), \
+                mock.patch.object(warmup.connections, 'close_all') as close_all, \
+                self.assertLogs('api.warmup', 'ERROR'):
+            warmup.warm_up_on_start()
+        close_all.assert_called_once_with()
+        self.assertFalse(warmup.is_ready())
+
+
+@override_settings(DATABASE_REPLICA_WEIGHTS={'replica1': 1})
+class ReadReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.router = db_router.PrimaryReplicaRouter()
+        self.user = make_user()
+        patcher = mock.patch.object(db_router, 'LOCAL_CACHES', ())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    def read(self):
+        return self.router.db_for_read(User)
+
+    def middleware(self, view):
+        return db_router.ReadYourWritesMiddleware(view)
+
+    def request(self, method='get'):
+        return getattr(RequestFactory(), method)('/api/products/', **auth(self.user))
+
+    def test_reads_go_to_replicas_outside_transactions(self):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.read(), 'replica1')
+            with db_router.primary():
+                self.assertEqual(self.read(), 'default')
+            self.assertEqual(self.read(), 'replica1')
+
+    def test_writes_outside_a_request_do_not_pin_the_process(self):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.router.db_for_write(User)
+            self.assertEqual(self.read(), 'replica1')
+
+    def test_a_write_pins_the_user_to_the_primary(self):
+        reads = []
+
+        def write(request):
+            reads.append(self.read())
+            self.router.db_for_write(User)
+            reads.append(self.read())
+            return HttpResponse()
+
+        def read(request):
+            reads.append(self.read())
+            return HttpResponse()
+
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.middleware(read)(self.request())
+            self.middleware(write)(self.request('put'))
+            self.assertEqual(self.read(), 'replica1')
+            self.middleware(read)(self.request())
+            cache.clear()
+            self.middleware(read)(self.request())
+        self.assertEqual(reads, ['replica1', 'default', 'default', 'default', 'replica1'])
+
+    def test_session_users_read_their_own_writes(self):
+        reads = []
+
+        def view(request):
+            if request.method == 'PUT':
+                self.router.db_for_write(User)
+            reads.append(self.read())
+            return HttpResponse()
+
+        def admin_request(method):
+            request = getattr(RequestFactory(), method)('/admin/api/product/1/change/')
+            request.user = self.user
+            return request
+
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.middleware(view)(admin_request('put'))
+            self.middleware(view)(admin_request('get'))
+        self.assertEqual(reads, ['default', 'default'])
+
+    def test_replicas_require_a_shared_cache(self):
+        with mock.patch.object(db_router, 'LOCAL_CACHES', (LocMemCache,)), \
+                self.assertRaises(ImproperlyConfigured):
+            self.middleware(lambda request: HttpResponse())
+
+
+class LaggingReplicaTests(LaggingReplicaTestCase):
+    def test_reads_outside_primary_miss_recent_writes(self):
+        make_user()
+        self.assertFalse(User.objects.exists())
+        with db_router.primary():
+            self.assertTrue(User.objects.exists())
+
+    def test_event_streams_read_the_primary(self):
+        user = make_user()
+        order = Order.objects.create(user=user, total=10, status='processing')
+        events.record_status_changes([order])
+        last_id = events.latest_event_id(user.pk)
+        self.assertTrue(last_id)
+        self.assertEqual([event['id'] for event in events._events_after(user.pk, 0)], [last_id])
+
+    def test_catalog_changes_read_the_primary(self):
+        make_product(name='Cake')
+        changes = catalog_changes(0, RequestFactory().get('/api/catalog/changes/'))
+        self.assertEqual([product['name'] for product in changes['products']], ['Cake'])
+
+    def test_cache_fills_read_the_primary(self):
+        make_product(name='Cake')
+        self.assertEqual(tiered_cache.get_or_set('lagging:products', Product.objects.count, ttl=60), 1)
+
+    def test_revenue_buckets_read_the_primary(self):
+        order = Order.objects.create(user=make_user(), total=10, status='completed')
+        yesterday = timezone.now() - timedelta(days=1)
+        Order.objects.filter(pk=order.pk).update(created_at=yesterday)
+        closed = reports.revenue_series('day', start=yesterday)[0]
+        self.assertEqual((closed['revenue'], closed['orders']), ('10.00', 1))
+
+    def test_worker_commands_read_the_primary(self):
+        Cart.objects.create(user=make_user(), product=make_product())
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=365))
+        out = io.StringIO()
+        call_command('apply_retention', policies=['abandoned_carts'], dry_run=True, stdout=out)
+        self.assertIn('abandoned_carts: would delete 1 rows', out.getvalue())
+
+
+class AdminOrderReportTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_admin()
+        self.customer = make_user('buyer@example.com')
+        self.day = datetime(2024, 3, 5, 12, tzinfo=dt_timezone.utc)
+        self.orders = [self.order('completed', 10), self.order('completed', 5), self.order('pending', 7)]
+
+    def order(self, status, total, created_at=None):
+        order = Order.objects.create(user=self.customer, total=total, status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at or self.day)
+        order.refresh_from_db()
+        return order
+
+    def get(self, url):
+        return self.client.get(url, **auth(self.admin))
+
+    def revenue(self):
+        response = self.get('/api/admin/stats/revenue/?start=2024-03-04&end=2024-03-06')
+        self.assertEqual(response.status_code, 200)
+        return [(bucket['revenue'], bucket['orders']) for bucket in response.json()['buckets']]
+
+    def test_order_filters(self):
+        self.order('delivered', 100, datetime(2024, 4, 1, tzinfo=dt_timezone.utc))
+        ids = lambda query: sorted(o['id'] for o in self.get('/api/admin/orders/?' + query).json())
+        self.assertEqual(ids('status=pending'), [self.orders[2].pk])
+        self.assertEqual(ids('date_from=2024-03-05&date_to=2024-03-05&min_total=6'),
+                         sorted([self.orders[0].pk, self.orders[2].pk]))
+        self.assertEqual(len(ids('email=buyer@example.com')), 4)
+        self.assertEqual(self.get('/api/admin/orders/?status=lost').status_code, 400)
+        self.assertEqual(self.get('/api/admin/orders/?min_total=NaNx').status_code, 400)
+        self.assertEqual(self.get('/api/admin/orders/?date_to=2024-02-30').status_code, 400)
+
+    def test_revenue_buckets(self):
+        self.assertEqual(self.revenue(), [('0.00', 0), ('15.00', 3), ('0.00', 0)])
+        response = self.get('/api/admin/stats/revenue/?granularity=month&start=2024-01-01&end=2024-03-31')
+        self.assertEqual([b['revenue'] for b in response.json()['buckets']], ['0.00', '0.00', '15.00'])
+
+    def test_cached_buckets_follow_order_changes(self):
+        self.assertEqual(self.revenue()[1], ('15.00', 3))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/admin/orders/', {'ids': [self.orders[0].pk], 'status': 'cancelled'},
+                                         content_type='application/json', **auth(self.admin))
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(self.revenue()[1], ('5.00', 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders[1].total = 8
+            self.orders[1].save()
+        self.assertEqual(self.revenue()[1], ('8.00', 3))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders[1].delete()
+        self.assertEqual(self.revenue()[1], ('0.00', 2))
+
+    def test_late_fill_does_not_undo_an_invalidation(self):
+        aggregate = reports._aggregate
+
+        def racing(*args):
+            # The order changes after the old buckets were computed but before they are cached.
+            computed = aggregate(*args)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.orders[1].total = 8
+                self.orders[1].save()
+            return computed
+
+        with mock.patch.object(reports, '_aggregate', racing):
+            self.assertEqual(self.revenue()[1], ('15.00', 3))
+        self.assertEqual(self.revenue()[1], ('18.00', 3))
+
+    def test_order_history_reads_recent_partitions(self):
+        recent = self.order('completed', 4, timezone.now())
+        ids = lambda query='': [o['id'] for o in self.get('/api/orders/' + query).json()]
+        self.assertEqual(ids(), [recent.pk])
+        self.assertEqual(sorted(ids('?months=600')), sorted([recent.pk] + [o.pk for o in self.orders]))
+        self.assertEqual(self.get('/api/orders/?months=0').status_code, 400)
+        [customer] = self.get('/api/admin/users/').json()
+        self.assertEqual(customer['totalSpent'], 4.0)
+
+    def test_stats_add_up_the_month_buckets(self):
+        stats = lambda: self.get('/api/admin/stats/').json()
+        self.assertEqual((stats()['total_orders'], stats()['total_revenue']), (3, 15.0))
+        # The closed months are cached: the oldest order and the current month are read.
+        with self.assertNumQueries(2):
+            reports.order_totals()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders[1].total = 8
+            self.orders[1].save()
+        self.assertEqual((stats()['total_orders'], stats()['total_revenue']), (3, 18.0))
+
+    def test_too_many_buckets_are_refused(self):
+        response = self.get('/api/admin/stats/revenue/?start=2000-01-01')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(settings.REVENUE_MAX_BUCKETS), response.json()['error'])
+
+
+class RecommendationTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.cake, self.pie, self.tart, self.flan = (make_product(name=name) for name in ('Cake', 'Pie', 'Tart', 'Flan'))
+
+    def order(self, status, *products, age=timedelta(hours=1)):
+        order = Order.objects.create(user=self.user, total=1, status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+        OrderItem.objects.bulk_create([OrderItem.from_product(order, product, 1) for product in products])
+
+    def related(self, product):
+        return [row['id'] for row in self.client.get(f'/api/products/{product.pk}/related/').json()]
+
+    def test_only_paid_orders_count(self):
+        self.order('completed', self.cake, self.pie)
+        self.order('delivered', self.cake, self.pie)
+        self.order('delivered', self.cake, self.flan)
+        self.order('pending', self.cake, self.tart)
+        self.order('pending', self.cake, self.tart)
+        self.order('cancelled', self.cake, self.tart)
+        recommendations.build()
+        self.assertEqual(self.related(self.cake), [self.pie.pk, self.flan.pk])
+        self.assertEqual(self.related(self.tart), [])
+
+    def test_recent_orders_wait_for_the_next_run(self):
+        self.order('completed', self.cake, self.pie)
+        self.order('completed', self.cake, self.tart, age=timedelta(minutes=1))
+        self.assertEqual(recommendations.build(), (1, 2))
+        self.assertEqual(self.related(self.cake), [self.pie.pk])
+        self.assertEqual(recommendations.build(lag=timedelta(0)), (1, 2))
+        self.assertEqual(sorted(self.related(self.cake)), sorted([self.pie.pk, self.tart.pk]))
+
+
+class PopularityTests(CacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_admin()
+        self.user = make_user()
+        self.cake, self.pie, self.tart = (make_product(name=name, price=price)
+                                          for name, price in (('Cake', 5), ('Pie', 3), ('Tart', 4)))
+
+    def order(self, *lines, age=timedelta(0)):
+        order = Order.objects.create(user=self.user, total=1, status='pending')
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+        OrderItem.objects.bulk_create([OrderItem.from_product(order, product, n) for product, n in lines])
+        return order
+
+    def set_status(self, order, new_status):
+        response = self.client.patch(f'/api/admin/orders/{order.pk}/status/', {'status': new_status},
+                                     content_type='application/json', **auth(self.admin))
+        self.assertEqual(response.status_code, 200)
+
+    def sorted_names(self, sort):
+        popularity.refresh()
+        clear_caches()
+        return [p['name'] for p in self.client.get(f'/api/products/?sort={sort}').json()]
+
+    def test_sales_follow_payments_and_cancellations(self):
+        first = self.order((self.pie, 3), (self.cake, 1))
+        self.order((self.tart, 10))
+        self.set_status(first, 'processing')
+        self.assertEqual(self.sorted_names('bestselling'), ['Pie', 'Cake', 'Tart'])
+        self.set_status(first, 'delivered')
+        self.assertEqual(Product.objects.get(pk=self.pie.pk).sales_count_30d, 3)
+        self.set_status(first, 'cancelled')
+        popularity.refresh()
+        self.cake.refresh_from_db()
+        self.assertEqual((self.cake.sales_count_7d, self.cake.sales_count_30d), (0, 0))
+
+    def test_refresh_moves_old_sales_out_of_the_windows(self):
+        old = self.order((self.pie, 2), age=timedelta(days=5))
+        recent = self.order((self.cake, 1))
+        self.set_status(old, 'processing')
+        self.set_status(recent, 'processing')
+        self.assertEqual(self.sorted_names('trending'), ['Pie', 'Cake', 'Tart'])
+        popularity.refresh(today=timezone.now().date() + timedelta(days=3))
+        clear_caches()
+        names = lambda sort: [p['name'] for p in self.client.get(f'/api/products/?sort={sort}').json()]
+        self.assertEqual(names('trending'), ['Cake', 'Pie', 'Tart'])
+        self.assertEqual(names('bestselling'), ['Pie', 'Cake', 'Tart'])
+
+    def test_payments_leave_product_rows_to_the_refresh(self):
+        order = self.order((self.pie, 3))
+        with CaptureQueriesContext(connection) as queries:
+            self.set_status(order, 'processing')
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE "api_product"')])
+        self.assertEqual(Product.objects.get(pk=self.pie.pk).sales_count_7d, 0)
+        self.assertEqual(popularity.refresh(), 2)
+        self.assertEqual(Product.objects.get(pk=self.pie.pk).sales_count_7d, 3)
+        self.assertEqual(popularity.refresh(), 0)
+
+    def test_wishlist_and_price_sorts(self):
+        for product in (self.tart, self.tart):
+            self.client.post('/api/wishlist/', {'product': product.pk}, content_type='application/json',
+                             **auth(self.user))
+        self.client.post('/api/wishlist/', {'product': self.pie.pk}, content_type='application/json',
+                         **auth(self.user))
+        self.assertEqual(self.sorted_names('most_wishlisted'), ['Pie', 'Cake', 'Tart'])
+        self.assertEqual(self.sorted_names('price_asc'), ['Pie', 'Tart', 'Cake'])
+        self.assertEqual(self.sorted_names('price_desc'), ['Cake', 'Tart', 'Pie'])
+        self.assertEqual(self.client.get('/api/products/?sort=random').status_code, 400)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.product = make_product()
+        inventory.set_stock(self.product.pk, 3, shards=2)
+
+    def buy(self, quantity=1, user=None):
+        return checkout(self.client, user or self.user, [{'product': self.product.pk, 'quantity': quantity}])
+
+    def levels(self):
+        levels = inventory.stock_levels(self.product.pk)
+        return levels['available'], levels['held']
+
+    def sweep(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return inventory.release_expired(now=timezone.now() + settings.STOCK_RESERVATION_TTL + timedelta(seconds=1))
+
+    def test_checkout_holds_stock_and_refuses_to_oversell(self):
+        self.assertEqual(self.buy(2).status_code, 201)
+        self.assertEqual(self.levels(), (1, 2))
+        response = self.buy(2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.json()['product'], response.json()['available']), (self.product.pk, 1))
+        self.assertEqual((Order.objects.count(), self.levels()), (1, (1, 2)))
+
+    def test_payment_confirms_the_hold_and_the_sweeper_leaves_it(self):
+        order_id = self.buy(2).json()['order_id']
+        response, _ = verify_payment(self.client, self.user, order_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.levels(), (1, 0))
+        self.assertEqual(self.sweep(), 0)
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'completed')
+
+    def test_sweeper_cancels_unpaid_orders_and_returns_their_stock(self):
+        order_id = self.buy(2).json()['order_id']
+        self.assertEqual(self.sweep(), 1)
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'cancelled')
+        self.assertEqual(self.levels(), (3, 0))
+
+    def test_deleting_orders_in_the_admin_returns_their_stock(self):
+        first, second = self.buy(1).json()['order_id'], self.buy(2).json()['order_id']
+        self.assertEqual(self.levels(), (0, 3))
+        self.client.force_login(make_admin())
+        self.client.post(f'/admin/api/order/{first}/delete/', {'post': 'yes'})
+        self.assertEqual(self.levels(), (1, 2))
+        self.client.post('/admin/api/order/', {'action': 'delete_selected', '_selected_action': [second], 'post': 'yes'})
+        self.assertEqual((Order.objects.count(), self.levels()), (0, (3, 0)))
+
+    def test_late_payment_takes_the_stock_again(self):
+        order_id = self.buy(2).json()['order_id']
+        self.sweep()
+        response, razorpay = verify_payment(self.client, self.user, order_id)
+        self.assertEqual((response.status_code, response.json()), (200, {'message': 'Payment verified successfully'}))
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.razorpay_payment_id), ('completed', 'pay_1'))
+        self.assertEqual(self.levels(), (1, 0))
+        razorpay.payment.refund.assert_not_called()
+        self.assertEqual(verify_payment(self.client, self.user, order_id)[0].status_code, 200)
+
+    def test_late_payment_for_sold_out_stock_is_refunded(self):
+        order_id = self.buy(2).json()['order_id']
+        self.sweep()
+        self.assertEqual(self.buy(3, make_user('fast@example.com')).status_code, 201)
+
+        response, razorpay = verify_payment(self.client, self.user, order_id)
+        self.assertEqual(response.status_code, 409)
+        razorpay.payment.refund.assert_called_once_with('pay_1', {})
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.razorpay_payment_id), ('cancelled', 'pay_1'))
+        self.assertEqual(self.levels(), (0, 3))
+
+        response, razorpay = verify_payment(self.client, self.user, order_id)
+        self.assertEqual(response.status_code, 409)
+        razorpay.payment.refund.assert_not_called()
+
+    def test_payment_for_another_order_is_refused(self):
+        first = self.buy().json()['order_id']
+        second = Order.objects.get(pk=self.buy().json()['order_id'])
+        with gateway():
+            response = self.client.post('/api/orders/verify-payment/', {
+                'order_id': first, 'razorpay_order_id': second.razorpay_order_id,
+                'razorpay_payment_id': 'pay_1', 'razorpay_signature': 'sig',
+            }, content_type='application/json', **auth(self.user))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=first).status, 'pending')
+
+    @override_settings(RAZORPAY_WEBHOOK_SECRET='whsec')
+    def test_late_webhook_payment(self):
+        paid, sold_out = self.buy(2).json()['order_id'], self.buy(1).json()['order_id']
+        self.sweep()
+        self.assertEqual(self.buy(1, make_user('fast@example.com')).status_code, 201)
+        for order_id, payment_id in ((paid, 'pay_a'), (sold_out, 'pay_b')):
+            PaymentEvent.objects.create(
+                event_id=payment_id, event='payment.captured', occurred_at=timezone.now(),
+                razorpay_order_id=Order.objects.get(pk=order_id).razorpay_order_id,
+                payload={'payload': {'payment': {'entity': {'id': payment_id}}}},
+            )
+        # The first order got its two units back; the second found none left.
+        with gateway() as razorpay:
+            process_pending_events()
+        razorpay.payment.refund.assert_called_once_with('pay_b', {})
+        self.assertEqual(
+            list(Order.objects.filter(pk__in=[paid, sold_out]).order_by('pk').values_list('status', 'razorpay_payment_id')),
+            [('completed', 'pay_a'), ('cancelled', 'pay_b')],
+        )
+        self.assertEqual(dict(PaymentEvent.objects.values_list('event_id', 'outcome')),
+                         {'pay_a': 'applied', 'pay_b': 'sold_out'})
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs concurrent transactions")
+class SweeperPaymentRaceTests(TransactionTestCase):
+    """Payments arriving while the sweeper cancels the same expired orders."""
+
+    def test_every_payment_ends_completed_or_refunded(self):
+        product = make_product()
+        inventory.set_stock(product.pk, 30, shards=3)
+        users = [make_user(f'buyer{i}@example.com') for i in range(20)]
+        orders = []
+        for i, user in enumerate(users):
+            order = Order.objects.create(user=user, total=1, status='pending', razorpay_order_id=f'order_race_{i}')
+            items = [OrderItem.objects.create(order=order, product=product, quantity=1, price=1)]
+            inventory.reserve(order, items)
+            orders.append(order)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        def pay(order):
+            try:
+                return post_payment(Client(), order.user, order.pk, f'pay_{order.pk}').status_code
+            finally:
+                connections.close_all()
+
+        def sweep():
+            try:
+                while inventory.release_expired(batch_size=3):
+                    pass
+            finally:
+                connections.close_all()
+
+        def rush():
+            # Other shoppers take stock freed by the sweeper.
+            try:
+                for i in range(12):
+                    order = Order.objects.create(user=users[0], total=1, status='pending')
+                    items = [OrderItem.objects.create(order=order, product=product, quantity=1, price=1)]
+                    try:
+                        with transaction.atomic():
+                            inventory.reserve(order, items)
+                    except inventory.OutOfStock:
+                        order.delete()
+            finally:
+                connections.close_all()
+
+        with gateway() as razorpay, ThreadPoolExecutor(max_workers=8) as pool:
+            sweeper, rusher = pool.submit(sweep), pool.submit(rush)
+            statuses = list(pool.map(pay, orders))
+            sweeper.result(), rusher.result()
+
+        refunded = {call.args[0] for call in razorpay.payment.refund.call_args_list}
+        self.assertEqual(len(refunded), len(razorpay.payment.refund.call_args_list))
+        for order, status_code in zip(orders, statuses):
+            order.refresh_from_db()
+            self.assertEqual(order.razorpay_payment_id, f'pay_{order.pk}')
+            if order.status == 'completed':
+                self.assertEqual(status_code, 200)
+                self.assertNotIn(order.razorpay_payment_id, refunded)
+                self.assertEqual(order.stock_reservations.filter(status=StockReservation.CONFIRMED).count(), 1)
+            else:
+                self.assertEqual((order.status, status_code), ('cancelled', 409))
+                self.assertIn(order.razorpay_payment_id, refunded)
+                self.assertFalse(order.stock_reservations.filter(status=StockReservation.HELD).exists())
+        levels = inventory.stock_levels(product.pk)
+        sold = StockReservation.objects.filter(status=StockReservation.CONFIRMED).count()
+        self.assertEqual(levels['available'] + levels['held'] + sold, 30)
@@ -0,0 +1,315 @@
+"""Product and category image uploads.
+
+Images never pass through a request worker's memory. Multipart uploads
+stream to a temporary file in chunks and stop as soon as they pass
+``IMAGE_UPLOAD_MAX_BYTES``. Large files can instead be sent in pieces to
+``/api/admin/uploads/`` with ``Content-Range`` headers, resuming from the
+returned offset after a dropped connection.
+
+A request only reads the image header, checking the format and pixel
+dimensions before anything is decoded, then queues an ImageUpload. The
+``process_image_uploads`` worker does the full decode: it applies the EXIF
+orientation, scales the image down to ``IMAGE_STORED_MAX_DIMENSION``,
+strips metadata, stores the result and sets it on the product or category.
+
+Partial and queued files live in ``IMAGE_UPLOAD_DIR``, which the web
+workers and the upload worker must share.
+"""
+import fcntl
+import io
+import logging
+import os
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from PIL import Image, ImageOps
+from rest_framework.response import Response
+
+from .models import Category, ImageUpload, Product
+
+
+logger = logging.getLogger(__name__)
+
+MODELS = {'product': Product, 'category': Category}
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+READ_SIZE = 64 * 1024
+# Room for the other form fields of a multipart image upload.
+FORM_OVERHEAD = 64 * 1024
+# A processing upload untouched this long belonged to a worker that died.
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+
+
+class UploadRejected(Exception):
+    status_code = 400
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+
+
+class UploadConflict(UploadRejected):
+    status_code = 409
+
+
+def part_path(upload):
+    return os.path.join(settings.IMAGE_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def inspect_image(file):
+    """Check an image's format and dimensions from its header only.
+
+    ``file`` is a path or a file object. Raises UploadRejected.
+    """
+    try:
+        with Image.open(file) as image:
+            fmt, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise UploadRejected(f"Image has more than {settings.IMAGE_MAX_PIXELS} pixels")
+    except Exception:
+        raise UploadRejected("Not an image file")
+    finally:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+    if fmt not in FORMATS:
+        raise UploadRejected(f"Unsupported image format {fmt}; use {', '.join(FORMATS)}")
+    if max(width, height) > settings.IMAGE_MAX_DIMENSION or width * height > settings.IMAGE_MAX_PIXELS:
+        raise UploadRejected(
+            f"Image is {width}x{height}; at most {settings.IMAGE_MAX_DIMENSION} pixels a side "
+            f"and {settings.IMAGE_MAX_PIXELS} pixels in total"
+        )
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploaded files to disk and gives up past IMAGE_UPLOAD_MAX_BYTES."""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.IMAGE_UPLOAD_MAX_BYTES + FORM_OVERHEAD:
+            raise UploadTooLarge(_too_large())
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.file.close()
+            raise UploadTooLarge(_too_large())
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _too_large():
+    return f"Uploads are limited to {settings.IMAGE_UPLOAD_MAX_BYTES} bytes"
+
+
+class ImageUploadMixin:
+    """For APIViews taking multipart image uploads: stream them to disk within the limits."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [LimitedUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, UploadRejected):
+            return Response({'error': str(exc)}, status=exc.status_code)
+        return super().handle_exception(exc)
+
+
+def queue_upload(user, instance, file):
+    """Queue an uploaded file, already checked by inspect_image, as ``instance``'s image."""
+    upload = ImageUpload(
+        user=user, kind=instance._meta.model_name, object_id=instance.pk,
+        filename=os.path.basename(file.name)[:255], size=file.size, status=ImageUpload.QUEUED,
+    )
+    os.makedirs(settings.IMAGE_UPLOAD_DIR, exist_ok=True)
+    if hasattr(file, 'temporary_file_path'):
+        file_move_safe(file.temporary_file_path(), part_path(upload))
+    else:
+        with open(part_path(upload), 'wb') as part:
+            for chunk in file.chunks():
+                part.write(chunk)
+    upload.save()
+    return upload
+
+
+def start_upload(user, kind, object_id, filename, size):
+    """Open a resumable upload of ``size`` bytes for the ``kind`` object ``object_id``."""
+    if kind not in MODELS:
+        raise UploadRejected(f"kind must be one of {', '.join(MODELS)}")
+    if size <= 0:
+        raise UploadRejected("size must be positive")
+    if size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(_too_large())
+    if not MODELS[kind].objects.filter(pk=object_id).exists():
+        raise UploadRejected(f"No {kind} {object_id}")
+    upload = ImageUpload(user=user, kind=kind, object_id=object_id, filename=os.path.basename(filename)[:255], size=size)
+    os.makedirs(settings.IMAGE_UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload), 'xb').close()
+    upload.save()
+    return upload
+
+
+def received_bytes(upload):
+    if upload.status != ImageUpload.UPLOADING:
+        return upload.size
+    try:
+        return os.path.getsize(part_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def write_chunk(upload, offset, length, stream):
+    """Append ``length`` bytes read from ``stream`` at ``offset`` of ``upload``.
+
+    The part file is the record of what has arrived, so a chunk cut off
+    halfway still counts for what was written. Returns the new offset; the
+    upload is queued once the last byte is in.
+    """
+    if upload.status != ImageUpload.UPLOADING:
+        raise UploadConflict(f"Upload is {upload.status}")
+    if length > settings.IMAGE_UPLOAD_CHUNK_BYTES:
+        raise UploadTooLarge(f"Chunks are limited to {settings.IMAGE_UPLOAD_CHUNK_BYTES} bytes")
+    if offset + length > upload.size:
+        raise UploadRejected(f"Chunk ends past the upload's {upload.size} bytes")
+    try:
+        part = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadConflict("Upload is gone")
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict("Another chunk of this upload is being written")
+        received = part.seek(0, os.SEEK_END)
+        if offset != received:
+            raise UploadConflict(f"Expected offset {received}")
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+        part.flush()
+        received = os.fstat(part.fileno()).st_size
+
+    if received == upload.size:
+        try:
+            inspect_image(part_path(upload))
+        except UploadRejected as e:
+            _finish(upload, ImageUpload.FAILED, error=str(e))
+            raise
+        upload.status = ImageUpload.QUEUED
+        upload.save(update_fields=['status', 'updated_at'])
+    return received
+
+
+def upload_state(upload, request=None):
+    image = None
+    if upload.image and request is not None:
+        image = request.build_absolute_uri(default_storage.url(upload.image))
+    return {
+        'id': str(upload.pk),
+        'kind': upload.kind,
+        'object_id': upload.object_id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': received_bytes(upload),
+        'status': upload.status,
+        'error': upload.error,
+        'image': image,
+    }
+
+
+def _remove_part(upload):
+    try:
+        os.unlink(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+@receiver(post_delete, sender=ImageUpload)
+def _delete_part(sender, instance, **kwargs):
+    _remove_part(instance)
+
+
+def _finish(upload, status, error='', image=''):
+    upload.status, upload.error, upload.image = status, error[:255], image
+    upload.save(update_fields=['status', 'error', 'image', 'updated_at'])
+    _remove_part(upload)
+
+
+def claim_uploads(batch_size):
+    """Mark up to ``batch_size`` queued uploads as processing and return them."""
+    ImageUpload.objects.filter(
+        status=ImageUpload.PROCESSING, updated_at__lt=timezone.now() - PROCESSING_TIMEOUT,
+    ).update(status=ImageUpload.QUEUED)
+    with transaction.atomic():
+        uploads = list(
+            ImageUpload.objects.filter(status=ImageUpload.QUEUED)
+            .order_by('created_at').select_for_update(skip_locked=True)[:batch_size]
+        )
+        ImageUpload.objects.filter(pk__in=[upload.pk for upload in uploads]).update(
+            status=ImageUpload.PROCESSING, updated_at=timezone.now(),
+        )
+    return uploads
+
+
+def render_image(path):
+    """``(bytes, extension)`` of the image at ``path`` as it should be stored."""
+    Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+    limit = settings.IMAGE_STORED_MAX_DIMENSION
+    with Image.open(path) as image:
+        fmt = image.format
+        if fmt == 'GIF':
+            # Re-encoding would drop the animation; the header check bounded its size.
+            with open(path, 'rb') as f:
+                return f.read(), FORMATS[fmt]
+        # JPEGs are decoded straight at a reduced scale when that still fits.
+        image.draft('RGB', (limit, limit))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((limit, limit))
+        options = {'optimize': True}
+        if fmt == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            options.update(quality=85, progressive=True)
+        elif fmt == 'WEBP':
+            options = {'quality': 85}
+        output = io.BytesIO()
+        image.save(output, fmt, **options)
+    return output.getvalue(), FORMATS[fmt]
+
+
+def process_upload(upload):
+    """Store ``upload``'s image and set it on its product or category."""
+    model = MODELS[upload.kind]
+    try:
+        content, ext = render_image(part_path(upload))
+    except Exception as e:
+        logger.warning("Image upload %s could not be processed: %s", upload.pk, e)
+        _finish(upload, ImageUpload.FAILED, error=f"Invalid image: {e}")
+        return
+    upload_to = model._meta.get_field('image').upload_to
+    name = default_storage.save(
+        posixpath.join(upload_to, posixpath.splitext(upload.filename)[0] + ext), ContentFile(content),
+    )
+    instance = model.objects.filter(pk=upload.object_id).first()
+    if instance is None:
+        _finish(upload, ImageUpload.FAILED, error=f"{upload.kind} {upload.object_id} no longer exists")
+        return
+    instance.image = name
+    instance.save(update_fields=['image'])
+    _finish(upload, ImageUpload.READY, image=name)
+
+
+def process_queued_uploads(batch_size=10):
+    """Process one batch of queued uploads. Returns the batch size."""
+    uploads = claim_uploads(batch_size)
+    for upload in uploads:
+        process_upload(upload)
+    return len(uploads)
@@ -1,13 +1,20 @@
 from django.urls import path
 from .views import (
+    LivenessView, ReadinessView,
     RegisterView, LoginView, UserListView, BlockUnblockUserView,
     CategoryListCreateView, ProductListCreateView, ProductDetailView,
     CartView, WishlistView, CreateOrderView, OrderListView, VerifyPaymentView,
-    CartItemDetailView, AdminStatsView, AdminUserListView, AdminProductView,
-    AdminOrderListView, AdminOrderStatusUpdateView,AdminOrderDetailView
+    CartItemDetailView, AdminStatsView, AdminUserListView, AdminProductListView, AdminProductView,
+    AdminOrderListView, AdminOrderStatusUpdateView,AdminOrderDetailView,
+    AdminCatalogImportView, RazorpayWebhookView, AdminRevenueView, RelatedProductsView,
+    AdminProductStockView, CatalogChangesView, order_events_stream,
+    AdminImageUploadView, AdminImageUploadDetailView,
+    AdminCacheStatsView, AdminProfileTokenView, AdminProfileListView, AdminProfileDetailView, AdminProfileStacksView,
 )
 
 urlpatterns = [
+    path('health/live/', LivenessView.as_view(), name='health-live'),
+    path('health/ready/', ReadinessView.as_view(), name='health-ready'),
    
     path('register/', RegisterView.as_view()),
     path('login/', LoginView.as_view()),
@@ -22,6 +29,8 @@ urlpatterns = [
    
     path('products/', ProductListCreateView.as_view()),
     path('products/<int:pk>/', ProductDetailView.as_view()),
+    path('products/<int:pk>/related/', RelatedProductsView.as_view(), name='product-related'),
+    path('catalog/changes/', CatalogChangesView.as_view(), name='catalog-changes'),
 
    
     path('cart/', CartView.as_view()),
@@ -30,15 +39,28 @@ urlpatterns = [
 
  
     path('orders/create/', CreateOrderView.as_view()),
+    path('orders/events/', order_events_stream, name='order-events'),
     path('orders/', OrderListView.as_view()),
     path('orders/verify-payment/', VerifyPaymentView.as_view()),
+    path('payments/razorpay/webhook/', RazorpayWebhookView.as_view(), name='razorpay-webhook'),
 
     path('admin/stats/', AdminStatsView.as_view(), name='admin-stats'),
+    path('admin/stats/revenue/', AdminRevenueView.as_view(), name='admin-stats-revenue'),
     path('admin/users/', AdminUserListView.as_view(), name='admin-users'),
     path('admin/users/<int:pk>/block/', BlockUnblockUserView.as_view(), name='block-user'),
+    path('admin/products/', AdminProductListView.as_view(), name='admin-products'),
     path('admin/products/<int:pk>/', AdminProductView.as_view(), name='admin-product'),
+    path('admin/products/<int:pk>/stock/', AdminProductStockView.as_view(), name='admin-product-stock'),
+    path('admin/products/import/', AdminCatalogImportView.as_view(), name='admin-product-import'),
     path('admin/orders/', AdminOrderListView.as_view(), name='admin-orders'),
     path('admin/orders/<int:pk>/status/', AdminOrderStatusUpdateView.as_view(), name='admin-order-status'),
     path('admin/orders/<int:pk>/', AdminOrderDetailView.as_view(), name='admin-order-detail'),
+    path('admin/uploads/', AdminImageUploadView.as_view(), name='admin-uploads'),
+    path('admin/uploads/<uuid:pk>/', AdminImageUploadDetailView.as_view(), name='admin-upload-detail'),
+    path('admin/cache/', AdminCacheStatsView.as_view(), name='admin-cache'),
+    path('admin/profiles/', AdminProfileListView.as_view(), name='admin-profiles'),
+    path('admin/profiles/token/', AdminProfileTokenView.as_view(), name='admin-profile-token'),
+    path('admin/profiles/<int:pk>/', AdminProfileDetailView.as_view(), name='admin-profile-detail'),
+    path('admin/profiles/<int:pk>/stacks/', AdminProfileStacksView.as_view(), name='admin-profile-stacks'),
 
 ]
@@ -2,25 +2,55 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework.exceptions import AuthenticationFailed
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum
-from django.core.mail import send_mail
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+from django.db import DatabaseError, connection, transaction
 from django.conf import settings
 from django.contrib.auth import get_user_model,authenticate
 from django.contrib.auth.hashers import check_password
-import razorpay
+import logging
+import mimetypes
+import os
+import re
+import tempfile
 
-from .models import User, Product, Category, Cart, Wishlist, Order, OrderItem
+from dessertshop_backend.cache import cache_response, tiered_cache
+
+from .models import (
+    User, Product, Category, Cart, Wishlist, Order, OrderItem, PaymentEvent, RelatedProduct, RequestProfile,
+    ImageUpload,
+)
 from .serializers import (
     UserSerializer, ProductSerializer, CategorySerializer,
     CartSerializer, WishlistSerializer, OrderSerializer, OrderItemSerializer
 )
 from .permissions import IsAdmin
+from .archival import archive_products
+from .catalog import CATALOG_TAG, catalog_changes
+from .fastpath import PRODUCT_PLAN
+from .fieldsets import prune_queryset, request_fieldset
+from .membership import invalidate_membership, with_membership
+from .recommendations import RECOMMENDATIONS_TAG
+from .events import db_call, event_stream, latest_event_id, record_status_changes
+from .clients import razorpay_client, send_mail
+from .idempotency import idempotent
+from . import bulk, profiling, warmup
+from .reports import GRANULARITIES, filter_orders, order_totals, parse_when, revenue_series
+from .partitions import history_start
+from .payments import SOLD_OUT, STALE, complete_payment, parse_event, refund_payment, verify_webhook_signature
+from .popularity import PRODUCT_SORTS, record_sales, record_wishlist, sales_sign
+from .inventory import OutOfStock, release, reserve, set_stock, settle, stock_levels
+from .uploads import ImageUploadMixin, UploadRejected, start_upload, upload_state, write_chunk
 
 User = get_user_model()
-
-
-client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+logger = logging.getLogger(__name__)
 
 
 
@@ -33,6 +63,31 @@ def get_tokens_for_user(user):
 
 
 
+class LivenessView(APIView):
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return Response({"status": "alive"})
+
+
+class ReadinessView(APIView):
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            # Runs the warm-up if it is off at start or failed there.
+            warmup.warm_up()
+            connection.ensure_connection()
+        except DatabaseError:
+            return Response({"status": "database unavailable"}, status=503)
+        except Exception:
+            logger.exception("Warm-up failed")
+            return Response({"status": "warming up"}, status=503)
+        return Response({"status": "ready"})
+
+
 class RegisterView(APIView):
     def post(self, request):
         serializer = UserSerializer(data=request.data)
@@ -101,16 +156,25 @@ class BlockUnblockUserView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def patch(self, request, pk):
-        user = get_object_or_404(User, id=pk)
-        user.is_active = not user.is_active
-        user.save()
-        return Response({'message': f'User {"unblocked" if user.is_active else "blocked"} successfully.'})
+        is_active = request.data.get('is_active')
+        if is_active is not None and not isinstance(is_active, bool):
+            return Response({'error': 'is_active must be true or false'}, status=400)
+        with transaction.atomic():
+            user = get_object_or_404(User.objects.select_for_update(), id=pk)
+            # Without an explicit is_active the call toggles, under the row lock.
+            user.is_active = not user.is_active if is_active is None else is_active
+            User.objects.filter(pk=user.pk).update(is_active=user.is_active)
+        return Response({
+            'message': f'User {"unblocked" if user.is_active else "blocked"} successfully.',
+            'is_active': user.is_active,
+        })
 
 
 
-class CategoryListCreateView(APIView):
+class CategoryListCreateView(ImageUploadMixin, APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    @cache_response(60, tags=[CATALOG_TAG], stale_ttl=300)
     def get(self, request):
         categories = Category.objects.all()
         serializer = CategorySerializer(categories, many=True, context={'request': request})
@@ -127,12 +191,19 @@ class CategoryListCreateView(APIView):
 
 
 
-class ProductListCreateView(APIView):
+class ProductListCreateView(ImageUploadMixin, APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    # Popularity sorts follow sales, so this only lags them by the TTL.
+    @cache_response(60, tags=[CATALOG_TAG], stale_ttl=300, postprocess=with_membership)
     def get(self, request):
         category = request.GET.get('category')
         products = Product.objects.filter(category__name=category, active=True) if category else Product.objects.filter(active=True)
+        sort = request.GET.get('sort')
+        if sort:
+            if sort not in PRODUCT_SORTS:
+                return Response({'error': f"sort must be one of {', '.join(PRODUCT_SORTS)}"}, status=400)
+            products = products.order_by(*PRODUCT_SORTS[sort])
         serializer = ProductSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -147,18 +218,44 @@ class ProductListCreateView(APIView):
 
 
 class ProductDetailView(APIView):
+    @cache_response(60, tags=[CATALOG_TAG], stale_ttl=300, postprocess=with_membership)
     def get(self, request, pk):
-        product = get_object_or_404(Product, id=pk)
+        products = Product.objects.filter(archived_at__isnull=True)
+        product = get_object_or_404(prune_queryset(products, ProductSerializer, request), id=pk)
         serializer = ProductSerializer(product, context={'request': request})
         return Response(serializer.data)
 
 
 
+class RelatedProductsView(APIView):
+    @cache_response(300, tags=[CATALOG_TAG, RECOMMENDATIONS_TAG], stale_ttl=3600)
+    def get(self, request, pk):
+        related = RelatedProduct.objects.filter(product_id=pk, related__active=True).order_by('rank')
+        plan = PRODUCT_PLAN.select(request_fieldset(request))
+        return Response(plan.serialize(related, request, prefix='related__'))
+
+
+class CatalogChangesView(APIView):
+    """Products and categories changed since ``?since=``, for incremental sync.
+
+    Start with ``since=0`` and pass back the returned token; keep going
+    while ``has_more`` is true. Archived products are listed as deleted.
+    """
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            since = -1
+        if since < 0:
+            return Response({"error": "Invalid since token"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(catalog_changes(since, request))
+
+
 class CartView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        cart_items = Cart.objects.filter(user=request.user)
+        cart_items = Cart.objects.filter(user=request.user, product__active=True)
         serializer = CartSerializer(cart_items, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -168,6 +265,7 @@ class CartView(APIView):
 
         if not product_id:
             return Response({"error": "Product ID required"}, status=status.HTTP_400_BAD_REQUEST)
+        get_object_or_404(Product, id=product_id, active=True)
 
         cart_item, created = Cart.objects.get_or_create(
             user=request.user,
@@ -178,6 +276,7 @@ class CartView(APIView):
         if not created:
             cart_item.quantity += quantity
             cart_item.save()
+        invalidate_membership(request.user.pk)
 
         serializer = CartSerializer(cart_item, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -192,6 +291,7 @@ class CartItemDetailView(APIView):
         if quantity is not None:
             cart_item.quantity = quantity
             cart_item.save()
+            invalidate_membership(request.user.pk)
             serializer = CartSerializer(cart_item, context={'request': request})
             return Response(serializer.data)
         return Response({"error": "Quantity not provided"}, status=status.HTTP_400_BAD_REQUEST)
@@ -199,6 +299,7 @@ class CartItemDetailView(APIView):
     def delete(self, request, pk):
         cart_item = get_object_or_404(Cart, id=pk, user=request.user)
         cart_item.delete()
+        invalidate_membership(request.user.pk)
         return Response({"message": "Item removed from cart"}, status=status.HTTP_200_OK)
 
 
@@ -207,7 +308,7 @@ class WishlistView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        wishlist = Wishlist.objects.filter(user=request.user)
+        wishlist = Wishlist.objects.filter(user=request.user, product__active=True)
         serializer = WishlistSerializer(wishlist, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -217,17 +318,27 @@ class WishlistView(APIView):
             return Response({"error": "Product ID required"}, status=status.HTTP_400_BAD_REQUEST)
 
         product = get_object_or_404(Product, id=product_id)
-        wishlist_item, created = Wishlist.objects.get_or_create(user=request.user, product=product)
-        if not created:
-            wishlist_item.delete()
-            return Response({"message": "Item removed from wishlist"})
+        with transaction.atomic():
+            invalidate_membership(request.user.pk)
+            wishlist_item, created = Wishlist.objects.get_or_create(user=request.user, product=product)
+            # Hidden and archived products can still be removed, not added.
+            if created and not product.active:
+                raise Http404
+            if not created:
+                wishlist_item.delete()
+                record_wishlist(product.id, -1)
+                return Response({"message": "Item removed from wishlist"})
+            record_wishlist(product.id, 1)
         return Response({"message": "Item added to wishlist"}, status=status.HTTP_201_CREATED)
 
     def delete(self, request):
         product_id = request.data.get('product')
         if not product_id:
             return Response({"error": "Product ID required"}, status=status.HTTP_400_BAD_REQUEST)
-        Wishlist.objects.filter(user=request.user, product_id=product_id).delete()
+        with transaction.atomic():
+            invalidate_membership(request.user.pk)
+            deleted, _ = Wishlist.objects.filter(user=request.user, product_id=product_id).delete()
+            record_wishlist(product_id, -deleted)
         return Response({"message": "Item removed from wishlist"})
 
 
@@ -235,6 +346,7 @@ class WishlistView(APIView):
 class CreateOrderView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         try:
             items = request.data.get('items')
@@ -244,22 +356,29 @@ class CreateOrderView(APIView):
                 return Response({"error": "Items and total required"}, status=400)
 
             total = float(total)
-            order = Order.objects.create(user=request.user, total=total, status="pending")
-
-            for item in items:
-                product = get_object_or_404(Product, id=item['product'])
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=item.get('quantity', 1),
-                    price=product.price
-                )
-
-            razorpay_order = client.order.create({
-                "amount": int(total * 100),
-                "currency": "INR",
-                "payment_capture": 1
-            })
+            with transaction.atomic():
+                order = Order.objects.create(user=request.user, total=total, status="pending")
+
+                order_items = []
+                for item in items:
+                    product = get_object_or_404(Product.objects.select_related('category'), id=item['product'], active=True)
+                    order_items.append(OrderItem.from_product(order, product, item.get('quantity', 1)))
+                OrderItem.objects.bulk_create(order_items)
+                reserve(order, order_items)
+
+            try:
+                razorpay_order = razorpay_client().order.create({
+                    "amount": int(total * 100),
+                    "currency": "INR",
+                    "payment_capture": 1
+                })
+            except Exception:
+                with transaction.atomic():
+                    order.status = 'cancelled'
+                    order.save(update_fields=['status'])
+                    release([order.pk])
+                    record_status_changes([order])
+                raise
 
             order.razorpay_order_id = razorpay_order['id']
             order.save()
@@ -271,6 +390,9 @@ class CreateOrderView(APIView):
                 "currency": razorpay_order['currency']
             }, status=201)
 
+        except OutOfStock as e:
+            return Response({"error": str(e), "product": e.product_id, "available": e.available}, status=409)
+
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
@@ -278,34 +400,69 @@ class CreateOrderView(APIView):
 class VerifyPaymentView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request):
+        from razorpay.errors import SignatureVerificationError
+
         data = request.data
         try:
-            client.utility.verify_payment_signature({
+            razorpay_client().utility.verify_payment_signature({
                 "razorpay_order_id": data.get('razorpay_order_id'),
                 "razorpay_payment_id": data.get('razorpay_payment_id'),
                 "razorpay_signature": data.get('razorpay_signature'),
             })
 
-            order = Order.objects.get(id=data.get('order_id'))
-            order.status = "completed"
-            order.razorpay_payment_id = data.get('razorpay_payment_id')
-            order.save()
-
+            with transaction.atomic():
+                order = Order.objects.select_for_update().get(id=data.get('order_id'))
+                if order.razorpay_order_id != data.get('razorpay_order_id'):
+                    return Response({"error": "Payment is not for this order"}, status=400)
+                outcome = complete_payment(order, data.get('razorpay_payment_id'))
+
+            if outcome == SOLD_OUT:
+                refund_payment(order.razorpay_payment_id)
+                return Response(
+                    {"error": "The order expired and an item has sold out since; the payment will be refunded"},
+                    status=409,
+                )
+            if outcome == STALE:
+                return Response({"error": f"Order is {order.status}, payment not applied"}, status=409)
             return Response({"message": "Payment verified successfully"})
 
-        except razorpay.errors.SignatureVerificationError:
+        except SignatureVerificationError:
             return Response({"error": "Invalid signature"}, status=400)
 
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
 
+class RazorpayWebhookView(APIView):
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        body = request.body
+        if not verify_webhook_signature(body, request.headers.get('X-Razorpay-Signature')):
+            return Response({"error": "Invalid signature"}, status=400)
+        try:
+            event = parse_event(body, request.headers.get('X-Razorpay-Event-Id'))
+        except (ValueError, TypeError):
+            return Response({"error": "Invalid payload"}, status=400)
+        # Razorpay retries deliveries, so duplicates are dropped on the unique event id.
+        PaymentEvent.objects.bulk_create([event], ignore_conflicts=True)
+        return Response({"status": "ok"})
+
+
 class OrderListView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
+        """Orders of the last ``?months=`` calendar months, ``ORDER_HISTORY_MONTHS`` by default."""
+        months = request.GET.get('months')
+        if months is not None and (not months.isdigit() or int(months) < 1):
+            return Response({'error': 'months must be a positive integer'}, status=400)
         orders = Order.objects.all() if request.user.role == 'admin' else Order.objects.filter(user=request.user)
+        orders = orders.filter(created_at__gte=history_start(months and int(months)))
+        orders = prune_queryset(orders, OrderSerializer, request)
         serializer = OrderSerializer(orders, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -316,8 +473,7 @@ class AdminStatsView(APIView):
     def get(self, request):
         total_users = User.objects.filter(role='user').count()
         total_products = Product.objects.count()
-        total_orders = Order.objects.count()
-        total_revenue = Order.objects.filter(status='completed').aggregate(total=Sum('total'))['total'] or 0
+        total_orders, total_revenue = order_totals()
         return Response({
             'total_users': total_users,
             'total_products': total_products,
@@ -326,6 +482,22 @@ class AdminStatsView(APIView):
         })
 
 
+class AdminRevenueView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        granularity = request.GET.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return Response({'error': f"granularity must be one of {', '.join(GRANULARITIES)}"}, status=400)
+        try:
+            start = parse_when(request.GET.get('start'))
+            end = parse_when(request.GET.get('end'), end=True)
+            buckets = revenue_series(granularity, start, end)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response({'granularity': granularity, 'buckets': buckets})
+
+
 class AdminUserListView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
@@ -334,12 +506,34 @@ class AdminUserListView(APIView):
         serializer = UserSerializer(users, many=True, context={'request': request})
         return Response(serializer.data)
 
+    def patch(self, request):
+        """Block or unblock many users: ``ids`` or ``filter``, and ``is_active``."""
+        try:
+            users, ids = bulk.targets(User.objects.filter(role='user'), request.data, bulk.filter_users, bulk.USER_FILTERS)
+            matched, updated = bulk.set_users_active(users, request.data.get('is_active'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(bulk.summary(ids, matched, updated))
+
+
+class AdminProductListView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def patch(self, request):
+        """Activate or deactivate many products: ``ids`` or ``filter``, and ``active``."""
+        try:
+            products, ids = bulk.targets(Product.objects.all(), request.data, bulk.filter_products, bulk.PRODUCT_FILTERS)
+            matched, updated = bulk.set_products_active(products, request.data.get('active'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(bulk.summary(ids, matched, updated))
+
 
-class AdminProductView(APIView):
+class AdminProductView(ImageUploadMixin, APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def put(self, request, pk):
-        product = get_object_or_404(Product, id=pk)
+        product = get_object_or_404(Product, id=pk, archived_at__isnull=True)
         serializer = ProductSerializer(product, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
             serializer.save()
@@ -347,36 +541,288 @@ class AdminProductView(APIView):
         return Response(serializer.errors, status=400)
 
     def delete(self, request, pk):
-        product = get_object_or_404(Product, id=pk)
-        product.delete()
+        # Archived, not deleted: order history keeps the product and nothing cascades.
+        if not archive_products([pk]):
+            raise Http404
         return Response({'message': 'Product deleted successfully'})
 
 
+class AdminProductStockView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request, pk):
+        product = get_object_or_404(Product, id=pk)
+        return Response(stock_levels(product.id))
+
+    def put(self, request, pk):
+        product = get_object_or_404(Product, id=pk)
+        quantity = request.data.get('quantity')
+        try:
+            quantity = None if quantity is None else int(quantity)
+            shards = int(request.data.get('shards', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'quantity and shards must be integers'}, status=400)
+        if (quantity is not None and quantity < 0) or not 1 <= shards <= 64:
+            return Response({'error': 'quantity must be >= 0 and shards between 1 and 64'}, status=400)
+        set_stock(product.id, quantity, shards)
+        return Response(stock_levels(product.id))
+
+
 class AdminOrderListView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        orders = Order.objects.all().order_by('-created_at')
+        try:
+            orders = filter_orders(Order.objects.all(), request.GET)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        orders = prune_queryset(orders, OrderSerializer, request).order_by('-created_at')
         serializer = OrderSerializer(orders, many=True, context={'request': request})
         return Response(serializer.data)
 
+    def patch(self, request):
+        """Move many orders to ``status``: ``ids``, or a ``filter`` of the list parameters."""
+        try:
+            orders, ids = bulk.targets(Order.objects.all(), request.data, bulk.filter_order_params, bulk.ORDER_FILTERS)
+            matched, updated = bulk.set_order_status(orders, request.data.get('status'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(bulk.summary(ids, matched, updated))
+
 
 class AdminOrderStatusUpdateView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def patch(self, request, pk):
-        order = get_object_or_404(Order, id=pk)
         new_status = request.data.get('status')
         if new_status not in dict(Order.STATUS_CHOICES):
             return Response({'error': 'Invalid status'}, status=400)
-        order.status = new_status
-        order.save()
+        with transaction.atomic():
+            order = get_object_or_404(Order.objects.select_for_update(), id=pk)
+            previous = order.status
+            if previous in Order.FINAL_STATUSES and new_status != previous:
+                return Response({'error': f'Order is {previous} and cannot change status'}, status=400)
+            order.status = new_status
+            order.save()
+            record_sales([order], sales_sign(previous, new_status))
+            settle([order])
+            if previous != new_status:
+                record_status_changes([order])
         return Response(OrderSerializer(order, context={'request': request}).data)
 
 class AdminOrderDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def delete(self, request, pk):
-        order = get_object_or_404(Order, id=pk)
-        order.delete()
+        with transaction.atomic():
+            order = get_object_or_404(Order.objects.select_for_update(), id=pk)
+            release([order.pk])
+            order.delete()
         return Response({'message': 'Order deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
+
+
+class AdminCatalogImportView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def post(self, request):
+        from .catalog_import import guess_format, import_catalog, read_rows
+
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'Catalog file required'}, status=400)
+        fmt = request.data.get('format') or guess_format(upload.name)
+        try:
+            rows = read_rows(upload, fmt)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        images = request.FILES.get('images')
+        archive_path = None
+        try:
+            if images:
+                if hasattr(images, 'temporary_file_path'):
+                    archive_path = images.temporary_file_path()
+                else:
+                    with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp:
+                        for chunk in images.chunks():
+                            tmp.write(chunk)
+                    archive_path = tmp.name
+            # No process pool inside a web worker; the import command runs images in parallel.
+            report = import_catalog(rows, image_archive=archive_path, workers=1)
+        finally:
+            if archive_path and not hasattr(images, 'temporary_file_path'):
+                os.unlink(archive_path)
+        return Response(report.as_dict())
+
+
+class AdminImageUploadView(APIView):
+    """Start a resumable image upload for a product or category.
+
+    Send the file to the returned upload in pieces with ``PATCH`` and a
+    ``Content-Range: bytes <first>-<last>/<size>`` header. After an error,
+    ``GET`` the upload for the offset to continue from.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def post(self, request):
+        try:
+            object_id = int(request.data.get('object_id'))
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'object_id and size must be integers'}, status=400)
+        try:
+            upload = start_upload(
+                request.user, request.data.get('kind'), object_id, request.data.get('filename') or 'image', size,
+            )
+        except UploadRejected as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        state = upload_state(upload, request)
+        state['chunk_size'] = settings.IMAGE_UPLOAD_CHUNK_BYTES
+        return Response(state, status=status.HTTP_201_CREATED)
+
+
+class AdminImageUploadDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request, pk):
+        return Response(upload_state(get_object_or_404(ImageUpload, pk=pk), request))
+
+    def patch(self, request, pk):
+        upload = get_object_or_404(ImageUpload, pk=pk)
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', request.headers.get('Content-Range', ''))
+        if not match:
+            return Response({'error': 'Content-Range: bytes <first>-<last>/<size> required'}, status=400)
+        first, last, size = map(int, match.groups())
+        if last < first or size != upload.size:
+            return Response({'error': 'Content-Range does not fit this upload'}, status=400)
+        if int(request.headers.get('Content-Length') or 0) != last - first + 1:
+            return Response({'error': 'Content-Length must match Content-Range'}, status=400)
+        try:
+            write_chunk(upload, first, last - first + 1, request.stream)
+        except UploadRejected as e:
+            return Response({**upload_state(upload, request), 'error': str(e)}, status=e.status_code)
+        return Response(upload_state(upload, request))
+
+    def delete(self, request, pk):
+        get_object_or_404(ImageUpload, pk=pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+PROFILE_SUMMARY_FIELDS = (
+    'id', 'user_id', 'method', 'path', 'status_code', 'duration_ms',
+    'sql_count', 'sql_ms', 'serializer_ms', 'samples', 'created_at',
+)
+
+
+class AdminCacheStatsView(APIView):
+    """Tiered cache counters of the worker that serves the request."""
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        return Response(tiered_cache.metrics())
+
+
+class AdminProfileTokenView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def post(self, request):
+        return Response({
+            'token': profiling.make_token(request.user),
+            'header': profiling.PROFILE_HEADER,
+            'param': profiling.PROFILE_PARAM,
+            'expires_in': settings.REQUEST_PROFILE_TOKEN_MAX_AGE,
+        }, status=status.HTTP_201_CREATED)
+
+
+class AdminProfileListView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        profiles = RequestProfile.objects.order_by('-id').values(*PROFILE_SUMMARY_FIELDS)
+        return Response(list(profiles))
+
+
+class AdminProfileDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request, pk):
+        profile = get_object_or_404(RequestProfile.objects.values(*PROFILE_SUMMARY_FIELDS, 'queries'), id=pk)
+        return Response(profile)
+
+    def delete(self, request, pk):
+        get_object_or_404(RequestProfile, id=pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AdminProfileStacksView(APIView):
+    """The profile's stacks as a folded file for flamegraph.pl or speedscope."""
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request, pk):
+        profile = get_object_or_404(RequestProfile.objects.only('stacks'), id=pk)
+        response = HttpResponse(profile.stacks, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{pk}.folded"'
+        return response
+
+
+def serve_media(request, path):
+    """Serve an uploaded file with far-future caching.
+
+    With MEDIA_OFFLOAD set, Django only validates the path and hands the
+    transfer to the web server through X-Accel-Redirect or X-Sendfile.
+    """
+    if settings.MEDIA_OFFLOAD:
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise Http404
+        if not os.path.isfile(full_path):
+            raise Http404
+        response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+        if settings.MEDIA_OFFLOAD == 'x-accel':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + path.lstrip('/')
+        else:
+            response['X-Sendfile'] = full_path
+    else:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    # Stored names are content hashes, so a URL never points at different bytes.
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE, immutable=True)
+    return response
+
+
+def _stream_user(request):
+    # EventSource cannot send headers, so the access token may also come as ?token=.
+    auth = JWTAuthentication()
+    try:
+        token = request.GET.get('token')
+        if token:
+            return auth.get_user(auth.get_validated_token(token))
+        result = auth.authenticate(request)
+        return result[0] if result else None
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def order_events_stream(request):
+    """Server-sent stream of the user's order status changes.
+
+    Resumes after ``Last-Event-ID`` (or ``?last_event_id=``) when given,
+    otherwise starts with changes made from now on. Serve it from the ASGI
+    application; under WSGI every open stream ties up a worker thread.
+    """
+    user = await db_call(_stream_user)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if last_id:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+    else:
+        last_id = await db_call(latest_event_id)(user.pk)
+
+    response = StreamingHttpResponse(event_stream(user.pk, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,98 @@
+"""Per-process warm-up, run before a worker reports itself ready."""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.urls import get_resolver
+
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_lock = threading.Lock()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def _open_connections():
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def _load_urls():
+    # Imports every view module and compiles the URL patterns.
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+
+
+def _build_serializers():
+    from .serializers import (
+        CartSerializer, CategorySerializer, OrderSerializer, ProductSerializer, UserSerializer,
+        WishlistSerializer,
+    )
+    for serializer_class in (
+        UserSerializer, CategorySerializer, ProductSerializer, CartSerializer, WishlistSerializer, OrderSerializer,
+    ):
+        serializer_class().fields
+
+
+def _prime_caches():
+    from django.contrib.contenttypes.models import ContentType
+    from .catalog import get_catalog_version
+    from .models import Category, Product
+
+    ContentType.objects.get_for_models(Category, Product)
+    get_catalog_version()
+    list(Category.objects.values_list('id', flat=True)[:1])
+    list(Product.objects.filter(active=True).values_list('id', flat=True)[:1])
+
+
+STEPS = [
+    ('database', _open_connections),
+    ('urls', _load_urls),
+    ('serializers', _build_serializers),
+    ('caches', _prime_caches),
+]
+
+
+def warm_up():
+    """Run every warm-up step once per process and mark the process ready.
+
+    Returns ``{step: seconds}`` for the steps that ran.
+    """
+    timings = {}
+    with _lock:
+        if _ready.is_set():
+            return timings
+        for name, step in STEPS:
+            start = time.perf_counter()
+            step()
+            timings[name] = time.perf_counter() - start
+        _ready.set()
+    return timings
+
+
+def warm_up_on_start():
+    """Warm up while the WSGI/ASGI module is imported.
+
+    A failure is logged rather than raised, so a worker still starts while
+    the database or cache is down; readiness retries the warm-up and answers
+    503 until it succeeds. The connections it opened are closed again: under
+    ``gunicorn --preload`` this runs in the master, and forked workers must
+    not share its sockets. Each worker reconnects on first use.
+    """
+    if not settings.WARMUP_ON_START:
+        return
+    try:
+        warm_up()
+    except Exception:
+        logger.exception("Warm-up failed; readiness will retry it")
+    finally:
+        connections.close_all()
+        caches.close_all()
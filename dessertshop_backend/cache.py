@@ -0,0 +1,351 @@
+"""Two-tier cache: a bounded in-process LRU in front of the shared cache.
+
+Values are read from the local LRU first, then from the shared cache
+(``TIERED_CACHE_ALIAS``, Redis in production, in-memory in development and
+tests) and only computed when both miss. Local copies live at most
+``TIERED_CACHE_LOCAL_SECONDS``, which bounds how long another worker's
+invalidation takes to reach this one.
+
+- Tags: an entry records the version of each of its tags when it was
+  computed; ``invalidate_tags`` gives the tags new versions, so every
+  entry carrying them misses from then on.
+- Single flight: the first thread of a process to miss a key leads; the
+  process's other threads wait on its flight without holding any lock.
+  Leaders of different processes take a lock in the shared cache, so one
+  worker computes while the others poll for its result.
+- Stale-while-revalidate: for ``stale_ttl`` seconds past ``ttl`` the old
+  value is served while one background refresh computes a new one.
+- Values are computed on the primary: invalidations follow committed
+  writes, and a lagging replica would cache the old rows under the new
+  tag versions.
+
+Cached values are shared between requests and must not be mutated.
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connections
+from django.http import HttpRequest, QueryDict
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .db_router import primary
+
+
+logger = logging.getLogger(__name__)
+
+WAIT_POLL_SECONDS = 0.05
+
+
+class Entry:
+    __slots__ = ('value', 'fresh_until', 'stale_until', 'tags', 'local_until')
+
+    def __init__(self, value, fresh_until, stale_until, tags, local_until=0.0):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.tags = tags
+        self.local_until = local_until
+
+
+class LocalLRU:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.local_until <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TIERED_CACHE_LOCAL_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def drop_tags(self, tags):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if not tags.isdisjoint(entry.tags)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Flight:
+    """One thread's computation of a key that the process's other threads wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value = None
+
+
+def _tag_key(tag):
+    return f'cache:tag:{tag}'
+
+
+class TieredCache:
+    def __init__(self):
+        self.local = LocalLRU()
+        self.flights = {}
+        self.flights_lock = threading.Lock()
+        self.counts = defaultdict(Counter)
+        self.counts_lock = threading.Lock()
+        self.refreshing = set()
+        self.refreshing_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+    @property
+    def shared(self):
+        return caches[settings.TIERED_CACHE_ALIAS]
+
+    def count(self, name, metric):
+        with self.counts_lock:
+            self.counts[name][metric] += 1
+
+    def metrics(self):
+        """This process's counters, per cache name and in total."""
+        with self.counts_lock:
+            by_name = {name: dict(counts) for name, counts in self.counts.items()}
+        total = Counter()
+        for counts in by_name.values():
+            total.update(counts)
+        return {'local_entries': len(self.local), 'total': dict(total), 'by_name': by_name}
+
+    def _shared_call(self, name, method, *args):
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception:
+            # A shared cache outage degrades to computing, not to errors.
+            logger.exception("Shared cache %s failed", method)
+            self.count(name, 'shared_errors')
+            return None
+
+    def _tag_versions(self, name, tags, found):
+        """Current version of each tag, giving missing tags a fresh one."""
+        versions = {tag: found.get(_tag_key(tag)) for tag in tags}
+        for tag, version in versions.items():
+            if version is None:
+                self._shared_call(name, 'add', _tag_key(tag), uuid.uuid4().hex, None)
+                versions[tag] = self._shared_call(name, 'get', _tag_key(tag))
+        return versions
+
+    def _read_shared(self, name, key, tags):
+        """``(entry, tag versions)``; the entry is None unless it is current for its tags."""
+        found = self._shared_call(name, 'get_many', [key, *map(_tag_key, tags)]) or {}
+        versions = self._tag_versions(name, tags, found)
+        stored = found.get(key)
+        if stored is None:
+            return None, versions
+        value, fresh_until, stale_until, entry_tags = stored
+        if entry_tags != versions:
+            return None, versions
+        return Entry(value, fresh_until, stale_until, entry_tags), versions
+
+    def _keep_local(self, key, entry, now):
+        entry.local_until = min(now + settings.TIERED_CACHE_LOCAL_SECONDS, entry.stale_until)
+        self.local.set(key, entry)
+
+    def _fill(self, name, key, compute, ttl, tags, stale_ttl, versions):
+        with primary():
+            value = compute()
+        now = time.time()
+        entry = Entry(value, now + ttl, now + ttl + stale_ttl, versions)
+        self._shared_call(name, 'set', key, (value, entry.fresh_until, entry.stale_until, versions), ttl + stale_ttl)
+        self._keep_local(key, entry, now)
+        self.count(name, 'computes')
+        return value
+
+    def get_or_set(self, key, compute, ttl, tags=(), stale_ttl=0, name=None):
+        """The cached value for ``key``, calling ``compute()`` on a miss."""
+        name = name or key.split(':', 1)[0]
+        tags = tuple(tags)
+        now = time.time()
+
+        entry = self.local.get(key, now)
+        if entry is None:
+            entry, versions = self._read_shared(name, key, tags)
+            if entry is not None:
+                self._keep_local(key, entry, now)
+                self.count(name, 'shared_hits' if entry.fresh_until > now else 'stale_hits')
+        else:
+            self.count(name, 'local_hits' if entry.fresh_until > now else 'stale_hits')
+        if entry is not None:
+            if entry.fresh_until <= now:
+                self._refresh_later(name, key, compute, ttl, tags, stale_ttl)
+            return entry.value
+
+        self.count(name, 'misses')
+        return self._compute_once(name, key, compute, ttl, tags, stale_ttl, versions)
+
+    def _compute_once(self, name, key, compute, ttl, tags, stale_ttl, versions):
+        with self.flights_lock:
+            flight = self.flights.get(key)
+            leading = flight is None
+            if leading:
+                flight = self.flights[key] = Flight()
+        if not leading:
+            self.count(name, 'waits')
+            if flight.done.wait(settings.TIERED_CACHE_LOCK_SECONDS) and flight.ok:
+                return flight.value
+            # The leader failed or is stuck; compute rather than keep waiting.
+            self.count(name, 'lock_timeouts')
+            return self._fill(name, key, compute, ttl, tags, stale_ttl, versions)
+        try:
+            flight.value = self._lead(name, key, compute, ttl, tags, stale_ttl, versions)
+            flight.ok = True
+            return flight.value
+        finally:
+            with self.flights_lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def _lead(self, name, key, compute, ttl, tags, stale_ttl, versions):
+        # A flight that just landed may have filled it meanwhile.
+        entry = self.local.get(key, time.time())
+        if entry is not None and entry.fresh_until > time.time():
+            return entry.value
+        lock_key = f'{key}:lock'
+        if self._shared_call(name, 'add', lock_key, 1, settings.TIERED_CACHE_LOCK_SECONDS) is not False:
+            try:
+                return self._fill(name, key, compute, ttl, tags, stale_ttl, versions)
+            finally:
+                self._shared_call(name, 'delete', lock_key)
+
+        # Another worker is computing it; wait for its result.
+        self.count(name, 'waits')
+        deadline = time.time() + settings.TIERED_CACHE_LOCK_SECONDS
+        while time.time() < deadline:
+            time.sleep(WAIT_POLL_SECONDS)
+            entry, versions = self._read_shared(name, key, tags)
+            if entry is not None:
+                self._keep_local(key, entry, time.time())
+                return entry.value
+        self.count(name, 'lock_timeouts')
+        return self._fill(name, key, compute, ttl, tags, stale_ttl, versions)
+
+    def _refresh_later(self, name, key, compute, ttl, tags, stale_ttl):
+        with self.refreshing_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        self.executor.submit(self._refresh, name, key, compute, ttl, tags, stale_ttl)
+
+    def _refresh(self, name, key, compute, ttl, tags, stale_ttl):
+        lock_key = f'{key}:lock'
+        close_old_connections()
+        try:
+            if self._shared_call(name, 'add', lock_key, 1, settings.TIERED_CACHE_LOCK_SECONDS) is False:
+                return
+            try:
+                _, versions = self._read_shared(name, key, tags)
+                self._fill(name, key, compute, ttl, tags, stale_ttl, versions)
+                self.count(name, 'refreshes')
+            finally:
+                self._shared_call(name, 'delete', lock_key)
+        except Exception:
+            logger.exception("Background refresh of %s failed", key)
+            self.count(name, 'refresh_errors')
+        finally:
+            with self.refreshing_lock:
+                self.refreshing.discard(key)
+            connections.close_all()
+
+    def delete(self, key):
+        self.local.delete(key)
+        self._shared_call(key.split(':', 1)[0], 'delete', key)
+
+    def invalidate_tags(self, *tags):
+        """Make every entry carrying any of ``tags`` miss, in every process."""
+        self.local.drop_tags(set(tags))
+        self._shared_call('tags', 'set_many', {_tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+tiered_cache = TieredCache()
+
+
+def invalidate_tags(*tags):
+    tiered_cache.invalidate_tags(*tags)
+
+
+class _Uncached(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class _KeyRequest(HttpRequest):
+    """An anonymous GET carrying only what a cache_response key is made of."""
+
+    def __init__(self, scheme, host, path, query):
+        super().__init__()
+        self.method = 'GET'
+        self.path = self.path_info = path
+        self.META = {'REQUEST_METHOD': 'GET', 'HTTP_HOST': host, 'QUERY_STRING': urlencode(query, doseq=True)}
+        self.GET = QueryDict(mutable=True)
+        for param, values in query:
+            self.GET.setlist(param, values)
+        self.GET._mutable = False
+        self._scheme = scheme
+
+    def _get_scheme(self):
+        return self._scheme
+
+
+def cache_response(ttl, tags=(), stale_ttl=0, postprocess=None):
+    """Cache the data of an APIView GET handler's 200 responses by URL.
+
+    The handler's output must not depend on the user; per-user additions go
+    in ``postprocess(data, request)``, which runs on every request. The
+    handler itself runs on an anonymous request rebuilt from the URL, so
+    background refreshes never touch a request that has already finished.
+    """
+    def decorator(method):
+        name = f'{method.__module__}.{method.__qualname__}'
+
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            inputs = (request.scheme, request.get_host(), request.path, sorted(request.GET.lists()))
+
+            def compute():
+                replay = view.__class__()
+                replay.request = Request(_KeyRequest(*inputs), authenticators=())
+                replay.args, replay.kwargs, replay.format_kwarg = args, kwargs, None
+                response = method(replay, replay.request, *args, **kwargs)
+                if response.status_code != 200:
+                    raise _Uncached(response)
+                return response.data
+
+            digest = hashlib.sha1(repr((inputs, args, kwargs)).encode()).hexdigest()
+            try:
+                data = tiered_cache.get_or_set(f'{name}:{digest}', compute, ttl, tags, stale_ttl)
+            except _Uncached as e:
+                return e.response
+            return Response(postprocess(data, request) if postprocess else data)
+        return wrapper
+    return decorator
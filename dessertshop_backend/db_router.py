@@ -0,0 +1,161 @@
+"""Primary/replica database routing with read-your-writes stickiness.
+
+Reads go to a weighted random replica from ``DATABASE_REPLICA_WEIGHTS``;
+writes, transactions and anything after a write in the same request go to
+``default``. After a user writes, their reads stay on the primary for
+``READ_YOUR_WRITES_SECONDS`` so they never see replication lag. That pin
+lives in the default cache, which must be shared by every worker.
+
+Outside a request (management commands, workers, background threads) a
+write does not pin anything; wrap code that must read its own writes, or
+that acts on what it reads, in ``primary()``. The worker commands run
+their whole ``handle`` under it.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+
+_pinned = ContextVar('db_pinned_to_primary', default=False)
+# None outside a request, else whether the request has written.
+_wrote = ContextVar('db_wrote_in_request', default=None)
+
+PRIMARY = 'default'
+UNSAFE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+# Caches that are not shared between processes.
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+@contextmanager
+def primary():
+    """Send every query in the block (or decorated function) to the primary."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        weights = getattr(settings, 'DATABASE_REPLICA_WEIGHTS', {})
+        self.replicas = [alias for alias, weight in weights.items() if weight > 0]
+        self.weights = [weights[alias] for alias in self.replicas]
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or _pinned.get() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return random.choices(self.replicas, weights=self.weights)[0]
+
+    def db_for_write(self, model, **hints):
+        # Only a request has a scope to pin; the middleware resets it.
+        if _wrote.get() is not None:
+            _pinned.set(True)
+            _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def _pin_key(user_id):
+    return f'db:primary-pin:{user_id}'
+
+
+def _session_user_id(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def _token_user_id(request):
+    header = request.headers.get('Authorization', '')
+    parts = header.split()
+    if len(parts) != 2 or parts[0] not in settings.SIMPLE_JWT['AUTH_HEADER_TYPES']:
+        return None
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.tokens import AccessToken
+    try:
+        return AccessToken(parts[1]).get(settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id'))
+    except TokenError:
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Scope routing state to the request and keep recent writers on the primary."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = bool(getattr(settings, 'DATABASE_REPLICA_WEIGHTS', {}))
+        if self.enabled and isinstance(caches['default'], LOCAL_CACHES):
+            # A pin set by one worker must be seen by the next request on any other.
+            raise ImproperlyConfigured(
+                "Database replicas need a cache shared by all workers for read-your-writes; set REDIS_URL"
+            )
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        # API requests carry a token; admin pages a session user.
+        user_id = _token_user_id(request) or _session_user_id(getattr(request, 'user', None))
+        pinned = request.method in UNSAFE_METHODS or (
+            user_id is not None and cache.get(_pin_key(user_id)) is not None
+        )
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                writer_id = _writer_id(getattr(request, 'user', None), user_id)
+                if writer_id is not None:
+                    cache.set(_pin_key(writer_id), 1, settings.READ_YOUR_WRITES_SECONDS)
+            return response
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        user_id = _token_user_id(request)
+        if user_id is None and hasattr(request, 'auser'):
+            user_id = _session_user_id(await request.auser())
+        pinned = request.method in UNSAFE_METHODS or (
+            user_id is not None and await cache.aget(_pin_key(user_id)) is not None
+        )
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = await self.get_response(request)
+            if _wrote.get():
+                user = await request.auser() if hasattr(request, 'auser') else None
+                writer_id = _writer_id(user, user_id)
+                if writer_id is not None:
+                    await cache.aset(_pin_key(writer_id), 1, settings.READ_YOUR_WRITES_SECONDS)
+            return response
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+
+
+def _writer_id(user, user_id):
+    return user.pk if user is not None and user.is_authenticated else user_id
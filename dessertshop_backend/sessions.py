@@ -0,0 +1,43 @@
+"""Session machinery for the admin only.
+
+The API authenticates every request with a JWT, so ``/api/`` requests get
+no session: nothing is read from or written to django_session for them.
+Until DRF authenticates the request, ``request.user`` is anonymous.
+"""
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+
+
+API_PREFIX = '/api/'
+
+
+async def _anonymous():
+    return AnonymousUser()
+
+
+class SessionMiddleware(sessions_middleware.SessionMiddleware):
+    def process_request(self, request):
+        if not request.path_info.startswith(API_PREFIX):
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if not hasattr(request, 'session'):
+            return response
+        return super().process_response(request, response)
+
+
+class AuthenticationMiddleware(auth_middleware.AuthenticationMiddleware):
+    def process_request(self, request):
+        if hasattr(request, 'session'):
+            return super().process_request(request)
+        request.user = AnonymousUser()
+        request.auser = _anonymous
+
+
+class MessageMiddleware(messages_middleware.MessageMiddleware):
+    # The default storage falls back to the session, which API requests lack.
+    def process_request(self, request):
+        if hasattr(request, 'session'):
+            super().process_request(request)
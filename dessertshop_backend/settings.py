@@ -9,10 +9,12 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import json
 import os
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,15 +47,18 @@ INSTALLED_APPS = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-profile')
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
+    'api.profiling.RequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'dessertshop_backend.sessions.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'dessertshop_backend.sessions.AuthenticationMiddleware',
+    'dessertshop_backend.db_router.ReadYourWritesMiddleware',
+    'dessertshop_backend.sessions.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -90,9 +95,44 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
         }
 }
 
+# Read replicas, as a JSON list of overrides of the default connection, e.g.
+# [{"HOST": "replica-1", "WEIGHT": 3}, {"HOST": "replica-2"}]. Reads are
+# spread by WEIGHT; a user's reads stick to the primary for
+# READ_YOUR_WRITES_SECONDS after they write.
+DATABASE_REPLICA_WEIGHTS = {}
+for index, replica in enumerate(json.loads(os.getenv('DB_REPLICAS') or '[]'), start=1):
+    alias = f'replica{index}'
+    DATABASE_REPLICA_WEIGHTS[alias] = replica.pop('WEIGHT', 1)
+    DATABASES[alias] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['dessertshop_backend.db_router.PrimaryReplicaRouter']
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+
+# Cache shared by all workers. Without REDIS_URL every process gets its own
+# in-memory cache, which is only suitable for development and tests; it is
+# refused when DB_REPLICAS is set, as read-your-writes pins live in it.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# dessertshop_backend.cache: the shared tier, the size of each process's
+# local tier, how long a local copy may outlive an invalidation made by
+# another worker, and how long a miss may hold the recompute lock.
+TIERED_CACHE_ALIAS = 'default'
+TIERED_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv('TIERED_CACHE_LOCAL_MAX_ENTRIES', '2048'))
+TIERED_CACHE_LOCAL_SECONDS = 5
+TIERED_CACHE_LOCK_SECONDS = 10
+
+# Run api.warmup in each WSGI/ASGI worker before it reports ready.
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'True') == 'True'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -150,14 +190,118 @@ SIMPLE_JWT = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded media is stored under content-hashed names and served with
+# far-future cache headers. MEDIA_STORAGE=object-store writes to a local
+# bucket stand-in served from OBJECT_STORE_ENDPOINT_URL instead.
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'filesystem')
+OBJECT_STORE_ENDPOINT_URL = os.getenv('OBJECT_STORE_ENDPOINT_URL', 'http://localhost:9000')
+OBJECT_STORE_BUCKET = os.getenv('OBJECT_STORE_BUCKET', 'media')
+OBJECT_STORE_ROOT = os.getenv('OBJECT_STORE_ROOT', os.path.join(BASE_DIR, 'object-store'))
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.LocalObjectStorage' if MEDIA_STORAGE == 'object-store'
+        else 'api.storage.HashedFileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Set to 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd) so Django only
+# checks the path and the web server sends the file. For nginx, map
+# MEDIA_ACCEL_PREFIX to MEDIA_ROOT with an `internal` location.
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Product and category image uploads, see api.uploads. IMAGE_UPLOAD_DIR
+# holds files until `manage.py process_image_uploads` has stored them and
+# must be shared by the web workers and that worker.
+IMAGE_UPLOAD_DIR = os.getenv('IMAGE_UPLOAD_DIR', os.path.join(BASE_DIR, 'uploads'))
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv('IMAGE_UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+IMAGE_UPLOAD_CHUNK_BYTES = 5 * 1024 * 1024
+IMAGE_MAX_DIMENSION = 12000
+IMAGE_MAX_PIXELS = 50_000_000
+# Stored images are scaled down to fit this many pixels a side.
+IMAGE_STORED_MAX_DIMENSION = int(os.getenv('IMAGE_STORED_MAX_DIMENSION', '2048'))
+
+ORDER_ARCHIVE_DIR = os.getenv('ORDER_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'orders'))
+# The order list and a user's totalSpent cover the current month and the
+# months before it, up to this many in all, so they read that many order
+# partitions however long the history grows. ?months= changes the list's.
+ORDER_HISTORY_MONTHS = int(os.getenv('ORDER_HISTORY_MONTHS', '12'))
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:5173",
     
 ]
 
+# Admin revenue series: how long a closed bucket stays cached (orders that
+# change also drop it), and the most buckets one request may ask for.
+REVENUE_CACHE_SECONDS = int(os.getenv('REVENUE_CACHE_SECONDS', str(24 * 60 * 60)))
+REVENUE_MAX_BUCKETS = int(os.getenv('REVENUE_MAX_BUCKETS', '400'))
+
+# A webhook can arrive before its order row is committed. Such events are
+# retried after RETRY_BASE, doubling each time, and given up after MAX_ATTEMPTS.
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_EVENT_MAX_ATTEMPTS', '8'))
+PAYMENT_EVENT_RETRY_BASE = timedelta(seconds=int(os.getenv('PAYMENT_EVENT_RETRY_BASE_SECONDS', '5')))
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24')))
+IDEMPOTENCY_WAIT_SECONDS = 5
+# A key still without a response this long after it was claimed belongs to a
+# request that died; a retry with the same key then runs again. Keep it above
+# the longest request time.
+IDEMPOTENCY_LEASE = timedelta(seconds=int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60')))
+
+# Policies run by `manage.py apply_retention` (see api.retention), with
+# their windows in days. Policies left out of this dict never run.
+RETENTION_POLICIES = {
+    'abandoned_carts': {'days': int(os.getenv('CART_RETENTION_DAYS', '60'))},
+    'expired_sessions': {},
+    'inactive_wishlists': {'days': int(os.getenv('ARCHIVED_WISHLIST_RETENTION_DAYS', '30'))},
+    'order_status_events': {'days': int(os.getenv('ORDER_EVENT_RETENTION_DAYS', '90'))},
+    'stock_reservations': {'days': 30},
+    'image_uploads': {'days': 7},
+}
+
+# Per-user wishlist/cart product ids behind is_wishlisted and cart_quantity.
+# Invalidated on every wishlist or cart change, so this only bounds memory.
+MEMBERSHIP_CACHE_SECONDS = 24 * 60 * 60
+
+# Most changed rows of each kind returned per GET /api/catalog/changes/ page.
+CATALOG_CHANGES_PAGE_SIZE = int(os.getenv('CATALOG_CHANGES_PAGE_SIZE', '500'))
+
+# Order status stream (GET /api/orders/events/, needs an ASGI server).
+# 'local' only wakes streams in the process that made the change; use
+# 'postgres' (LISTEN/NOTIFY) whenever more than one worker serves traffic.
+ORDER_EVENTS_BACKEND = os.getenv('ORDER_EVENTS_BACKEND', 'local')
+ORDER_EVENTS_HEARTBEAT_SECONDS = 15
+
+# How long checkout holds stock for an unpaid order before the sweeper
+# (release_stock_reservations) cancels the order and returns the stock.
+STOCK_RESERVATION_TTL = timedelta(minutes=int(os.getenv('STOCK_RESERVATION_TTL_MINUTES', '15')))
+
+# Admin-triggered profiling of single requests (api.profiling): send a token
+# from POST /api/admin/profiles/token/ in the X-Profile header. Off means
+# the middleware is not installed at all.
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'True') == 'True'
+REQUEST_PROFILE_TOKEN_MAX_AGE = 60 * 60
+REQUEST_PROFILE_INTERVAL = 0.001
+# Only the most recent profiles are kept.
+REQUEST_PROFILE_KEEP = int(os.getenv('REQUEST_PROFILE_KEEP', '200'))
+
+# Django admin changelists show the planner's row estimate instead of
+# running COUNT(*) when it expects at least this many rows.
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Most rows one bulk admin update (api.bulk) may change.
+ADMIN_BULK_MAX_ROWS = int(os.getenv('ADMIN_BULK_MAX_ROWS', '5000'))
+
 RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET')
+RAZORPAY_WEBHOOK_SECRET = os.getenv('RAZORPAY_WEBHOOK_SECRET')
 
 
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dessertshop_backend.settings')
 
 application = get_wsgi_application()
+
+# Warm up before the worker reports ready. Failures are logged, not raised,
+# and /api/health/ready/ answers 503 and retries until the warm-up succeeds.
+from api.warmup import warm_up_on_start  # noqa: E402
+warm_up_on_start()